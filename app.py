@@ -6,6 +6,7 @@ import threading
 import time
 from flask import Flask, jsonify
 from main import main as run_bot
+from utils.metrics import metrics
 import logging
 import os
 
@@ -42,6 +43,11 @@ def status():
     """Детальный статус бота"""
     return jsonify(bot_status)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики бота (загрузка Gemini, задержки и т.д.)"""
+    return jsonify(metrics.snapshot())
+
 def run_flask():
     """Запускает Flask сервер в отдельном потоке"""
     port = int(os.environ.get('PORT', 8000))  # Koyeb использует порт 8000 по умолчанию
@@ -0,0 +1,43 @@
+"""
+Бенчмарк строки контекста: готовая строка UserData против пересборки на каждый запрос.
+
+Запуск: python bench_context.py
+Обработчик читает контекст 1-2 раза на сообщение, поэтому сравнивается
+одно добавление ответа и два чтения контекста.
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.user import UserData
+from test_context_string import render_full
+
+CONTEXT_SIZES = [20, 50, 100]
+ANSWER_SIZES_KB = [1, 4, 16]
+ROUNDS = 200
+
+def bench(user: UserData, answer: str, get_context) -> float:
+    """Возвращает среднее время одного раунда в микросекундах"""
+    started = time.perf_counter()
+    for i in range(ROUNDS):
+        user.add_to_context('user' if i % 2 == 0 else 'assistant', answer)
+        get_context(user)
+        get_context(user)
+    return (time.perf_counter() - started) * 1e6 / ROUNDS
+
+def main():
+    print(f"{'Контекст':>8} | {'Ответ':>6} | {'Пересборка, мкс':>15} | {'Готовая, мкс':>12} | {'Ускорение':>9}")
+    for max_context in CONTEXT_SIZES:
+        for size_kb in ANSWER_SIZES_KB:
+            answer = ("Совет по делу. " * (size_kb * 40))[:size_kb * 1024 // 2]
+
+            old = bench(UserData(user_id=1, max_context_length=max_context), answer,
+                        lambda user: render_full(user.context_messages))
+            new = bench(UserData(user_id=1, max_context_length=max_context), answer,
+                        lambda user: user.get_context_string())
+            print(f"{max_context:>8} | {size_kb:>4}КБ | {old:>15.1f} | {new:>12.1f} | {old / new:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
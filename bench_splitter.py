@@ -0,0 +1,83 @@
+"""
+Бенчмарк MessageSplitter на длинных ответах LLM (10 КБ - 1 МБ).
+
+Запуск: python bench_splitter.py
+Время на килобайт должно оставаться примерно постоянным (линейное масштабирование).
+"""
+
+import sys
+import os
+import random
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.messages import MessageSplitter
+
+SIZES_KB = [10, 50, 100, 250, 500, 1000]
+
+WORDS = [
+    "идея", "критика", "альтернатива", "подход", "система", "риск", "гипотеза",
+    "инсайт", "стратегия", "проект", "анализ", "решение", "контекст", "метрика",
+]
+
+def make_llm_text(size_bytes: int, seed: int = 42) -> str:
+    """Генерирует текст, похожий на ответ LLM: заголовки, списки, **жирный**, `код`"""
+    rng = random.Random(seed)
+    paragraphs = []
+    total = 0
+
+    while total < size_bytes:
+        kind = rng.random()
+        if kind < 0.15:
+            paragraph = f"**{rng.choice(WORDS).capitalize()} {rng.randint(1, 99)}:**"
+        elif kind < 0.35:
+            items = [f"* {' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 10)))}."
+                     for _ in range(rng.randint(2, 5))]
+            paragraph = "\n".join(items)
+        else:
+            sentences = []
+            for _ in range(rng.randint(2, 8)):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(5, 20))]
+                if rng.random() < 0.2:
+                    words[rng.randrange(len(words))] = f"`{rng.choice(WORDS)}`"
+                sentences.append(" ".join(words).capitalize() + rng.choice([".", "!", "?"]))
+            paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph.encode('utf-8')) + 2
+
+    return "\n\n".join(paragraphs)
+
+def make_single_paragraph(size_bytes: int, seed: int = 7) -> str:
+    """Сплошной текст без пустых строк: разбиение идет по предложениям"""
+    rng = random.Random(seed)
+    sentences = []
+    total = 0
+    while total < size_bytes:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))).capitalize() + "."
+        sentences.append(sentence)
+        total += len(sentence.encode('utf-8')) + 1
+    return " ".join(sentences)
+
+def bench(splitter: MessageSplitter, text: str, repeats: int = 3) -> float:
+    """Возвращает лучшее время разбивки в секундах"""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        splitter.split(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    splitter = MessageSplitter()
+
+    for title, generator in [("Ответ LLM", make_llm_text), ("Один абзац", make_single_paragraph)]:
+        print(f"\n=== {title} ===")
+        print(f"{'Размер':>8} | {'Частей':>6} | {'Время, мс':>10} | {'мкс/КБ':>8}")
+        for size_kb in SIZES_KB:
+            text = generator(size_kb * 1024)
+            parts = splitter.split(text)
+            elapsed = bench(splitter, text)
+            print(f"{size_kb:>6}КБ | {len(parts):>6} | {elapsed * 1000:>10.1f} | {elapsed * 1e6 / size_kb:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -105,22 +105,97 @@ Red Teaming.
         В сокращеном сообщении необходимо передать самые важные мысли и предложения. 
         Сохрани обращение "на ты".''')
     
+    # Режим генерации ответа
+    ANSWER_GENERATION_MODE = os.getenv('ANSWER_GENERATION_MODE', 'two_stage')  # two_stage, single_call, lazy
+    # two_stage - полный ответ, затем отдельный запрос на сокращение (2 запроса)
+    # single_call - полный и краткий ответ одним запросом в JSON (при ошибке - two_stage)
+    # lazy - сразу генерируется только краткий ответ, полный - по кнопке или в фоне
+    LAZY_FULL_ANSWER = os.getenv('LAZY_FULL_ANSWER', 'on_demand')  # on_demand, background
+    
+    # Потоковый вывод: краткий ответ показывается по мере генерации (полный - как в режиме lazy)
+    STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))  # Секунд между правками сообщения
+    
+    # Инструкция для краткого ответа в режиме lazy
+    LAZY_SHORT_ANSWER_PROMPT = os.getenv('LAZY_SHORT_ANSWER_PROMPT',
+        '''Не пиши развернутый ответ: сразу дай его сокращенную версию по следующему правилу:''')
+    
+    # Инструкция формата для однопроходного режима
+    SINGLE_CALL_FORMAT_PROMPT = os.getenv('SINGLE_CALL_FORMAT_PROMPT',
+        '''Верни ответ в формате JSON с двумя полями:
+        "full_answer" - полный развернутый ответ;
+        "short_answer" - сокращенная версия полного ответа по следующему правилу:''')
+    
+    # Формат ответа на голосовое сообщение: расшифровка отдельным полем того же запроса
+    AUDIO_JSON_FORMAT_PROMPT = os.getenv('AUDIO_JSON_FORMAT_PROMPT',
+        '''Верни ответ в формате JSON. Поле "transcript" - дословная расшифровка голосового
+        сообщения пользователя (только его слова, без ответа и комментариев).''')
+    AUDIO_STREAM_FORMAT_PROMPT = os.getenv('AUDIO_STREAM_FORMAT_PROMPT',
+        '''Формат ответа: первой строкой напиши "Вопрос:" и дословную расшифровку голосового
+        сообщения пользователя, второй строкой - "===", а после нее - ответ.''')
+    
     # Промпт для резюме диалога
     DIALOG_SUMMARY_PROMPT = os.getenv('DIALOG_SUMMARY_PROMPT',
         '''Проанализируй весь диалог и создай максимально подробное резюме диалога. 
         Включи все основные советы и рекомендации, важные детали и нюансы. 
         Резюме должно быть структурированным и полным, чтобы на его основе можно было продолжить разговор с полным пониманием контекста.''')
     
+    # Дополнение готового резюме новыми сообщениями (фоновое резюме перед лимитом)
+    DIALOG_SUMMARY_UPDATE_PROMPT = os.getenv('DIALOG_SUMMARY_UPDATE_PROMPT',
+        '''Ниже резюме начала диалога и новые сообщения после него. Дополни резюме новыми вопросами,
+        советами и деталями, сохранив все важное из прежнего резюме и его структуру.''')
+    
+    # Резюме начинает готовиться в фоне с предупреждения о лимите (7-е сообщение)
+    # и дополняется на следующих, чтобы на 10-м сообщении новый чат начинался сразу
+    SUMMARY_PRECOMPUTE = os.getenv('SUMMARY_PRECOMPUTE', 'true').lower() == 'true'
+    # Готовые резюме по хешу контекста: повторное нажатие "📋 Резюме диалога" без новых
+    # сообщений отвечает сразу (записей в памяти, время жизни в секундах)
+    DIALOG_SUMMARY_CACHE_SIZE = int(os.getenv('DIALOG_SUMMARY_CACHE_SIZE', '256'))
+    DIALOG_SUMMARY_CACHE_TTL = float(os.getenv('DIALOG_SUMMARY_CACHE_TTL', '3600'))
+    
     # Настройки контекста
     MAX_CONTEXT_MESSAGES = int(os.getenv('MAX_CONTEXT_MESSAGES', '20'))
     if MAX_CONTEXT_MESSAGES < 2:
         MAX_CONTEXT_MESSAGES = 2
     elif MAX_CONTEXT_MESSAGES > 100:
         MAX_CONTEXT_MESSAGES = 100
+    # Бюджет истории в токенах (оценка локально, без API): старые сообщения вытесняются,
+    # пока история не уложится в бюджет. 0 - ограничение только по количеству сообщений
+    CONTEXT_TOKEN_BUDGET = max(0, int(os.getenv('CONTEXT_TOKEN_BUDGET', '0')))
+    # Хранить в истории прошлые ответы советника в краткой версии (полная - только у последнего)
+    CONTEXT_COLLAPSE_ANSWERS = os.getenv('CONTEXT_COLLAPSE_ANSWERS', 'false').lower() == 'true'
+    
+    # Хранилище контекста
+    # memory - только в памяти (теряется при перезапуске), sqlite - файл SQLITE_PATH, redis - REDIS_URL
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory').lower()
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/bot.db')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '1.0'))  # Период пакетной записи (секунды)
+    STORAGE_BATCH_SIZE = int(os.getenv('STORAGE_BATCH_SIZE', '100'))  # Запись сразу при накоплении N пользователей
+    
+    # Ограничение памяти
+    # Выгружать пользователей, неактивных N секунд (0 - никогда). Не задано - сутки,
+    # но только при хранилище на диске: без него выгрузка стирает диалог
+    USER_IDLE_TTL = float(os.getenv('USER_IDLE_TTL')) if os.getenv('USER_IDLE_TTL') else None
+    FULL_ANSWERS_MAX_BYTES = int(float(os.getenv('FULL_ANSWERS_MAX_MB', '64')) * 1024 * 1024)  # Общий бюджет на полные ответы (0 - без ограничения)
+    FULL_ANSWERS_SPILL_PATH = os.getenv('FULL_ANSWERS_SPILL_PATH', '')  # Файл для вытесненных ответов (пусто - удалять)
     
     # Модель Gemini
     GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-pro-preview-05-06')
     
+    # Параллелизм
+    GEMINI_MAX_CONCURRENT_REQUESTS = int(os.getenv('GEMINI_MAX_CONCURRENT_REQUESTS', '8'))  # Одновременных запросов к Gemini
+    GEMINI_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', '100'))  # Очередь запросов, с которой новые сообщения отклоняются (0 - без ограничения)
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))  # Одновременно обрабатываемых апдейтов Telegram
+    # Сообщения одного пользователя обрабатываются по очереди; текстовые сообщения,
+    # пришедшие подряд в пределах окна (секунды), объединяются в один вопрос (0 - без объединения)
+    MESSAGE_COALESCE_WINDOW = float(os.getenv('MESSAGE_COALESCE_WINDOW', '0'))
+    
+    # Кэш системного промпта (MAIN_PROMPT) на стороне Gemini
+    PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'true').lower() == 'true'
+    PROMPT_CACHE_TTL = float(os.getenv('PROMPT_CACHE_TTL', '3600'))  # Время жизни кэша (секунды)
+    PROMPT_CACHE_REFRESH_MARGIN = float(os.getenv('PROMPT_CACHE_REFRESH_MARGIN', '300'))  # Продлевать за N секунд до истечения
+    
     # Лимиты сообщений
     MESSAGE_LENGTH_LIMIT = 4000
     MESSAGE_CUT_LENGTH = 3900
@@ -145,9 +220,35 @@ Red Teaming.
     """
     
     # Настройки транскрипции
-    TRANSCRIPTION_MODE = os.getenv('TRANSCRIPTION_MODE', 'gemini_only')  # auto, gemini_only, speech_api_only
+    TRANSCRIPTION_MODE = os.getenv('TRANSCRIPTION_MODE', 'gemini_only')  # auto, gemini_only, speech_api_only, hedged
+    # Режим hedged: через сколько секунд без результата Gemini запускать Speech API параллельно (0 - сразу)
+    TRANSCRIPTION_HEDGE_DELAY = float(os.getenv('TRANSCRIPTION_HEDGE_DELAY', '2.0'))
     GEMINI_MAX_AUDIO_SIZE_MB = 20  # Максимальный размер для Gemini (в мегабайтах)
+    # Аудио до этого размера передается прямо в запросе, без загрузки через File API (0 - всегда загружать)
+    GEMINI_INLINE_AUDIO_MAX_KB = int(os.getenv('GEMINI_INLINE_AUDIO_MAX_KB', '4096'))
+    # Ожидание обработки загруженного файла: паузы растут от INITIAL вдвое до MAX, не дольше TIMEOUT
+    GEMINI_FILE_POLL_INITIAL = float(os.getenv('GEMINI_FILE_POLL_INITIAL', '0.1'))
+    GEMINI_FILE_POLL_MAX = float(os.getenv('GEMINI_FILE_POLL_MAX', '2.0'))
+    GEMINI_FILE_WAIT_TIMEOUT = float(os.getenv('GEMINI_FILE_WAIT_TIMEOUT', '30'))
+    # Google Speech API (режимы auto и speech_api_only): таймауты в секундах,
+    # повторы при 429/5xx и сетевых ошибках с экспоненциальной паузой и случайным разбросом
+    SPEECH_API_URL = os.getenv('SPEECH_API_URL', 'https://speech.googleapis.com/v1/speech:recognize')
+    SPEECH_CONNECT_TIMEOUT = float(os.getenv('SPEECH_CONNECT_TIMEOUT', '5'))
+    SPEECH_READ_TIMEOUT = float(os.getenv('SPEECH_READ_TIMEOUT', '30'))
+    SPEECH_MAX_RETRIES = int(os.getenv('SPEECH_MAX_RETRIES', '3'))
+    SPEECH_RETRY_BASE_DELAY = float(os.getenv('SPEECH_RETRY_BASE_DELAY', '0.5'))
+    SPEECH_RETRY_MAX_DELAY = float(os.getenv('SPEECH_RETRY_MAX_DELAY', '10'))
+    # Кэш транскрипций по file_unique_id и хешу аудио: записей в памяти, время жизни (секунды),
+    # файл SQLite для второго уровня (пусто - только память) и лимит записей в нем (0 - без ограничения)
+    TRANSCRIPT_CACHE_SIZE = int(os.getenv('TRANSCRIPT_CACHE_SIZE', '1000'))
+    TRANSCRIPT_CACHE_TTL = float(os.getenv('TRANSCRIPT_CACHE_TTL', '604800'))
+    TRANSCRIPT_CACHE_PATH = os.getenv('TRANSCRIPT_CACHE_PATH', '')
+    TRANSCRIPT_CACHE_DISK_SIZE = int(os.getenv('TRANSCRIPT_CACHE_DISK_SIZE', '100000'))
     GEMINI_MAX_AUDIO_DURATION = 300  # Максимальная длительность для Gemini (в секундах)
+    # Аудио длиннее лимитов режется на куски с перекрытием и транскрибируется параллельно
+    CHUNK_TRANSCRIPTION_SECONDS = float(os.getenv('CHUNK_TRANSCRIPTION_SECONDS', '240'))
+    CHUNK_TRANSCRIPTION_OVERLAP = float(os.getenv('CHUNK_TRANSCRIPTION_OVERLAP', '2'))
+    CHUNK_TRANSCRIPTION_CONCURRENCY = int(os.getenv('CHUNK_TRANSCRIPTION_CONCURRENCY', '4'))
     SHOW_TRANSCRIPTION_METHOD = False  # Показывать метод транскрипции пользователю
     
     # Режим обработки аудио (НОВАЯ НАСТРОЙКА для Gemini 2.5 Pro)
@@ -10,6 +10,9 @@ from keyboards.reply import ReplyKeyboards
 from utils.context import ContextManager
 from utils.messages import MessageUtils
 from services.gemini import GeminiService
+from services.full_answers import FullAnswerService
+from services.dialog_summary import DialogSummarizer
+from services.llm_executor import mark_request
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -17,21 +20,36 @@ logger = logging.getLogger(__name__)
 class ButtonHandlers:
     """Класс обработчиков кнопок"""
     
-    def __init__(self, context_manager: ContextManager, gemini_service: GeminiService = None):
+    # Кнопки, которые меняют историю диалога: обрабатываются в очереди сообщений пользователя
+    CONTEXT_CALLBACK_PREFIXES = ("summary_new_", "new_chat_")
+    
+    def __init__(self, context_manager: ContextManager, gemini_service: GeminiService = None,
+                 full_answer_service: FullAnswerService = None, dialog_summarizer: DialogSummarizer = None):
         """
         Инициализация обработчиков кнопок
         
         Args:
             context_manager: Менеджер контекста пользователей
             gemini_service: Сервис Gemini для генерации резюме
+            full_answer_service: Сервис отложенных полных ответов (режим lazy)
+            dialog_summarizer: Инкрементальное резюме диалога
         """
         self.context_manager = context_manager
         self.gemini_service = gemini_service
+        self.full_answer_service = full_answer_service
+        if dialog_summarizer is None and gemini_service:
+            dialog_summarizer = DialogSummarizer(context_manager, gemini_service)
+        self.dialog_summarizer = dialog_summarizer
         self.inline_keyboards = InlineKeyboards()
         self.reply_keyboards = ReplyKeyboards()
         self.message_utils = MessageUtils()
         logger.info("Инициализированы обработчики кнопок")
     
+    @classmethod
+    def changes_context(cls, data: str) -> bool:
+        """Меняет ли нажатие кнопки историю диалога"""
+        return bool(data) and data.startswith(cls.CONTEXT_CALLBACK_PREFIXES)
+    
     async def handle_inline_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик нажатий на inline кнопки"""
         query = update.callback_query
@@ -39,6 +57,7 @@ class ButtonHandlers:
         
         user_id = update.effective_user.id
         data = query.data
+        mark_request(user_id)
         
         logger.info(f"Inline кнопка '{data}' от пользователя ID: {user_id}")
         
@@ -68,6 +87,11 @@ class ButtonHandlers:
             
             if answer_user_id == user_id:
                 answer_data = self.context_manager.get_full_answer(user_id, answer_id)
+                if FullAnswerService.is_pending(answer_data):
+                    answer_data = await self._generate_pending_full_answer(query, user_id, answer_id)
+                    if answer_data is None:
+                        return
+                
                 if answer_data:
                     full_text = answer_data['full_answer']
                     
@@ -135,6 +159,27 @@ class ButtonHandlers:
                 else:
                     await self.message_utils.safe_edit_message(query, "❌ Ответ не найден")
     
+    async def _generate_pending_full_answer(self, query, user_id: int, answer_id: int):
+        """Генерирует отложенный полный ответ (режим lazy); возвращает None при ошибке"""
+        answer_data = self.context_manager.get_full_answer(user_id, answer_id)
+        
+        if self.full_answer_service:
+            # Показываем статус
+            await self.message_utils.safe_edit_message(query, "🦉 Уху...")
+            answer_data = await self.full_answer_service.ensure_full_answer(user_id, answer_id)
+            if answer_data and not FullAnswerService.is_pending(answer_data):
+                return answer_data
+        
+        if not answer_data:
+            await self.message_utils.safe_edit_message(query, "❌ Ответ не найден")
+            return None
+        
+        # Не удалось сгенерировать - возвращаем краткий ответ с кнопками
+        short_text = answer_data['short_answer'] + "\n\n❌ Не удалось получить полный ответ. Попробуйте еще раз."
+        reply_markup = self.inline_keyboards.get_answer_keyboard(user_id, answer_id)
+        await self.message_utils.safe_edit_message(query, short_text, 'Markdown', reply_markup)
+        return None
+    
     async def _handle_short_answer(self, query, user_id: int, data: str):
         """Обработка возврата к краткому ответу"""
         parts = data.split("_")
@@ -174,9 +219,9 @@ class ButtonHandlers:
                 )
                 return
             
-            # Генерируем резюме через Gemini
-            if self.gemini_service:
-                summary = await self.gemini_service.generate_dialog_summary(context_string)
+            # Дописываем в резюме новые сообщения
+            if self.dialog_summarizer:
+                summary = await self.dialog_summarizer.summarize(user_id)
                 
                 # Добавляем клавиатуру с полезными действиями
                 reply_markup = self.inline_keyboards.get_summary_keyboard(user_id)
@@ -260,9 +305,9 @@ class ButtonHandlers:
                 )
                 return
             
-            # Генерируем резюме
-            if self.gemini_service:
-                summary = await self.gemini_service.generate_dialog_summary(context_string)
+            # Дописываем в резюме новые сообщения
+            if self.dialog_summarizer:
+                summary = await self.dialog_summarizer.summarize(user_id)
                 
                 # Начинаем новый чат с резюме
                 self.context_manager.start_new_chat_with_summary(user_id, summary)
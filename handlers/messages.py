@@ -9,17 +9,28 @@ from telegram.ext import ContextTypes
 from keyboards.inline import InlineKeyboards
 from utils.context import ContextManager
 from utils.messages import MessageUtils
-from services.gemini import GeminiService
+from utils.streaming import ChatEditThrottler, StreamingReply
+from utils.cache import TranscriptCache
+from utils.metrics import metrics
+from utils.ogg import OggError, analyze_opus
+from services.gemini import GeminiService, StreamedTranscript
 from services.speech import SpeechService
+from services.full_answers import FullAnswerService
+from services.llm_executor import mark_request
+from services.dialog_summary import DialogSummarizer
+from services.transcription import HedgedTranscriber, ChunkedTranscriber, ENGINE_NAMES
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+BUSY_TEXT = "⏳ Сейчас очень много вопросов, и я не успеваю ответить. Пожалуйста, повторите через минуту."
+
 class MessageHandlers:
     """Класс обработчиков сообщений"""
     
     def __init__(self, context_manager: ContextManager, gemini_service: GeminiService, 
-                 speech_service: SpeechService):
+                 speech_service: SpeechService, full_answer_service: FullAnswerService = None,
+                 transcript_cache: TranscriptCache = None, dialog_summarizer: DialogSummarizer = None):
         """
         Инициализация обработчиков сообщений
         
@@ -27,23 +38,108 @@ class MessageHandlers:
             context_manager: Менеджер контекста пользователей
             gemini_service: Сервис для работы с Gemini
             speech_service: Сервис для распознавания речи
+            full_answer_service: Сервис отложенных полных ответов (режим lazy)
+            transcript_cache: Кэш транскрипций голосовых сообщений
+            dialog_summarizer: Фоновое резюме диалога перед началом нового чата
         """
         self.context_manager = context_manager
         self.gemini_service = gemini_service
         self.speech_service = speech_service
+        self.full_answer_service = full_answer_service
+        self.transcriber = HedgedTranscriber(gemini_service, speech_service)
+        self.chunked_transcriber = ChunkedTranscriber(gemini_service, speech_service)
+        self.transcript_cache = transcript_cache or TranscriptCache()
+        self.dialog_summarizer = dialog_summarizer or DialogSummarizer(context_manager, gemini_service)
         self.inline_keyboards = InlineKeyboards()
         self.message_utils = MessageUtils()
+        self.edit_throttler = ChatEditThrottler()
         logger.info("Инициализированы обработчики сообщений")
     
-    async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Обработчик текстовых сообщений"""
+    def _save_answer(self, user_id: int, question: str, full_answer, short_answer: str,
+                     context_string: str) -> int:
+        """
+        Сохраняет вопрос и ответ в контекст и возвращает ID ответа
+        
+        В режиме lazy полный ответ равен None: сохраняется контекст на момент вопроса,
+        а сам ответ генерируется позже через FullAnswerService.
+        """
+        # Сохраняем в контекст (это увеличит счетчик пользовательских сообщений)
+        self.context_manager.add_to_context(user_id, "user", question)
+        self.context_manager.add_to_context(user_id, "assistant", full_answer or short_answer, short_answer)
+        
+        # Создаем ID для ответа и сохраняем полный ответ
+        answer_id = self.context_manager.get_next_answer_id(user_id)
+        self.context_manager.save_full_answer(
+            user_id, answer_id, full_answer, short_answer, question,
+            context=context_string if full_answer is None else None
+        )
+        
+        if full_answer is None and self.full_answer_service:
+            self.full_answer_service.on_answer_saved(user_id, answer_id)
+        
+        return answer_id
+    
+    async def _stream_answer(self, update: Update, thinking_message, user_id: int, stream,
+                             context_string: str, question: str = None, get_question=None) -> bool:
+        """
+        Показывает краткий ответ по мере генерации, затем сохраняет его
+        
+        Сообщение "🦉 Уху..." редактируется с ограничением частоты правок,
+        полный ответ генерируется позже (как в режиме lazy).
+        
+        Args:
+            stream: Асинхронный генератор накопленного текста ответа
+            question: Вопрос пользователя
+            get_question: Корутина-функция, возвращающая вопрос после генерации (голосовое)
+            
+        Returns:
+            bool: False, если модель не вернула текст
+        """
+        reply = StreamingReply(thinking_message, self.edit_throttler)
+        short_answer = ""
+        try:
+            async for short_answer in stream:
+                await reply.update(short_answer)
+        finally:
+            await stream.aclose()
+        
+        if not short_answer.strip():
+            return False
+        
+        if question is None:
+            question = await get_question()
+        
+        answer_id = self._save_answer(user_id, question, None, short_answer, context_string)
+        
+        limit_info = self.context_manager.get_limit_info_text(user_id)
+        response_text = short_answer
+        if limit_info:
+            response_text += f"\n\n{limit_info}"
+        
+        reply_markup = self.inline_keyboards.get_answer_keyboard(user_id, answer_id)
+        await reply.finalize(update, response_text, 'Markdown', reply_markup)
+        
+        await self._check_and_handle_limits(update, user_id)
+        return True
+    
+    async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str = None) -> None:
+        """
+        Обработчик текстовых сообщений
+        
+        Args:
+            text: Текст вопроса, если он отличается от текста апдейта (объединенная серия сообщений)
+        """
         user_id = update.effective_user.id
-        text = update.message.text
+        if text is None:
+            text = update.message.text
         
         if not text or text.strip() == "":
             await update.message.reply_text("⚠️ Пустое сообщение. Пожалуйста, задайте вопрос.")
             return
         
+        if await self._reject_if_busy(update, user_id):
+            return
+        
         logger.info(f"Текстовое сообщение от пользователя ID: {user_id}, длина: {len(text)}")
         
         # Отправляем сообщение о начале обработки
@@ -53,16 +149,18 @@ class MessageHandlers:
             # Получаем контекст пользователя
             context_string = self.context_manager.get_context_string(user_id)
             
+            if Config.STREAM_RESPONSES:
+                # Показываем ответ по мере генерации
+                stream = self.gemini_service.stream_short_answer(text, context_string)
+                if not await self._stream_answer(update, thinking_message, user_id, stream, context_string, text):
+                    raise ValueError("Gemini вернул пустой ответ")
+                return
+            
             # Обрабатываем вопрос через Gemini
             full_answer, short_answer = await self.gemini_service.process_with_context(text, context_string)
             
-            # Сохраняем в контекст (это увеличит счетчик пользовательских сообщений)
-            self.context_manager.add_to_context(user_id, "user", text)
-            self.context_manager.add_to_context(user_id, "assistant", full_answer)
-            
-            # Создаем ID для ответа и сохраняем полный ответ
-            answer_id = self.context_manager.get_next_answer_id(user_id)
-            self.context_manager.save_full_answer(user_id, answer_id, full_answer, short_answer, text)
+            # Сохраняем вопрос и ответ
+            answer_id = self._save_answer(user_id, text, full_answer, short_answer, context_string)
             
             # Формируем краткий ответ для отображения
             limit_info = self.context_manager.get_limit_info_text(user_id)
@@ -88,16 +186,34 @@ class MessageHandlers:
             await thinking_message.delete()
             await update.message.reply_text("❌ Произошла ошибка при обработке вашего сообщения.")
     
+    async def _reject_if_busy(self, update: Update, user_id: int) -> bool:
+        """
+        Отвечает "бот занят", если очередь к модели переполнена; иначе отмечает запрос как интерактивный
+        
+        Returns:
+            bool: True, если сообщение отклонено
+        """
+        if self.gemini_service.executor.overloaded():
+            metrics.inc('gemini.shed')
+            logger.warning(f"⏳ Очередь к Gemini переполнена - сообщение пользователя {user_id} отклонено")
+            await update.message.reply_text(BUSY_TEXT)
+            return True
+        
+        mark_request(user_id)
+        return False
+    
     async def _check_and_handle_limits(self, update: Update, user_id: int):
         """НОВОЕ: Проверяет и обрабатывает лимиты сообщений"""
         
+        # С 7-го сообщения резюме готовится заранее
+        self.dialog_summarizer.on_message(user_id)
+        
         # Проверяем, нужно ли автоматически создать резюме (10-е сообщение)
         if self.context_manager.should_auto_create_summary(user_id):
             logger.info(f"Пользователь {user_id} достиг лимита 10 сообщений - создаем автоматическое резюме")
             
-            # Создаем резюме
-            context_string = self.context_manager.get_context_string(user_id)
-            summary = await self.gemini_service.generate_dialog_summary(context_string)
+            # Резюме обычно уже готово в фоне - остается учесть последний ответ
+            summary = await self.dialog_summarizer.summary_for_rollover(user_id)
             
             # Начинаем новый чат с резюме
             self.context_manager.start_new_chat_with_summary(user_id, summary)
@@ -139,20 +255,62 @@ class MessageHandlers:
         
         logger.info(f"Голосовое сообщение от пользователя ID: {user_id}")
         
+        if await self._reject_if_busy(update, user_id):
+            return
+        
         # Отправляем сообщение о начале обработки
         thinking_message = await update.message.reply_text("🦉 Уху...")
+        audio = None
         
         try:
-            # Получаем файл
             voice = update.message.voice
+            
+            # Пересланное или повторно отправленное аудио уже транскрибировано - не скачиваем его
+            cached = self.transcript_cache.get(voice.file_unique_id)
+            if cached:
+                logger.info("♻️ Транскрипция найдена в кэше по file_unique_id")
+                await self._answer_transcribed_text(
+                    update, thinking_message, user_id, cached['transcript'],
+                    self.context_manager.get_context_string(user_id)
+                )
+                return
+            
+            # Получаем файл
             file = await context.bot.get_file(voice.file_id)
             
-            # Загружаем аудио данные
-            audio_data = await file.download_as_bytearray()
+            # Загружаем аудио данные: один буфер bytes на весь конвейер, этапы его не копируют
+            audio_data = await self.message_utils.download_bytes(file)
+            
+            cached = self.transcript_cache.get_by_content(audio_data, voice.file_unique_id)
+            if cached:
+                logger.info("♻️ Транскрипция найдена в кэше по содержимому аудио")
+                await self._answer_transcribed_text(
+                    update, thinking_message, user_id, cached['transcript'],
+                    self.context_manager.get_context_string(user_id)
+                )
+                return
+            
+            # Длительность и тишину определяем по заголовкам Ogg/Opus, до загрузки в Gemini
+            duration = voice.duration
+            try:
+                info = analyze_opus(audio_data)
+                duration = info.duration
+                if info.silent:
+                    logger.info(f"🔇 Пустое голосовое сообщение ({info.duration:.1f}s, тишина {info.quiet_ratio:.0%})")
+                    metrics.inc('audio.rejected_silent')
+                    await thinking_message.edit_text(
+                        "🔇 В голосовом сообщении не слышно речи. Попробуйте записать его заново."
+                    )
+                    return
+            except OggError as e:
+                logger.warning(f"Не удалось разобрать заголовки аудио, используем данные Telegram: {e}")
+            
+            # Файл загружается в Gemini один раз для всех этапов (прямая обработка, транскрипция)
+            audio = self.gemini_service.audio_session(audio_data)
             
             # Проверяем размер файла для выбора стратегии
             file_size_mb = len(audio_data) / (1024 * 1024)
-            logger.info(f"Размер аудиофайла: {file_size_mb:.2f} MB, длительность: {voice.duration}s")
+            logger.info(f"Размер аудиофайла: {file_size_mb:.2f} MB, длительность: {duration:.1f}s")
             
             # Получаем контекст пользователя
             context_string = self.context_manager.get_context_string(user_id)
@@ -164,39 +322,55 @@ class MessageHandlers:
                 
                 # Проверяем лимиты для прямой обработки
                 if (file_size_mb > Config.GEMINI_MAX_AUDIO_SIZE_MB or 
-                    voice.duration > Config.GEMINI_MAX_AUDIO_DURATION):
+                    duration > Config.GEMINI_MAX_AUDIO_DURATION):
                     logger.warning(f"Файл превышает лимиты для прямой обработки - переключаемся на транскрипцию")
                     # Fallback к транскрипции
                     await self._process_with_transcription(
-                        update, thinking_message, audio_data, voice, context_string, user_id
+                        update, thinking_message, audio_data, voice, context_string, user_id, audio, duration
                     )
                 else:
                     # Прямая обработка аудио
+                    if Config.STREAM_RESPONSES:
+                        try:
+                            heard = StreamedTranscript()
+                            stream = self.gemini_service.stream_audio_short_answer(audio, context_string, heard)
+                            if await self._stream_answer(
+                                update, thinking_message, user_id, stream, context_string,
+                                get_question=lambda: self._voice_question(heard.text, audio, voice, audio_data)
+                            ):
+                                return
+                            logger.warning("Потоковая обработка аудио не дала результата - переключаемся на транскрипцию")
+                        except Exception as stream_error:
+                            logger.error(f"Ошибка потоковой обработки аудио: {stream_error}")
+                        
+                        await self._process_with_transcription(
+                            update, thinking_message, audio_data, voice, context_string, user_id, audio, duration
+                        )
+                        return
+                    
                     # Оставляем статус "🦉 Уху..." без изменений
                     
                     try:
-                        full_answer, short_answer = await self.gemini_service.process_audio_with_context(
-                            bytes(audio_data), context_string
+                        full_answer, short_answer, transcript = await self.gemini_service.process_audio_with_context(
+                            audio, context_string
                         )
                         
-                        # Проверяем, что получили валидный ответ
-                        if not full_answer or full_answer.strip() == "" or "ошибка" in full_answer.lower():
+                        # Проверяем, что получили валидный ответ (в режиме lazy есть только краткий)
+                        answer_text = full_answer or short_answer
+                        if not answer_text or answer_text.strip() == "" or "ошибка" in answer_text.lower():
                             logger.warning("Прямая обработка не дала валидный результат - переключаемся на транскрипцию")
                             await self._process_with_transcription(
-                                update, thinking_message, audio_data, voice, context_string, user_id
+                                update, thinking_message, audio_data, voice, context_string, user_id, audio, duration
                             )
                             return
                         
-                        # Извлекаем транскрипцию для контекста
-                        transcription = await self.gemini_service.extract_transcription_from_response(full_answer)
-                        
-                        # Сохраняем в контекст
-                        self.context_manager.add_to_context(user_id, "user", transcription)
-                        self.context_manager.add_to_context(user_id, "assistant", full_answer)
+                        # Расшифровка пришла в том же ответе модели
+                        transcription = await self._voice_question(transcript, audio, voice, audio_data)
                         
-                        # Создаем ID для ответа и сохраняем полный ответ
-                        answer_id = self.context_manager.get_next_answer_id(user_id)
-                        self.context_manager.save_full_answer(user_id, answer_id, full_answer, short_answer, transcription)
+                        # Сохраняем вопрос и ответ
+                        answer_id = self._save_answer(
+                            user_id, transcription, full_answer, short_answer, context_string
+                        )
                         
                         # Формируем ответ
                         limit_info = self.context_manager.get_limit_info_text(user_id)
@@ -223,7 +397,7 @@ class MessageHandlers:
                         logger.error(f"Ошибка прямой обработки аудио: {direct_error}")
                         logger.info("Переключаемся на режим транскрипции как fallback")
                         await self._process_with_transcription(
-                            update, thinking_message, audio_data, voice, context_string, user_id
+                            update, thinking_message, audio_data, voice, context_string, user_id, audio, duration
                         )
             
             else:
@@ -237,16 +411,46 @@ class MessageHandlers:
                 reason_str = ", ".join(reason) if reason else "неизвестная причина"
                 logger.info(f"Используем режим транскрипции. Причины: {reason_str}")
                 await self._process_with_transcription(
-                    update, thinking_message, audio_data, voice, context_string, user_id
+                    update, thinking_message, audio_data, voice, context_string, user_id, audio, duration
                 )
                 
         except Exception as e:
             logger.error(f"Ошибка при обработке голосового сообщения: {e}")
             await thinking_message.delete()
             await update.message.reply_text("❌ Произошла ошибка при обработке голосового сообщения.")
+        
+        finally:
+            if audio is not None:
+                await audio.close()
+    
+    async def _voice_question(self, transcript, audio, voice, audio_data) -> str:
+        """
+        Возвращает вопрос пользователя для контекста после прямой обработки аудио
+        
+        Обычно расшифровка приходит вместе с ответом; если модель ее не вернула,
+        аудио транскрибируется отдельно (файл сессии используется повторно).
+        """
+        if not transcript:
+            metrics.inc('audio.transcript_fallback')
+            logger.warning("Модель не вернула расшифровку - транскрибируем аудио отдельно")
+            transcript = await self.gemini_service.transcribe_audio(audio)
+            if not transcript:
+                return "Голосовое сообщение пользователя"
+        
+        self.transcript_cache.put(transcript, voice.file_unique_id, audio_data)
+        return transcript
     
-    async def _process_with_transcription(self, update, thinking_message, audio_data, voice, context_string, user_id):
-        """Вспомогательный метод для обработки через транскрипцию (старый режим)"""
+    async def _process_with_transcription(self, update, thinking_message, audio_data, voice, context_string, user_id,
+                                          audio=None, duration: float = None):
+        """
+        Вспомогательный метод для обработки через транскрипцию (старый режим)
+        
+        audio - сессия голосового сообщения: если прямая обработка уже загрузила файл
+        в Gemini, транскрипция использует его без повторной загрузки.
+        duration - длительность из заголовков Ogg/Opus (по умолчанию voice.duration).
+        """
+        if duration is None:
+            duration = voice.duration
         # Оставляем статус "🦉 Уху..." без изменений
         
         text = None
@@ -255,6 +459,11 @@ class MessageHandlers:
         # Умная логика выбора метода транскрипции на основе настроек
         use_gemini = True
         
+        # Длинное аудио Gemini транскрибирует по кускам
+        file_size_mb = len(audio_data) / (1024 * 1024)
+        exceeds_gemini_limits = (file_size_mb > Config.GEMINI_MAX_AUDIO_SIZE_MB or
+                                 duration > Config.GEMINI_MAX_AUDIO_DURATION)
+        
         # Проверяем режим транскрипции из конфига
         if Config.TRANSCRIPTION_MODE == "speech_api_only":
             use_gemini = False
@@ -262,33 +471,39 @@ class MessageHandlers:
         elif Config.TRANSCRIPTION_MODE == "gemini_only":
             use_gemini = True
             logger.info("Режим gemini_only - используем только Gemini")
-        else:  # auto режим
-            # Проверяем ограничения для Gemini
-            file_size_mb = len(audio_data) / (1024 * 1024)
-            if (file_size_mb > Config.GEMINI_MAX_AUDIO_SIZE_MB or 
-                voice.duration > Config.GEMINI_MAX_AUDIO_DURATION):
-                use_gemini = False
-                logger.info(f"Файл превышает лимиты Gemini (размер: {file_size_mb:.2f}MB, длительность: {voice.duration}s) - используем Speech API")
-        
-        if not use_gemini:
-            # Используем Google Speech API
-            text = await self.speech_service.transcribe_audio_simple(bytes(audio_data))
+        
+        if use_gemini and exceeds_gemini_limits:
+            logger.info(f"Файл превышает лимиты Gemini (размер: {file_size_mb:.2f}MB, длительность: {duration:.1f}s) - транскрибируем по кускам")
+            text = await self.chunked_transcriber.transcribe(audio_data)
+            transcription_method = "Gemini (по кускам)"
+            
+            if not text and Config.TRANSCRIPTION_MODE != "gemini_only":
+                logger.warning("Gemini не распознал куски - переключаемся на Speech API")
+                text = await self.chunked_transcriber.transcribe(audio_data, use_speech_api=True)
+                transcription_method = "Google Speech API (по кускам)"
+        elif not use_gemini:
+            # Используем Google Speech API (запись длиннее минуты - по кускам)
+            text = await self.chunked_transcriber.transcribe(audio_data, use_speech_api=True)
             transcription_method = "Google Speech API"
+        elif Config.TRANSCRIPTION_MODE == "hedged":
+            # Gemini и Speech API соревнуются, резервный стартует с задержкой
+            text, winner = await self.transcriber.transcribe(audio or audio_data, audio_data)
+            transcription_method = f"{ENGINE_NAMES.get(winner, winner)} (hedged)"
         else:
             # Сначала пробуем Gemini (основной метод)
             try:
-                text = await self.gemini_service.transcribe_audio(bytes(audio_data))
+                text = await self.gemini_service.transcribe_audio(audio or audio_data)
                 transcription_method = "Gemini"
                 
                 if not text and Config.TRANSCRIPTION_MODE != "gemini_only":
                     logger.warning("Gemini вернул пустой результат - переключаемся на Speech API")
-                    text = await self.speech_service.transcribe_audio_simple(bytes(audio_data))
+                    text = await self.speech_service.transcribe_audio_simple(audio_data)
                     transcription_method = "Google Speech API (fallback)"
                     
             except Exception as e:
                 logger.warning(f"Ошибка в Gemini транскрипции: {e}")
                 if Config.TRANSCRIPTION_MODE != "gemini_only":
-                    text = await self.speech_service.transcribe_audio_simple(bytes(audio_data))
+                    text = await self.speech_service.transcribe_audio_simple(audio_data)
                     transcription_method = "Google Speech API (error fallback)"
                 else:
                     text = None
@@ -303,17 +518,24 @@ class MessageHandlers:
             return
         
         logger.info(f"Транскрипция завершена ({transcription_method}): {text}")
+        self.transcript_cache.put(text, voice.file_unique_id, audio_data)
+        
+        await self._answer_transcribed_text(update, thinking_message, user_id, text, context_string)
+    
+    async def _answer_transcribed_text(self, update, thinking_message, user_id: int, text: str, context_string: str):
+        """Отвечает на распознанный текст голосового сообщения"""
+        if Config.STREAM_RESPONSES:
+            # Показываем ответ по мере генерации
+            stream = self.gemini_service.stream_short_answer(text, context_string)
+            if not await self._stream_answer(update, thinking_message, user_id, stream, context_string, text):
+                await thinking_message.edit_text("❌ Произошла ошибка при обработке голосового сообщения.")
+            return
         
         # Обрабатываем вопрос (статус остается "🦉 Уху...")
         full_answer, short_answer = await self.gemini_service.process_with_context(text, context_string)
         
-        # Сохраняем в контекст
-        self.context_manager.add_to_context(user_id, "user", text)
-        self.context_manager.add_to_context(user_id, "assistant", full_answer)
-        
-        # Создаем ID для ответа и сохраняем полный ответ
-        answer_id = self.context_manager.get_next_answer_id(user_id)
-        self.context_manager.save_full_answer(user_id, answer_id, full_answer, short_answer, text)
+        # Сохраняем вопрос и ответ
+        answer_id = self._save_answer(user_id, text, full_answer, short_answer, context_string)
         
         # Формируем краткий ответ для отображения
         limit_info = self.context_manager.get_limit_info_text(user_id)
@@ -3,11 +3,17 @@ Telegram бот-советник с модульной архитектурой.
 """
 
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
 from config import Config
 from utils.context import ContextManager
+from utils.cache import TranscriptCache
+from utils.user_queue import UserWorkQueue
+from storage import create_storage
 from services.gemini import GeminiService
 from services.speech import SpeechService
+from services.full_answers import FullAnswerService
+from services.dialog_summary import DialogSummarizer
 from handlers.commands import CommandHandlers
 from handlers.messages import MessageHandlers
 from handlers.buttons import ButtonHandlers
@@ -27,21 +33,38 @@ class AdvisorBot:
         Config.validate()
         
         # Инициализируем основные компоненты
-        self.context_manager = ContextManager()
+        self.context_manager = ContextManager(create_storage())
         self.gemini_service = GeminiService()
         self.speech_service = SpeechService()
+        self.transcript_cache = TranscriptCache()
+        self.full_answer_service = FullAnswerService(self.context_manager, self.gemini_service)
+        self.dialog_summarizer = DialogSummarizer(self.context_manager, self.gemini_service)
+        
+        # Сообщения каждого пользователя обрабатываются по очереди
+        self.user_queue = UserWorkQueue()
         
         # Инициализируем обработчики
         self.command_handlers = CommandHandlers(self.context_manager)
         self.message_handlers = MessageHandlers(
             self.context_manager, 
             self.gemini_service, 
-            self.speech_service
+            self.speech_service,
+            self.full_answer_service,
+            self.transcript_cache,
+            self.dialog_summarizer
+        )
+        self.button_handlers = ButtonHandlers(
+            self.context_manager, self.gemini_service, self.full_answer_service, self.dialog_summarizer
         )
-        self.button_handlers = ButtonHandlers(self.context_manager, self.gemini_service)
         
-        # Создаем приложение
-        self.application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+        # Создаем приложение (апдейты обрабатываются параллельно, без ожидания друг друга)
+        self.application = (
+            Application.builder()
+            .token(Config.TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(Config.MAX_CONCURRENT_UPDATES)
+            .post_shutdown(self._on_shutdown)
+            .build()
+        )
         
         # Настраиваем обработчики
         self._setup_handlers()
@@ -52,16 +75,20 @@ class AdvisorBot:
         """Настройка всех обработчиков событий"""
         logger.info("⚙️ Настраиваю обработчики...")
         
+        # До любого обработчика: данные пользователя читаются из хранилища вне цикла событий
+        self.application.add_handler(TypeHandler(Update, self._preload_user), group=-1)
+        
         # Обработчики команд
-        self.application.add_handler(CommandHandler("start", self.command_handlers.start))
-        self.application.add_handler(CommandHandler("clear", self.command_handlers.clear_command))
+        # /start и /clear очищают контекст - в очереди пользователя, после текущего ответа
+        self.application.add_handler(CommandHandler("start", self._queued(self.command_handlers.start)))
+        self.application.add_handler(CommandHandler("clear", self._queued(self.command_handlers.clear_command)))
         self.application.add_handler(CommandHandler("help", self.command_handlers.help_command))
         
         # Обработчик нажатий на inline кнопки
-        self.application.add_handler(CallbackQueryHandler(self.button_handlers.handle_inline_button))
+        self.application.add_handler(CallbackQueryHandler(self._handle_inline_button))
         
         # Обработчик голосовых сообщений
-        self.application.add_handler(MessageHandler(filters.VOICE, self.message_handlers.handle_voice_message))
+        self.application.add_handler(MessageHandler(filters.VOICE, self._handle_voice))
         
         # Обработчик текстовых сообщений (включая кнопки клавиатуры)
         self.application.add_handler(MessageHandler(
@@ -71,6 +98,20 @@ class AdvisorBot:
         
         logger.info("✅ Обработчики настроены!")
     
+    async def _preload_user(self, update, context):
+        """Загружает контекст пользователя апдейта в память (см. ContextManager.preload_user)"""
+        if update.effective_user:
+            await self.context_manager.preload_user(update.effective_user.id)
+    
+    async def _on_shutdown(self, application):
+        """Сохраняет накопленные изменения контекста и освобождает ресурсы при остановке"""
+        await self.user_queue.join()
+        self.context_manager.close()
+        logger.info("💾 Контекст пользователей сохранен")
+        self.transcript_cache.close()
+        await self.gemini_service.close()
+        await self.speech_service.close()
+    
     async def _handle_text_with_buttons(self, update, context):
         """Универсальный обработчик текста с поддержкой кнопок"""
         text = update.message.text
@@ -81,14 +122,33 @@ class AdvisorBot:
             "⚙️ Настройки", "🧹 Очистить память", "ℹ️ Справка"
         ]
         
+        user_id = update.effective_user.id
         if text in keyboard_buttons:
-            # Обрабатываем как кнопку клавиатуры
-            await self.button_handlers.handle_keyboard_button(
+            # Обрабатываем как кнопку клавиатуры (в очереди: "🧹 Очистить память" меняет контекст)
+            self.user_queue.submit(
+                user_id, self.button_handlers.handle_keyboard_button,
                 update, context, self.message_handlers, self.command_handlers
             )
         else:
-            # Обрабатываем как обычное текстовое сообщение
-            await self.message_handlers.handle_text_message(update, context)
+            # Обрабатываем как обычное текстовое сообщение (серия сообщений может объединиться)
+            self.user_queue.submit_text(user_id, self.message_handlers.handle_text_message, text, update, context)
+    
+    def _queued(self, handler):
+        """Обработчик апдейта, выполняемый в очереди сообщений пользователя"""
+        async def enqueue(update, context):
+            self.user_queue.submit(update.effective_user.id, handler, update, context)
+        return enqueue
+    
+    async def _handle_inline_button(self, update, context):
+        """Кнопки, меняющие историю диалога, ждут в очереди пользователя; остальные отвечают сразу"""
+        if self.button_handlers.changes_context(update.callback_query.data):
+            self.user_queue.submit(update.effective_user.id, self.button_handlers.handle_inline_button, update, context)
+        else:
+            await self.button_handlers.handle_inline_button(update, context)
+    
+    async def _handle_voice(self, update, context):
+        """Голосовые сообщения обрабатываются в той же очереди пользователя, что и текст"""
+        self.user_queue.submit(update.effective_user.id, self.message_handlers.handle_voice_message, update, context)
     
     def run(self):
         """Запуск бота"""
@@ -98,7 +158,13 @@ class AdvisorBot:
         logger.info(f"   🎧 Режим обработки аудио: {Config.AUDIO_PROCESSING_MODE}")
         logger.info(f"   📝 Режим транскрипции: {Config.TRANSCRIPTION_MODE}")
         logger.info(f"   💬 Лимит контекста: {Config.MAX_CONTEXT_MESSAGES} сообщений")
+        logger.info(f"   💾 Хранилище контекста: {Config.STORAGE_BACKEND}")
         logger.info(f"   📄 Лимит сообщения: {Config.MESSAGE_LENGTH_LIMIT} символов")
+        logger.info(f"   ✍️ Режим генерации ответа: {Config.ANSWER_GENERATION_MODE}")
+        logger.info(f"   ⚡ Потоковый вывод: {'ДА' if Config.STREAM_RESPONSES else 'НЕТ'}")
+        logger.info(f"   ⚙️ Параллельных запросов к Gemini: {Config.GEMINI_MAX_CONCURRENT_REQUESTS}")
+        logger.info(f"   🚦 Очередь к Gemini: до {Config.GEMINI_MAX_QUEUE or '∞'} запросов")
+        logger.info(f"   🗄️ Кэш системного промпта: {'ДА' if Config.PROMPT_CACHE_ENABLED else 'НЕТ'}")
         logger.info(f"   🎯 Прямая обработка аудио: {'ДА' if Config.should_use_direct_audio_mode() else 'НЕТ'}")
         
         try:
@@ -2,58 +2,206 @@
 Модели пользовательских данных.
 """
 
+import time
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Set
+
+CONTEXT_HEADER = "История разговора:\n"
+CONTEXT_FOOTER = "\n\n"
+
+def estimate_tokens(text: str) -> int:
+    """Примерное количество токенов (см. utils.tokens)"""
+    # Импорт здесь: пакет utils при инициализации сам импортирует models
+    from utils.tokens import estimate_tokens as estimate
+    return estimate(text)
 
 @dataclass
 class UserData:
-    """Данные пользователя"""
+    """
+    Данные пользователя
+    
+    Строка контекста для промпта хранится готовой и обновляется при каждом изменении
+    истории: новое сообщение дописывается в конец, вытесненное отрезается с начала.
+    
+    История ограничивается max_context_length сообщениями и, если задан
+    context_token_budget, примерным числом токенов (вытесняются самые старые сообщения).
+    При collapse_answers прошлые ответы советника заменяются в истории краткими.
+    
+    Резюме диалога хранится как контрольная точка: текст резюме и число сообщений чата,
+    которые в нем учтены. Следующее резюме дописывает в него только новые сообщения.
+    """
     user_id: int
     context_messages: List[Dict[str, str]] = field(default_factory=list)
     full_answers: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    stored_answers: Set[int] = field(default_factory=set)  # Вытеснены из памяти, но остались в хранилище
     user_message_count: int = 0  # НОВОЕ: счетчик сообщений только от пользователя
     max_context_length: int = 20  # Для хранения истории (старая логика)
+    context_token_budget: int = 0  # Бюджет истории в токенах (0 - только лимит сообщений)
+    collapse_answers: bool = False  # Сворачивать прошлые ответы до краткой версии
+    next_answer_id: int = 0  # ID следующего ответа (не зависит от вытеснения старых ответов)
+    messages_added: int = 0  # Сколько сообщений добавлено в текущий чат (не уменьшается при вытеснении)
+    chat_number: int = 0  # Номер чата: меняется при очистке и начале нового чата
+    summary: Optional[str] = None  # Резюме диалога на контрольной точке
+    summary_checkpoint: int = 0  # messages_added на момент резюме
+    last_access: float = field(default_factory=time.time)  # Для выгрузки неактивных пользователей
+    _context_string: str = field(default="", init=False, repr=False, compare=False)
+    _line_lengths: deque = field(default_factory=deque, init=False, repr=False, compare=False)
+    _line_tokens: deque = field(default_factory=deque, init=False, repr=False, compare=False)
+    _context_tokens: int = field(default=0, init=False, repr=False, compare=False)
     
-    def add_to_context(self, role: str, content: str):
-        """Добавляет сообщение в контекст пользователя"""
-        self.context_messages.append({
+    def __post_init__(self):
+        self._rebuild_context_string()
+    
+    @staticmethod
+    def _render_message(msg: Dict[str, str]) -> str:
+        """Строка одного сообщения в истории разговора"""
+        if msg['role'] == 'user':
+            return f"Пользователь: {msg['content']}"
+        return f"Советник: {msg['content']}"
+    
+    def _rebuild_context_string(self):
+        """Полностью пересобирает строку контекста (после очистки или загрузки)"""
+        lines = [self._render_message(msg) for msg in self.context_messages]
+        self._line_lengths = deque(len(line) for line in lines)
+        self._line_tokens = deque(estimate_tokens(line) for line in lines)
+        self._context_tokens = sum(self._line_tokens)
+        self._context_string = CONTEXT_HEADER + "\n".join(lines) + CONTEXT_FOOTER if lines else ""
+    
+    def add_to_context(self, role: str, content: str, short_content: Optional[str] = None):
+        """
+        Добавляет сообщение в контекст пользователя
+        
+        Args:
+            role: 'user' или 'assistant'
+            content: Текст сообщения
+            short_content: Краткая версия ответа советника (для сворачивания в истории)
+        """
+        if self.collapse_answers and role == 'assistant':
+            self._collapse_previous_answer()
+        
+        msg = {
             'role': role,
             'content': content
-        })
+        }
+        if short_content and short_content != content:
+            msg['short'] = short_content
+        self.context_messages.append(msg)
+        self.messages_added += 1
         
         # НОВОЕ: увеличиваем счетчик только для сообщений пользователя
         if role == 'user':
             self.user_message_count += 1
         
-        # Ограничиваем размер контекста для хранения истории
-        if len(self.context_messages) > self.max_context_length:
-            self.context_messages = self.context_messages[-self.max_context_length:]
+        line = self._render_message(msg)
+        tokens = estimate_tokens(line)
+        self._line_lengths.append(len(line))
+        self._line_tokens.append(tokens)
+        self._context_tokens += tokens
+        
+        # Ограничиваем размер контекста (новое сообщение остается всегда)
+        drop = min(max(0, len(self.context_messages) - self.max_context_length), len(self.context_messages) - 1)
+        if self.context_token_budget:
+            remaining = self._context_tokens - sum(self._line_tokens[i] for i in range(drop))
+            while remaining > self.context_token_budget and drop < len(self.context_messages) - 1:
+                remaining -= self._line_tokens[drop]
+                drop += 1
+        
+        cut = 0
+        if drop:
+            del self.context_messages[:drop]
+            for _ in range(drop):
+                # Вытесненные строки отрезаются вместе с разделителями "\n"
+                cut += self._line_lengths.popleft() + 1
+                self._context_tokens -= self._line_tokens.popleft()
+        
+        # Дописываем новую строку и отрезаем вытесненные за одно копирование
+        old = self._context_string
+        body = old[len(CONTEXT_HEADER) + cut:len(old) - len(CONTEXT_FOOTER)] if old else ""
+        if body:
+            self._context_string = "".join((CONTEXT_HEADER, body, "\n", line, CONTEXT_FOOTER))
+        else:
+            self._context_string = CONTEXT_HEADER + line + CONTEXT_FOOTER
     
-    def get_context_string(self) -> str:
-        """Формирует строку с контекстом разговора"""
-        if not self.context_messages:
-            return ""
+    def _collapse_previous_answer(self):
+        """Заменяет последний ответ советника в истории его краткой версией"""
+        for index in range(len(self.context_messages) - 1, -1, -1):
+            msg = self.context_messages[index]
+            if msg['role'] != 'assistant':
+                continue
+            if 'short' not in msg:
+                return
+            
+            msg['content'] = msg.pop('short')
+            line = self._render_message(msg)
+            tokens = estimate_tokens(line)
+            
+            offset = len(CONTEXT_HEADER) + sum(self._line_lengths[i] + 1 for i in range(index))
+            end = offset + self._line_lengths[index]
+            self._context_string = "".join((self._context_string[:offset], line, self._context_string[end:]))
+            self._context_tokens += tokens - self._line_tokens[index]
+            self._line_lengths[index] = len(line)
+            self._line_tokens[index] = tokens
+            return
+    
+    def get_summary_delta(self) -> tuple:
+        """
+        Резюме на контрольной точке и сообщения после нее
         
-        context_parts = []
-        for msg in self.context_messages:
-            if msg['role'] == 'user':
-                context_parts.append(f"Пользователь: {msg['content']}")
-            else:
-                context_parts.append(f"Советник: {msg['content']}")
+        Returns:
+            tuple: (резюме или None, новые сообщения, точка (номер чата, messages_added) для сохранения)
+        """
+        new_count = self.messages_added - self.summary_checkpoint
+        if self.summary is None:
+            # Резюме еще нет - учитывается вся история
+            messages = list(self.context_messages)
+        else:
+            # Вытесненные из истории сообщения уже недоступны - учитываются оставшиеся
+            messages = self.context_messages[max(0, len(self.context_messages) - new_count):] if new_count else []
+        return self.summary, messages, (self.chat_number, self.messages_added)
+    
+    def save_summary_checkpoint(self, summary: str, point: tuple) -> bool:
+        """
+        Сохраняет резюме, учитывающее сообщения до point (см. get_summary_delta)
         
-        return "История разговора:\n" + "\n".join(context_parts) + "\n\n"
+        Returns:
+            bool: False, если чат сменился или уже есть более новое резюме
+        """
+        chat_number, messages_added = point
+        if chat_number != self.chat_number or (self.summary is not None and messages_added < self.summary_checkpoint):
+            return False
+        self.summary = summary
+        self.summary_checkpoint = messages_added
+        return True
+    
+    @classmethod
+    def render_messages(cls, messages: List[Dict[str, str]]) -> str:
+        """Текст сообщений в формате истории разговора (без заголовка)"""
+        return "\n".join(cls._render_message(msg) for msg in messages)
+    
+    def get_context_tokens(self) -> int:
+        """Примерное количество токенов в истории разговора"""
+        return self._context_tokens
+    
+    def get_context_string(self) -> str:
+        """Возвращает строку с контекстом разговора"""
+        return self._context_string
     
     def clear_context(self):
         """Очищает контекст пользователя и сбрасывает счетчик"""
         self.context_messages.clear()
         self.full_answers.clear()
+        self.stored_answers.clear()
         self.user_message_count = 0  # НОВОЕ: сброс счетчика
+        self._reset_summary(None)
+        self._rebuild_context_string()
     
     def start_new_chat_with_summary(self, summary: str):
         """Начинает новый чат с резюме предыдущего диалога"""
         # Очищаем контекст и счетчик
         self.context_messages.clear()
         self.full_answers.clear()
+        self.stored_answers.clear()
         self.user_message_count = 0
         
         # Добавляем резюме как первое сообщение "системы" (не увеличивает счетчик)
@@ -61,16 +209,33 @@ class UserData:
             'role': 'assistant',
             'content': f"Резюме предыдущего диалога: {summary}"
         })
+        # Резюме нового чата будет дописываться к резюме предыдущего
+        self._reset_summary(summary)
+        self._rebuild_context_string()
+    
+    def _reset_summary(self, summary: Optional[str]):
+        """Начинает новый чат для контрольной точки резюме"""
+        self.chat_number += 1
+        self.messages_added = 0
+        self.summary = summary
+        self.summary_checkpoint = 0
     
-    def save_full_answer(self, answer_id: int, full_answer: str, short_answer: str, 
-                        question: str, message_id: Optional[int] = None):
-        """Сохраняет полный ответ для возможности показа по запросу"""
+    def save_full_answer(self, answer_id: int, full_answer: Optional[str], short_answer: str, 
+                        question: str, message_id: Optional[int] = None, context: Optional[str] = None):
+        """
+        Сохраняет полный ответ для возможности показа по запросу
+        
+        Если полный ответ еще не сгенерирован (режим lazy), full_answer равен None,
+        а context хранит контекст разговора на момент вопроса для его генерации.
+        """
         self.full_answers[answer_id] = {
             'full_answer': full_answer,
             'short_answer': short_answer,
             'question': question,
-            'message_id': message_id
+            'message_id': message_id,
+            'context': context
         }
+        self.next_answer_id = max(self.next_answer_id, answer_id + 1)
     
     def get_full_answer(self, answer_id: int) -> Optional[Dict[str, Any]]:
         """Получает полный ответ по ID"""
@@ -98,4 +263,45 @@ class UserData:
     
     def get_next_answer_id(self) -> int:
         """Возвращает следующий ID для ответа"""
-        return len(self.full_answers) 
\ No newline at end of file
+        return self.next_answer_id
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Снимок данных пользователя для хранилища (не зависит от дальнейших изменений)"""
+        return {
+            'user_id': self.user_id,
+            'context_messages': [dict(msg) for msg in self.context_messages],
+            'full_answers': {answer_id: dict(answer) for answer_id, answer in self.full_answers.items()},
+            # Эти ответы хранилище переносит из предыдущего снимка (см. BatchingStorage)
+            'stored_answers': sorted(self.stored_answers),
+            'user_message_count': self.user_message_count,
+            'next_answer_id': self.next_answer_id,
+            'messages_added': self.messages_added,
+            'chat_number': self.chat_number,
+            'summary': self.summary,
+            'summary_checkpoint': self.summary_checkpoint
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **limits) -> 'UserData':
+        """
+        Восстанавливает данные пользователя из хранилища
+        
+        Args:
+            data: Словарь из to_dict()
+            **limits: Текущие лимиты контекста (max_context_length, context_token_budget, collapse_answers)
+        """
+        # JSON хранит ключи строками
+        full_answers = {int(answer_id): answer for answer_id, answer in data.get('full_answers', {}).items()}
+        return cls(
+            user_id=data['user_id'],
+            context_messages=list(data.get('context_messages', [])),
+            full_answers=full_answers,
+            stored_answers=set(data.get('stored_answers', [])) - set(full_answers),
+            user_message_count=data.get('user_message_count', 0),
+            next_answer_id=data.get('next_answer_id', max(full_answers, default=-1) + 1),
+            messages_added=data.get('messages_added', len(data.get('context_messages', []))),
+            chat_number=data.get('chat_number', 0),
+            summary=data.get('summary'),
+            summary_checkpoint=data.get('summary_checkpoint', 0),
+            **limits
+        )
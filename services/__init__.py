@@ -4,5 +4,12 @@
 
 from .gemini import GeminiService
 from .speech import SpeechService
+from .llm_executor import LLMExecutor
+from .full_answers import FullAnswerService
+from .prompt_cache import PromptCache
+from .audio_session import AudioSession
+from .transcription import HedgedTranscriber, ChunkedTranscriber
+from .dialog_summary import DialogSummarizer
 
-__all__ = ['GeminiService', 'SpeechService'] 
\ No newline at end of file
+__all__ = ['GeminiService', 'SpeechService', 'LLMExecutor', 'FullAnswerService', 'PromptCache', 'AudioSession',
+           'HedgedTranscriber', 'ChunkedTranscriber', 'DialogSummarizer'] 
\ No newline at end of file
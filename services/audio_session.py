@@ -0,0 +1,78 @@
+"""
+Сессия голосового сообщения: аудио загружается в Gemini один раз на весь конвейер.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class AudioSession:
+    """
+    Голосовое сообщение, общее для всех этапов обработки.
+
+    Короткое аудио (не больше inline_max_bytes) передается прямо в запросе.
+    Большое загружается в Gemini при первом обращении и используется повторно
+    (прямая обработка, транскрипция при ее неудаче, анализ качества);
+    удаляется только в close() - после завершения всего конвейера.
+    """
+
+    def __init__(self, data: bytes, upload: Callable[[bytes, Optional[float]], Awaitable[Any]],
+                 cleanup: Callable[[Any], Awaitable[None]],
+                 inline_max_bytes: int = 0, mime_type: str = "audio/ogg", deadline: Optional[float] = None):
+        """
+        Args:
+            data: Байты аудиофайла (один буфер на весь конвейер, этапы его не копируют)
+            upload: Загрузка аудио, возвращает файл Gemini
+            cleanup: Удаление файла Gemini
+            inline_max_bytes: Максимальный размер аудио для передачи в запросе (0 - всегда загружать)
+            mime_type: MIME-тип аудио
+            deadline: Крайний срок подготовки файла (time.monotonic), None - по умолчанию загрузчика
+        """
+        self.data = data
+        self.mime_type = mime_type
+        self.deadline = deadline
+        self.inline = 0 < len(data) <= inline_max_bytes
+        self._upload = upload
+        self._cleanup = cleanup
+        self._lock = asyncio.Lock()
+        self._file = None
+        self.uses = 0
+
+    async def get_part(self):
+        """
+        Возвращает часть запроса с аудио: байты для короткого аудио,
+        иначе файл Gemini (загружается при первом вызове)
+
+        Raises:
+            AudioProcessingError: Аудио не удалось подготовить
+        """
+        if self.inline:
+            self.uses += 1
+            metrics.inc('audio.inline')
+            return {'mime_type': self.mime_type, 'data': self.data}
+
+        async with self._lock:
+            if self._file is None:
+                # При ошибке загрузки следующий этап попробует снова
+                self._file = await self._upload(self.data, self.deadline)
+            else:
+                metrics.inc('audio.upload_reused')
+                logger.info("♻️ Используем уже загруженный аудиофайл")
+            self.uses += 1
+            return self._file
+
+    async def close(self):
+        """Удаляет файл из Gemini"""
+        async with self._lock:
+            audio_file, self._file = self._file, None
+        if audio_file is not None:
+            await self._cleanup(audio_file)
+
+    async def __aenter__(self) -> 'AudioSession':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
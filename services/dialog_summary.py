@@ -0,0 +1,157 @@
+"""
+Инкрементальное резюме диалога: новые сообщения дописываются к готовому резюме.
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Optional
+from config import Config
+from models.user import UserData
+from services.gemini import GeminiService
+from services.llm_executor import PRIORITY_BACKGROUND, RequestTicket, use_request
+from utils.cache import TTLCache
+from utils.context import ContextManager
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class DialogSummarizer:
+    """
+    Поддерживает резюме диалога, не перечитывая всю историю
+    
+    Резюме хранится контрольной точкой в UserData; в него дописываются только
+    сообщения после точки, поэтому стоимость резюме не растет с длиной разговора.
+    С предупреждения о лимите (7-е сообщение) резюме обновляется в фоне после каждого
+    ответа, и на 10-м сообщении новый чат начинается почти сразу.
+    """
+
+    def __init__(self, context_manager: ContextManager, gemini_service: GeminiService, cache: TTLCache = None):
+        """
+        Инициализация сервиса
+
+        Args:
+            context_manager: Менеджер контекста пользователей
+            gemini_service: Сервис Gemini
+            cache: Готовые резюме по хешу контекста (по умолчанию - по настройкам DIALOG_SUMMARY_CACHE_*)
+        """
+        self.context_manager = context_manager
+        self.gemini_service = gemini_service
+        self.cache = cache or TTLCache(
+            'dialog_summary',
+            max_entries=Config.DIALOG_SUMMARY_CACHE_SIZE,
+            ttl=Config.DIALOG_SUMMARY_CACHE_TTL
+        )
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._tickets: Dict[int, RequestTicket] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def on_message(self, user_id: int):
+        """Вызывается после ответа; с 7-го сообщения до лимита дополняет резюме в фоне"""
+        if not Config.SUMMARY_PRECOMPUTE or self.context_manager.should_auto_create_summary(user_id):
+            return
+        if self.context_manager.get_user_message_count(user_id) < 7:
+            return
+        
+        task = self._tasks.get(user_id)
+        if task is None or task.done():
+            logger.info(f"📋 Обновляем резюме диалога пользователя {user_id} в фоне")
+            # Пользователь не ждет этого резюме - ответы другим пользователям важнее
+            ticket = RequestTicket(user_id, PRIORITY_BACKGROUND)
+            self._tasks[user_id] = asyncio.create_task(self._refresh(user_id, ticket))
+            self._tickets[user_id] = ticket
+
+    @staticmethod
+    def _cache_key(user_id: int, context_string: str) -> str:
+        return f"{user_id}:" + hashlib.sha256(context_string.encode('utf-8')).hexdigest()
+
+    async def summarize(self, user_id: int) -> str:
+        """
+        Возвращает резюме всего диалога, дописав в него новые сообщения
+
+        Резюме неизменившегося диалога берется из кэша; одновременные запросы
+        (двойное нажатие, "Резюме" и сразу "Резюме + новый чат") ждут одну генерацию.
+        Если резюме не удалось обновить, оно создается по всей истории, как раньше.
+        """
+        key = self._cache_key(user_id, self.context_manager.get_context_string(user_id))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._summarize(user_id, key))
+            self._inflight[key] = task
+        else:
+            metrics.inc('dialog_summary.joined')
+        # shield: отмена одного из ожидающих не должна прерывать общую генерацию
+        return await asyncio.shield(task)
+
+    async def _summarize(self, user_id: int, key: str) -> str:
+        """Генерирует резюме для summarize (одна задача на ключ)"""
+        try:
+            await self._wait_background(user_id)
+            
+            summary = await self._fold(user_id)
+            if summary:
+                self.cache.set(key, summary)
+                return summary
+            
+            context_string = self.context_manager.get_context_string(user_id)
+            return await self.gemini_service.generate_dialog_summary(context_string)
+        finally:
+            self._inflight.pop(key, None)
+
+    async def summary_for_rollover(self, user_id: int) -> str:
+        """Резюме для автоматического начала нового чата; учитывает, было ли оно готово заранее"""
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            metrics.inc('dialog_summary.rollover.stale')
+        elif self.context_manager.get_user(user_id).summary_checkpoint:
+            metrics.inc('dialog_summary.rollover.fresh')
+        else:
+            metrics.inc('dialog_summary.rollover.missing')
+        return await self.summarize(user_id)
+
+    async def _wait_background(self, user_id: int):
+        """Дожидается фонового обновления, чтобы не дописывать те же сообщения дважды"""
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            # Теперь обновления ждет пользователь: оно не должно стоять за чужими фоновыми запросами
+            self.gemini_service.executor.promote(self._tickets[user_id])
+            # shield: отмена обработчика не должна прерывать фоновое обновление
+            await asyncio.shield(task)
+
+    async def _refresh(self, user_id: int, ticket: RequestTicket):
+        """Дописывает в резюме новые сообщения, пока они появляются"""
+        use_request(ticket)
+        try:
+            while self.context_manager.get_summary_delta(user_id)[1]:
+                if await self._fold(user_id) is None:
+                    return
+        except Exception as e:
+            logger.error(f"Ошибка фонового резюме диалога: {e}")
+        finally:
+            if self._tasks.get(user_id) is asyncio.current_task():
+                del self._tasks[user_id]
+                del self._tickets[user_id]
+
+    async def _fold(self, user_id: int) -> Optional[str]:
+        """
+        Дописывает в резюме сообщения после контрольной точки
+
+        Returns:
+            str: Резюме всей истории или None, если его не удалось получить
+        """
+        summary, messages, point = self.context_manager.get_summary_delta(user_id)
+        if not messages:
+            return summary
+        
+        updated = await self.gemini_service.update_dialog_summary(summary, UserData.render_messages(messages))
+        if updated is None:
+            return None
+        
+        metrics.inc('dialog_summary.folds')
+        metrics.observe('dialog_summary.folded_messages', len(messages))
+        self.context_manager.save_summary_checkpoint(user_id, updated, point)
+        return updated
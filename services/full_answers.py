@@ -0,0 +1,108 @@
+"""
+Отложенная генерация полных ответов (режим lazy).
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+from config import Config
+from services.gemini import GeminiService
+from services.llm_executor import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RequestTicket, use_request
+from utils.context import ContextManager
+
+logger = logging.getLogger(__name__)
+
+class FullAnswerService:
+    """Генерирует полные ответы в фоне или по нажатию кнопки "📝 Полный ответ\""""
+
+    def __init__(self, context_manager: ContextManager, gemini_service: GeminiService):
+        """
+        Инициализация сервиса
+
+        Args:
+            context_manager: Менеджер контекста пользователей
+            gemini_service: Сервис Gemini
+        """
+        self.context_manager = context_manager
+        self.gemini_service = gemini_service
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._tickets: Dict[Tuple[int, int], RequestTicket] = {}
+
+    @staticmethod
+    def is_pending(answer_data: Optional[Dict[str, Any]]) -> bool:
+        """Проверяет, что полный ответ еще не сгенерирован"""
+        return bool(answer_data) and answer_data.get('full_answer') is None
+
+    def on_answer_saved(self, user_id: int, answer_id: int):
+        """Вызывается после сохранения краткого ответа; в режиме background запускает генерацию"""
+        if Config.LAZY_FULL_ANSWER == 'background':
+            self._get_task(user_id, answer_id, PRIORITY_BACKGROUND)
+
+    async def ensure_full_answer(self, user_id: int, answer_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает данные ответа, при необходимости дожидаясь генерации полного ответа
+
+        Повторные нажатия и фоновая генерация используют одну и ту же задачу.
+
+        Returns:
+            dict: Данные ответа (full_answer остается None, если генерация не удалась)
+        """
+        answer_data = self.context_manager.get_full_answer(user_id, answer_id)
+        if not self.is_pending(answer_data):
+            return answer_data
+
+        task = self._get_task(user_id, answer_id)
+        # Фоновая генерация, которую теперь ждет пользователь, не должна стоять за чужими фоновыми запросами
+        self.gemini_service.executor.promote(self._tickets[(user_id, answer_id)])
+        # shield: отмена обработчика кнопки не должна прерывать общую генерацию
+        await asyncio.shield(task)
+        return self.context_manager.get_full_answer(user_id, answer_id)
+
+    @classmethod
+    def _same_answer(cls, current: Optional[Dict[str, Any]], original: Dict[str, Any]) -> bool:
+        """Тот же ли это еще не сгенерированный ответ, для которого запускалась генерация"""
+        return cls.is_pending(current) and all(
+            current.get(field) == original.get(field) for field in ('question', 'short_answer', 'message_id')
+        )
+
+    def _get_task(self, user_id: int, answer_id: int, priority: int = PRIORITY_INTERACTIVE) -> asyncio.Task:
+        """Возвращает текущую задачу генерации или создает новую"""
+        key = (user_id, answer_id)
+        task = self._tasks.get(key)
+        if task is None:
+            ticket = RequestTicket(user_id, priority)
+            task = asyncio.create_task(self._generate(user_id, answer_id, ticket))
+            self._tasks[key] = task
+            self._tickets[key] = ticket
+        return task
+
+    async def _generate(self, user_id: int, answer_id: int, ticket: RequestTicket):
+        """Генерирует полный ответ и сохраняет его через ContextManager"""
+        use_request(ticket)
+        try:
+            answer_data = self.context_manager.get_full_answer(user_id, answer_id)
+            if not self.is_pending(answer_data):
+                return
+
+            logger.info(f"📝 Генерируем отложенный полный ответ {answer_id} для пользователя {user_id}")
+            full_answer = await self.gemini_service.generate_full_answer(
+                answer_data['question'], answer_data.get('context') or ""
+            )
+            if not full_answer:
+                return
+
+            # Ответ мог быть удален (новый чат) или заменен, пока шла генерация; сам словарь
+            # при этом может быть другим (ответ вытеснялся из памяти, пользователь выгружался)
+            if not self._same_answer(self.context_manager.get_full_answer(user_id, answer_id), answer_data):
+                logger.info(f"Ответ {answer_id} пользователя {user_id} устарел, полный ответ не сохранен")
+                return
+
+            self.context_manager.save_full_answer(
+                user_id, answer_id, full_answer, answer_data['short_answer'],
+                answer_data['question'], answer_data.get('message_id')
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отложенной генерации полного ответа: {e}")
+        finally:
+            self._tasks.pop((user_id, answer_id), None)
+            self._tickets.pop((user_id, answer_id), None)
@@ -2,19 +2,82 @@
 Сервис для работы с Google Gemini API.
 """
 
+import asyncio
+import io
+import json
 import logging
+import time
+from typing import AsyncIterator, Optional, Union
 import google.generativeai as genai
 from config import Config
+from services.llm_executor import LLMExecutor
+from services.audio_session import AudioSession
+from services.prompt_cache import PromptCache
+from utils.metrics import metrics
+from utils.tokens import estimate_tokens
+from utils.ogg import OggError, analyze_opus
 
 logger = logging.getLogger(__name__)
 
+# Схема структурированного ответа для однопроходного режима
+ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "full_answer": {"type": "string"},
+        "short_answer": {"type": "string"}
+    },
+    "required": ["full_answer", "short_answer"]
+}
+
+# Поля ответа на голосовое сообщение: расшифровка приходит в том же запросе, что и ответ
+AUDIO_FIELD_PROMPTS = {
+    "full_answer": 'Поле "full_answer" - полный развернутый ответ на вопрос пользователя.',
+    "short_answer": 'Поле "short_answer" - сокращенная версия ответа по следующему правилу:',
+}
+
+# Разделитель расшифровки и ответа при потоковой генерации (см. AUDIO_STREAM_FORMAT_PROMPT)
+STREAM_TRANSCRIPT_PREFIX = "Вопрос:"
+STREAM_TRANSCRIPT_DELIMITER = "==="
+# Если разделителя нет в первых символах, модель не соблюла формат - весь текст считается ответом
+STREAM_TRANSCRIPT_MAX_CHARS = 3000
+
+def audio_answer_schema(fields: tuple) -> dict:
+    """Схема JSON-ответа на голосовое сообщение с расшифровкой и указанными полями"""
+    return {
+        "type": "object",
+        "properties": {name: {"type": "string"} for name in ("transcript",) + fields},
+        "required": ["transcript", *fields]
+    }
+
+class StreamedTranscript:
+    """Расшифровка голосового сообщения, полученная в начале потокового ответа"""
+    
+    def __init__(self):
+        self.text: Optional[str] = None
+
+class AudioProcessingError(Exception):
+    """Ошибка подготовки аудио в Gemini с сообщением для пользователя"""
+    
+    def __init__(self, user_message: str):
+        super().__init__(user_message)
+        self.user_message = user_message
+
 class GeminiService:
     """Сервис для работы с Gemini API"""
     
-    def __init__(self):
-        """Инициализация сервиса Gemini"""
+    def __init__(self, executor: LLMExecutor = None, prompt_cache: PromptCache = None):
+        """
+        Инициализация сервиса Gemini
+        
+        Args:
+            executor: Исполнитель блокирующих вызовов SDK (создается по умолчанию)
+            prompt_cache: Модель для ответов с MAIN_PROMPT на стороне Gemini (создается по умолчанию)
+        """
         genai.configure(api_key=Config.GEMINI_API_KEY)
+        # Модель без системного промпта: транскрипция, сокращение, резюме
         self.model = genai.GenerativeModel(Config.GEMINI_MODEL)
+        self.executor = executor or LLMExecutor()
+        self.prompt_cache = prompt_cache or PromptCache(executor=self.executor)
         
         # Проверяем возможности модели
         supports_audio = Config.supports_direct_audio_processing()
@@ -33,33 +96,157 @@ class GeminiService:
             logger.info(f"🎧 Прямая обработка аудио недоступна для этой модели")
             logger.info(f"💡 Для включения используйте: gemini-1.5-*, gemini-2.0-* или gemini-2.5-*")
     
-    async def process_with_context(self, text: str, context: str) -> tuple[str, str]:
+    async def close(self):
+        """Освобождает ресурсы на стороне Gemini (кэш системного промпта)"""
+        await self.prompt_cache.close()
+    
+    def _record_latency(self, kind: str, mode: str, started: float):
+        """Записывает время получения ответа для выбранного режима генерации"""
+        elapsed = time.monotonic() - started
+        metrics.observe(f"answer_latency.{kind}.{mode}", elapsed)
+        logger.info(f"⏱️ Ответ ({kind}, режим {mode}) получен за {elapsed:.2f}s")
+    
+    async def _generate_single_call(self, prompt: str, attachment=None) -> Optional[tuple[str, str]]:
         """
-        Обрабатывает текст с помощью Gemini в два этапа с учетом контекста
+        Генерирует полный и краткий ответ одним запросом (структурированный JSON)
+        
+        Args:
+            prompt: Основной промпт
+            attachment: Дополнительная часть запроса (например, аудиофайл)
+            
+        Returns:
+            tuple: (полный_ответ, краткий_ответ) или None, если ответ не удалось разобрать
+        """
+        single_prompt = f"{prompt}\n\n{Config.SINGLE_CALL_FORMAT_PROMPT}\n{Config.SUMMARY_PROMPT}"
+        contents = [single_prompt, attachment] if attachment is not None else single_prompt
+        
+        try:
+            answer_model = await self.prompt_cache.get_model()
+            response = await self.executor.run(
+                answer_model.generate_content,
+                contents,
+                generation_config=genai.GenerationConfig(
+                    response_mime_type="application/json",
+                    response_schema=ANSWER_SCHEMA
+                )
+            )
+            data = json.loads(response.text)
+            full_answer = (data.get('full_answer') or '').strip()
+            short_answer = (data.get('short_answer') or '').strip()
+            if not full_answer:
+                raise ValueError("пустое поле full_answer")
+            return full_answer, short_answer or full_answer
+        
+        except Exception as e:
+            logger.warning(f"⚠️ Однопроходная генерация не удалась, используем двухэтапную: {e}")
+            return None
+    
+    async def _generate_audio_structured(self, audio_prompt: str, audio_part, fields: tuple) -> Optional[dict]:
+        """
+        Генерирует ответ на голосовое сообщение вместе с расшифровкой (структурированный JSON)
+        
+        Args:
+            audio_prompt: Промпт прямой обработки аудио
+            audio_part: Аудио (файл Gemini или inline-часть)
+            fields: Поля ответа помимо transcript (full_answer, short_answer)
+            
+        Returns:
+            dict: Поля ответа (transcript может быть пустым) или None, если ответ не удалось разобрать;
+                  ошибки запроса к модели пробрасываются
+        """
+        instructions = [audio_prompt, Config.AUDIO_JSON_FORMAT_PROMPT]
+        instructions.extend(AUDIO_FIELD_PROMPTS[name] for name in fields)
+        if 'short_answer' in fields:
+            instructions.append(Config.SUMMARY_PROMPT)
+        
+        answer_model = await self.prompt_cache.get_model()
+        response = await self.executor.run(
+            answer_model.generate_content,
+            ["\n\n".join(instructions), audio_part],
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=audio_answer_schema(fields)
+            )
+        )
+        
+        try:
+            data = json.loads(response.text)
+            result = {name: (data.get(name) or '').strip() for name in ("transcript",) + fields}
+            if not result[fields[0]]:
+                raise ValueError(f"пустое поле {fields[0]}")
+            return result
+        
+        except Exception as e:
+            logger.warning(f"⚠️ Структурированный ответ на аудио не удалось получить: {e}")
+            return None
+    
+    @staticmethod
+    def _record_prompt_tokens(kind: str, prompt: str, context: str):
+        """Пишет в лог и метрики примерный размер промпта в токенах"""
+        tokens = estimate_tokens(prompt)
+        metrics.observe(f'prompt_tokens.{kind}', tokens)
+        logger.info(f"🔢 Промпт ({kind}): ~{tokens} токенов, из них история ~{estimate_tokens(context)}")
+    
+    @classmethod
+    def _build_text_prompt(cls, text: str, context: str) -> str:
+        """Формирует промпт для ответа на текстовый вопрос (MAIN_PROMPT передается как system_instruction)"""
+        prompt = f"""{context}Новый вопрос пользователя: {text}
+
+Учитывай весь контекст разговора при формировании ответа. Если вопрос связан с предыдущими, обязательно на это ссылайся."""
+        cls._record_prompt_tokens('text', prompt, context)
+        return prompt
+    
+    @staticmethod
+    def _with_short_answer_instruction(prompt: str) -> str:
+        """Добавляет к промпту требование сразу дать краткий ответ (режим lazy)"""
+        return f"{prompt}\n\n{Config.LAZY_SHORT_ANSWER_PROMPT}\n{Config.SUMMARY_PROMPT}"
+    
+    async def process_with_context(self, text: str, context: str) -> tuple[Optional[str], str]:
+        """
+        Обрабатывает текст с помощью Gemini с учетом контекста
+        
+        В режиме single_call полный и краткий ответ приходят одним запросом,
+        в режиме lazy генерируется только краткий ответ (полный - по запросу),
+        иначе (или при ошибке разбора) - в два этапа.
         
         Args:
             text: Текст пользователя
             context: Контекст разговора
             
         Returns:
-            tuple: (полный_ответ, краткий_ответ)
+            tuple: (полный_ответ, краткий_ответ); в режиме lazy полный ответ равен None
         """
         try:
-            # Этап 1: Генерируем развернутый ответ с контекстом
-            full_prompt = f"""{Config.MAIN_PROMPT}
+            started = time.monotonic()
+            full_prompt = self._build_text_prompt(text, context)
 
-{context}Новый вопрос пользователя: {text}
+            if Config.ANSWER_GENERATION_MODE == 'lazy':
+                answer_model = await self.prompt_cache.get_model()
+                response = await self.executor.run(
+                    answer_model.generate_content, self._with_short_answer_instruction(full_prompt)
+                )
+                self._record_latency('text', 'lazy', started)
+                return None, response.text
 
-Учитывай весь контекст разговора при формировании ответа. Если вопрос связан с предыдущими, обязательно на это ссылайся."""
+            mode = 'two_stage'
+            if Config.ANSWER_GENERATION_MODE == 'single_call':
+                answers = await self._generate_single_call(full_prompt)
+                if answers:
+                    self._record_latency('text', 'single_call', started)
+                    return answers
+                mode = 'single_call_fallback'
 
-            response1 = self.model.generate_content(full_prompt)
+            # Этап 1: Генерируем развернутый ответ с контекстом
+            answer_model = await self.prompt_cache.get_model()
+            response1 = await self.executor.run(answer_model.generate_content, full_prompt)
             full_answer = response1.text
 
             # Этап 2: Сокращаем ответ
             summary_prompt = f"{Config.SUMMARY_PROMPT}\n\nТекст для сокращения: {full_answer}"
-            response2 = self.model.generate_content(summary_prompt)
+            response2 = await self.executor.run(self.model.generate_content, summary_prompt)
             short_answer = response2.text
 
+            self._record_latency('text', mode, started)
             return full_answer, short_answer
 
         except Exception as e:
@@ -67,58 +254,66 @@ class GeminiService:
             error_msg = "Извините, произошла ошибка при обработке вашего запроса. Попробуйте позже."
             return error_msg, error_msg
     
-    async def transcribe_audio(self, audio_data: bytes) -> str:
+    async def generate_full_answer(self, text: str, context: str) -> Optional[str]:
+        """
+        Генерирует только полный ответ (для отложенного раскрытия в режиме lazy)
+        
+        Args:
+            text: Вопрос пользователя
+            context: Контекст разговора на момент вопроса
+            
+        Returns:
+            str: Полный ответ или None при ошибке
+        """
+        try:
+            started = time.monotonic()
+            answer_model = await self.prompt_cache.get_model()
+            response = await self.executor.run(answer_model.generate_content, self._build_text_prompt(text, context))
+            self._record_latency('text', 'lazy_full', started)
+            return response.text or None
+        
+        except Exception as e:
+            logger.error(f"Ошибка при генерации полного ответа: {e}")
+            return None
+    
+    async def transcribe_audio(self, audio: Union[AudioSession, bytes]) -> str:
         """
         Использует Gemini для транскрипции аудио с улучшенным промптом
         
         Args:
-            audio_data: Байты аудиофайла
+            audio: Сессия голосового сообщения (файл уже может быть загружен) или байты аудио
             
         Returns:
             str: Транскрибированный текст или None при ошибке
         """
+        session, owned = self._session_for(audio)
         try:
-            import tempfile
-            import os
-            
-            # Создаем временный файл
-            with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_path = temp_file.name
-            
-            # Загружаем аудио в Gemini
-            audio_file = genai.upload_file(path=temp_path)
-            
-            # Ожидаем завершения обработки файла
-            import time
-            while audio_file.state.name == "PROCESSING":
-                time.sleep(2)
-                audio_file = genai.get_file(audio_file.name)
-            
-            if audio_file.state.name == "FAILED":
-                logger.error("Ошибка обработки аудиофайла в Gemini")
-                return None
+            audio_file = await session.get_part()
             
             # Используем улучшенный промпт для транскрипции
-            response = self.model.generate_content([
+            response = await self.executor.run(self.model.generate_content, [
                 Config.AUDIO_TRANSCRIPTION_PROMPT,
                 audio_file
             ])
             
-            # Удаляем временный файл и файл из Gemini
-            os.unlink(temp_path)
-            genai.delete_file(audio_file.name)
-            
             transcription = response.text.strip()
             
             # Логируем результат
             logger.info(f"Gemini транскрипция завершена, длина: {len(transcription)} символов")
             
             return transcription if transcription else None
+        
+        except AudioProcessingError:
+            logger.error("Ошибка обработки аудиофайла в Gemini")
+            return None
             
         except Exception as e:
             logger.error(f"Ошибка при транскрипции через Gemini: {e}")
             return None
+        
+        finally:
+            if owned:
+                await session.close()
     
     async def generate_dialog_summary(self, context: str) -> str:
         """
@@ -140,163 +335,210 @@ class GeminiService:
 
 Создай максимально подробное и структурированное резюме этого диалога."""
 
-            response = self.model.generate_content(summary_prompt)
+            response = await self.executor.run(self.model.generate_content, summary_prompt)
             return response.text
 
         except Exception as e:
             logger.error(f"Ошибка при генерации резюме диалога: {e}")
             return "Извините, произошла ошибка при создании резюме диалога."
 
-    async def analyze_audio_quality(self, audio_data: bytes) -> dict:
+    async def update_dialog_summary(self, summary: Optional[str], new_messages: str) -> Optional[str]:
         """
-        Анализирует качество аудио перед транскрипцией
+        Дополняет резюме диалога новыми сообщениями (без повторного чтения всей истории)
         
         Args:
-            audio_data: Байты аудиофайла
+            summary: Готовое резюме; None - резюме создается по new_messages с нуля
+            new_messages: Сообщения после резюме в формате истории разговора
             
         Returns:
-            dict: Информация о качестве аудио
+            str: Обновленное резюме или None при ошибке
         """
+        if summary is None:
+            prompt = f"""{Config.DIALOG_SUMMARY_PROMPT}
+
+{new_messages}
+
+Создай максимально подробное и структурированное резюме этого диалога."""
+        else:
+            prompt = f"""{Config.DIALOG_SUMMARY_UPDATE_PROMPT}
+
+Резюме: {summary}
+
+Новые сообщения:
+{new_messages}"""
+        
         try:
-            import tempfile
-            import os
-            
-            # Создаем временный файл
-            with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_path = temp_file.name
-            
-            # Загружаем аудио в Gemini
-            audio_file = genai.upload_file(path=temp_path)
-            
-            # Ожидаем завершения обработки файла
-            import time
-            while audio_file.state.name == "PROCESSING":
-                time.sleep(2)
-                audio_file = genai.get_file(audio_file.name)
-            
-            if audio_file.state.name == "FAILED":
-                return {"quality": "failed", "readable": False}
-            
-            # Анализируем качество
-            analysis_prompt = """
-            Проанализируй качество этого аудиофайла для транскрипции.
-            
-            Верни ответ в формате:
-            Качество: [отличное/хорошее/удовлетворительное/плохое]
-            Разборчивость: [да/частично/нет]
-            Язык: [русский/английский/другой]
-            Длительность: [короткое/среднее/длинное]
-            Проблемы: [перечисли если есть]
-            """
-            
-            response = self.model.generate_content([analysis_prompt, audio_file])
-            
-            # Удаляем файлы
-            os.unlink(temp_path)
-            genai.delete_file(audio_file.name)
-            
-            analysis_text = response.text.strip()
-            
-            # Простой парсинг результата
-            quality_info = {
-                "quality": "unknown",
-                "readable": True,
-                "language": "russian",
-                "analysis": analysis_text
-            }
-            
-            # Определяем качество из текста
-            if "плохое" in analysis_text.lower():
-                quality_info["quality"] = "poor"
-                quality_info["readable"] = False
-            elif "удовлетворительное" in analysis_text.lower():
-                quality_info["quality"] = "fair"
-            elif "хорошее" in analysis_text.lower():
-                quality_info["quality"] = "good"
-            elif "отличное" in analysis_text.lower():
-                quality_info["quality"] = "excellent"
-                
-            return quality_info
-            
+            response = await self.executor.run(self.model.generate_content, prompt)
+            return response.text or None
         except Exception as e:
-            logger.error(f"Ошибка анализа качества аудио: {e}")
-            return {"quality": "unknown", "readable": True, "language": "russian"}
+            logger.error(f"Ошибка при обновлении резюме диалога: {e}")
+            return None
 
-    async def process_audio_with_context(self, audio_data: bytes, context: str) -> tuple[str, str]:
+    async def analyze_audio_quality(self, audio: Union[AudioSession, bytes]) -> dict:
         """
-        Обрабатывает аудио напрямую с помощью Gemini 2.5 Pro с учетом контекста
-        БЕЗ предварительной транскрипции - более эффективно для сложных промптов
+        Анализирует качество аудио перед транскрипцией
+        
+        Разбирает заголовки Ogg/Opus локально - без загрузки файла и вызова модели.
+        
+        Args:
+            audio: Сессия голосового сообщения или байты аудио
+            
+        Returns:
+            dict: Информация о качестве аудио
+        """
+        data = audio.data if isinstance(audio, AudioSession) else audio
+        try:
+            info = analyze_opus(data)
+        except OggError as e:
+            logger.warning(f"Не удалось разобрать аудио: {e}")
+            return {"quality": "unknown", "readable": True}
+        
+        return {
+            "quality": info.quality,
+            "readable": not info.silent,
+            "duration": info.duration,
+            "bitrate": info.bitrate,
+            "channels": info.channels,
+            "silent": info.silent,
+            "analysis": (f"Длительность: {info.duration:.1f}s, битрейт: {info.bitrate // 1000} кбит/с, "
+                         f"каналов: {info.channels}, тишина: {info.quiet_ratio:.0%}")
+        }
+    
+    def audio_session(self, audio_data: bytes, deadline: Optional[float] = None) -> AudioSession:
+        """
+        Создает сессию голосового сообщения: короткое аудио передается в запросе,
+        большое загружается один раз на все этапы
         
         Args:
             audio_data: Байты аудиофайла
-            context: Контекст разговора
+            deadline: Крайний срок подготовки файла (time.monotonic)
+        """
+        return AudioSession(
+            audio_data, self._upload_audio, self._cleanup_audio,
+            inline_max_bytes=Config.GEMINI_INLINE_AUDIO_MAX_KB * 1024, deadline=deadline
+        )
+    
+    def _session_for(self, audio: Union[AudioSession, bytes]) -> tuple:
+        """
+        Возвращает (сессия, создана_здесь) - для байтов создается временная сессия,
+        которую вызывающий метод закрывает сам
+        """
+        if isinstance(audio, AudioSession):
+            return audio, False
+        return self.audio_session(audio), True
+
+    async def _wait_for_file(self, audio_file, deadline: float):
+        """
+        Ждет, пока файл выйдет из состояния PROCESSING
+        
+        Паузы между проверками растут от GEMINI_FILE_POLL_INITIAL вдвое до GEMINI_FILE_POLL_MAX,
+        поэтому короткие файлы готовы через доли секунды, а не через кратное 2 секундам время.
+        Ожидание можно отменить (asyncio.CancelledError пробрасывается вызывающему).
+        
+        Args:
+            audio_file: Загруженный файл Gemini
+            deadline: Момент (time.monotonic), после которого ожидание прекращается
             
         Returns:
-            tuple: (полный_ответ, краткий_ответ)
+            Файл с последним полученным состоянием
         """
-        temp_path = None
-        audio_file = None
+        started = time.monotonic()
+        delay = Config.GEMINI_FILE_POLL_INITIAL
+        polls = 0
         
         try:
-            import tempfile
-            import os
-            
-            logger.info(f"🎧 Начинаем прямую обработку аудио, размер: {len(audio_data)} байт")
-            
-            # Создаем временный файл с правильным расширением
-            with tempfile.NamedTemporaryFile(suffix=".oga", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_path = temp_file.name
+            while audio_file.state.name == "PROCESSING":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, Config.GEMINI_FILE_POLL_MAX)
+                polls += 1
+                audio_file = await self.executor.run(genai.get_file, audio_file.name)
+                logger.debug(f"⏱️ Ожидание обработки аудио: {time.monotonic() - started:.2f}s, статус: {audio_file.state.name}")
+        finally:
+            waited = time.monotonic() - started
+            metrics.observe('audio.processing_wait', waited)
+            if polls:
+                logger.info(f"⏳ Файл обрабатывался в Gemini {waited:.2f}s ({polls} проверок)")
+        
+        return audio_file
+    
+    async def _upload_audio(self, audio_data: bytes, deadline: Optional[float] = None):
+        """
+        Загружает аудио в Gemini прямо из памяти и ждет окончания обработки
+        
+        Args:
+            audio_data: Байты аудиофайла (BytesIO использует их без копирования)
+            deadline: Крайний срок ожидания обработки (time.monotonic);
+                      по умолчанию - GEMINI_FILE_WAIT_TIMEOUT секунд от начала загрузки
             
-            logger.info(f"📁 Временный файл создан: {temp_path}")
+        Returns:
+            Файл Gemini
             
-            # Загружаем аудио в Gemini с указанием MIME-типа
+        Raises:
+            AudioProcessingError: Файл не удалось обработать (текст ошибки - для пользователя)
+        """
+        audio_file = None
+        if deadline is None:
+            deadline = time.monotonic() + Config.GEMINI_FILE_WAIT_TIMEOUT
+        
+        try:
+            # Загружаем аудио в Gemini с указанием MIME-типа (для потока в памяти он обязателен)
+            metrics.inc('audio.uploads')
             try:
                 logger.info("⬆️ Загружаем аудиофайл в Gemini API...")
-                audio_file = genai.upload_file(
-                    path=temp_path,
-                    mime_type="audio/ogg"  # Указываем правильный MIME-тип
+                audio_file = await self.executor.run(
+                    genai.upload_file, path=io.BytesIO(audio_data), mime_type="audio/ogg"
                 )
                 logger.info(f"✅ Файл загружен в Gemini: {audio_file.name}")
             except Exception as upload_error:
-                logger.warning(f"⚠️ Ошибка загрузки с MIME audio/ogg: {upload_error}")
-                logger.info("🔄 Пробуем загрузить без указания MIME-типа...")
+                logger.warning(f"⚠️ Ошибка загрузки аудио: {upload_error}")
+                logger.info("🔄 Пробуем загрузить повторно...")
                 try:
-                    audio_file = genai.upload_file(path=temp_path)
-                    logger.info(f"✅ Файл загружен без MIME-типа: {audio_file.name}")
+                    audio_file = await self.executor.run(
+                        genai.upload_file, path=io.BytesIO(audio_data), mime_type="audio/ogg"
+                    )
+                    logger.info(f"✅ Файл загружен со второй попытки: {audio_file.name}")
                 except Exception as second_upload_error:
                     logger.error(f"❌ Критическая ошибка загрузки: {second_upload_error}")
                     raise second_upload_error
             
             # Ожидаем завершения обработки файла
-            import time
-            max_wait_time = 30  # Максимальное время ожидания
-            waited_time = 0
-            
-            logger.info("⏳ Ожидаем обработки файла в Gemini...")
-            while audio_file.state.name == "PROCESSING" and waited_time < max_wait_time:
-                time.sleep(2)
-                waited_time += 2
-                audio_file = genai.get_file(audio_file.name)
-                logger.debug(f"⏱️ Ожидание обработки аудио: {waited_time}s, статус: {audio_file.state.name}")
+            audio_file = await self._wait_for_file(audio_file, deadline)
             
             if audio_file.state.name == "FAILED":
                 logger.error(f"❌ Ошибка обработки аудиофайла в Gemini: {audio_file.state}")
-                error_msg = "Извините, произошла ошибка при обработке аудио. Попробуйте записать сообщение заново."
-                return error_msg, error_msg
+                raise AudioProcessingError(
+                    "Извините, произошла ошибка при обработке аудио. Попробуйте записать сообщение заново."
+                )
             
             if audio_file.state.name == "PROCESSING":
-                logger.error(f"⏰ Таймаут при обработке аудиофайла в Gemini после {max_wait_time}s")
-                error_msg = "Извините, обработка аудио заняла слишком много времени. Попробуйте записать более короткое сообщение."
-                return error_msg, error_msg
+                logger.error("⏰ Таймаут при обработке аудиофайла в Gemini")
+                raise AudioProcessingError(
+                    "Извините, обработка аудио заняла слишком много времени. Попробуйте записать более короткое сообщение."
+                )
             
             logger.info(f"✅ Аудиофайл успешно обработан Gemini: {audio_file.state.name}")
-            
-            # Этап 1: Генерируем развернутый ответ напрямую с аудио
-            audio_prompt = f"""{Config.MAIN_PROMPT}
-
-{context}
+            return audio_file
+        
+        except BaseException:
+            await self._cleanup_audio(audio_file)
+            raise
+    
+    async def _cleanup_audio(self, audio_file):
+        """Удаляет файл из Gemini"""
+        try:
+            if audio_file:
+                await self.executor.run(genai.delete_file, audio_file.name)
+                logger.debug("🗑️ Файл удален из Gemini")
+        except Exception as cleanup_error:
+            logger.warning(f"⚠️ Ошибка удаления файла из Gemini: {cleanup_error}")
+    
+    @classmethod
+    def _build_audio_prompt(cls, context: str) -> str:
+        """Формирует промпт для прямой обработки голосового сообщения (MAIN_PROMPT - в system_instruction)"""
+        prompt = f"""{context}
 
 ВАЖНО: Пользователь отправил голосовое сообщение. 
 Анализируй не только содержание, но и тон, эмоции, интонации.
@@ -304,28 +546,90 @@ class GeminiService:
 Если голосовой вопрос связан с предыдущими сообщениями, обязательно на это ссылайся.
 
 Сначала транскрибируй аудио, затем дай развернутый ответ на вопрос пользователя."""
+        cls._record_prompt_tokens('audio', prompt, context)
+        return prompt
+
+    async def process_audio_with_context(self, audio: Union[AudioSession, bytes],
+                                         context: str) -> tuple[Optional[str], str, Optional[str]]:
+        """
+        Обрабатывает аудио напрямую с помощью Gemini 2.5 Pro с учетом контекста
+        БЕЗ предварительной транскрипции - более эффективно для сложных промптов
+        
+        Расшифровка возвращается отдельным полем того же запроса (JSON), чтобы в контекст
+        попали слова пользователя без второго вызова модели.
+        
+        Args:
+            audio: Сессия голосового сообщения или байты аудио. Файл сессии не удаляется,
+                   чтобы транскрипция при неудаче использовала его повторно
+            context: Контекст разговора
+            
+        Returns:
+            tuple: (полный_ответ, краткий_ответ, расшифровка); в режиме lazy полный ответ равен None,
+                   расшифровка равна None, если модель ее не вернула
+        """
+        session, owned = self._session_for(audio)
+        
+        try:
+            started = time.monotonic()
+            logger.info(f"🎧 Начинаем прямую обработку аудио, размер: {len(session.data)} байт")
+            
+            audio_file = await session.get_part()
+            
+            # Этап 1: Генерируем развернутый ответ напрямую с аудио
+            audio_prompt = self._build_audio_prompt(context)
+
+            if Config.ANSWER_GENERATION_MODE == 'lazy':
+                logger.info("🤖 Генерируем краткий ответ (полный - по запросу)...")
+                # Поле short_answer уже содержит правило сокращения - развернутый ответ не пишется
+                answers = await self._generate_audio_structured(audio_prompt, audio_file, ("short_answer",))
+                if not answers:
+                    error_msg = "Извините, не удалось обработать ваше голосовое сообщение. Попробуйте записать его заново или говорить громче и четче."
+                    return error_msg, error_msg, None
+                self._record_latency('audio', 'lazy', started)
+                logger.info(f"🎉 Прямая обработка аудио завершена успешно!")
+                return None, answers['short_answer'], answers['transcript'] or None
+
+            mode = 'two_stage'
+            if Config.ANSWER_GENERATION_MODE == 'single_call':
+                logger.info("🤖 Генерируем полный и краткий ответ одним запросом...")
+                answers = await self._generate_audio_structured(
+                    audio_prompt, audio_file, ("full_answer", "short_answer")
+                )
+                if answers:
+                    self._record_latency('audio', 'single_call', started)
+                    logger.info(f"🎉 Прямая обработка аудио завершена успешно!")
+                    return (answers['full_answer'], answers['short_answer'] or answers['full_answer'],
+                            answers['transcript'] or None)
+                mode = 'single_call_fallback'
 
             logger.info("🤖 Генерируем ответ с помощью Gemini...")
-            try:
-                response1 = self.model.generate_content([audio_prompt, audio_file])
+            answers = await self._generate_audio_structured(audio_prompt, audio_file, ("full_answer",))
+            if answers:
+                full_answer, transcript = answers['full_answer'], answers['transcript'] or None
                 logger.info("✅ Первый этап (развернутый ответ) завершен")
-            except Exception as generation_error:
-                logger.error(f"❌ Ошибка генерации контента: {generation_error}")
-                raise generation_error
-            
-            if not response1.text:
-                logger.error("❌ Gemini вернул пустой ответ")
-                error_msg = "Извините, не удалось обработать ваше голосовое сообщение. Попробуйте записать его заново или говорить громче и четче."
-                return error_msg, error_msg
+            else:
+                # Модель не вернула JSON - просим обычный текст без расшифровки
+                try:
+                    answer_model = await self.prompt_cache.get_model()
+                    response1 = await self.executor.run(answer_model.generate_content, [audio_prompt, audio_file])
+                    logger.info("✅ Первый этап (развернутый ответ) завершен")
+                except Exception as generation_error:
+                    logger.error(f"❌ Ошибка генерации контента: {generation_error}")
+                    raise generation_error
+                
+                if not response1.text:
+                    logger.error("❌ Gemini вернул пустой ответ")
+                    error_msg = "Извините, не удалось обработать ваше голосовое сообщение. Попробуйте записать его заново или говорить громче и четче."
+                    return error_msg, error_msg, None
+                full_answer, transcript = response1.text, None
             
-            full_answer = response1.text
             logger.info(f"📝 Получен полный ответ, длина: {len(full_answer)} символов")
 
             # Этап 2: Сокращаем ответ
             try:
                 logger.info("✂️ Сокращаем ответ...")
                 summary_prompt = f"{Config.SUMMARY_PROMPT}\n\nТекст для сокращения: {full_answer}"
-                response2 = self.model.generate_content(summary_prompt)
+                response2 = await self.executor.run(self.model.generate_content, summary_prompt)
                 short_answer = response2.text if response2.text else full_answer
                 logger.info("✅ Второй этап (сокращение) завершен")
             except Exception as summary_error:
@@ -333,9 +637,13 @@ class GeminiService:
                 # Если сокращение не удалось, используем полный ответ
                 short_answer = full_answer
             
+            self._record_latency('audio', mode, started)
             logger.info(f"🎉 Прямая обработка аудио завершена успешно!")
             
-            return full_answer, short_answer
+            return full_answer, short_answer, transcript
+
+        except AudioProcessingError as e:
+            return e.user_message, e.user_message, None
 
         except Exception as e:
             logger.error(f"💥 КРИТИЧЕСКАЯ ОШИБКА при прямой обработке аудио: {type(e).__name__}: {e}")
@@ -343,60 +651,148 @@ class GeminiService:
             logger.error(f"📋 Traceback: {traceback.format_exc()}")
             
             error_msg = "Извините, произошла техническая ошибка при обработке вашего голосового сообщения. Попробуйте отправить текстовое сообщение или записать аудио заново."
-            return error_msg, error_msg
+            return error_msg, error_msg, None
             
         finally:
-            # Очистка ресурсов
-            try:
-                if temp_path and os.path.exists(temp_path):
-                    os.unlink(temp_path)
-                    logger.debug("🗑️ Временный файл удален")
-            except Exception as cleanup_error:
-                logger.warning(f"⚠️ Ошибка удаления временного файла: {cleanup_error}")
+            # Очистка ресурсов (файл общей сессии удаляет ее владелец)
+            if owned:
+                await session.close()
+
+    async def _stream_text(self, contents) -> AsyncIterator[str]:
+        """
+        Потоковая генерация ответа
+        
+        Yields:
+            str: Накопленный текст ответа после каждого полученного фрагмента
+        """
+        answer_model = await self.prompt_cache.get_model()
+        # Потребитель (правки сообщения в Telegram) медленнее модели: фрагменты копятся
+        # в очереди, а слот исполнителя освобождается сразу по окончании генерации
+        pieces: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(self._drain_stream(answer_model, contents, pieces))
+        try:
+            text = ""
+            while (piece := await pieces.get()) is not None:
+                text += piece
+                yield text
+            # Ошибка генерации пробрасывается потребителю
+            await producer
+        finally:
+            producer.cancel()
+
+    async def _drain_stream(self, model, contents, pieces: asyncio.Queue):
+        """Получает фрагменты ответа в очередь; None в конце - генерация завершена"""
+        try:
+            async with self.executor.slot():
+                response = await model.generate_content_async(contents, stream=True)
+                async for chunk in response:
+                    try:
+                        piece = chunk.text
+                    except ValueError:
+                        # Фрагмент без текста (например, служебный финальный)
+                        continue
+                    if piece:
+                        pieces.put_nowait(piece)
+        finally:
+            pieces.put_nowait(None)
+
+    async def _stream_with_metrics(self, kind: str, contents) -> AsyncIterator[str]:
+        """Потоковая генерация с записью времени до первого фрагмента и до конца ответа"""
+        started = time.monotonic()
+        first_chunk = True
+        
+        async for text in self._stream_text(contents):
+            if first_chunk:
+                first_chunk = False
+                elapsed = time.monotonic() - started
+                metrics.observe(f"answer_first_token.{kind}", elapsed)
+                logger.info(f"⚡ Первый фрагмент ответа ({kind}) через {elapsed:.2f}s")
+            yield text
+        
+        self._record_latency(kind, 'stream', started)
+
+    async def stream_short_answer(self, text: str, context: str) -> AsyncIterator[str]:
+        """
+        Потоково генерирует краткий ответ на текстовый вопрос (полный - по запросу)
+        
+        Args:
+            text: Текст пользователя
+            context: Контекст разговора
             
-            try:
-                if audio_file:
-                    genai.delete_file(audio_file.name)
-                    logger.debug("🗑️ Файл удален из Gemini")
-            except Exception as cleanup_error:
-                logger.warning(f"⚠️ Ошибка удаления файла из Gemini: {cleanup_error}")
+        Yields:
+            str: Накопленный текст краткого ответа
+        """
+        prompt = self._with_short_answer_instruction(self._build_text_prompt(text, context))
+        async for partial in self._stream_with_metrics('text', prompt):
+            yield partial
 
-    async def extract_transcription_from_response(self, response_text: str) -> str:
+    async def stream_audio_short_answer(self, audio: Union[AudioSession, bytes], context: str,
+                                        transcript: StreamedTranscript = None) -> AsyncIterator[str]:
         """
-        Извлекает транскрипцию из ответа Gemini для сохранения в контекст
+        Потоково генерирует краткий ответ на голосовое сообщение (прямая обработка)
+        
+        Модель начинает с расшифровки и разделителя (AUDIO_STREAM_FORMAT_PROMPT):
+        расшифровка сохраняется в transcript, пользователю показывается только ответ.
         
         Args:
-            response_text: Полный ответ от Gemini
+            audio: Сессия голосового сообщения или байты аудио
+            context: Контекст разговора
+            transcript: Сюда записывается расшифровка (None, если модель не соблюла формат)
             
-        Returns:
-            str: Извлеченная транскрипция или упрощенная версия
+        Yields:
+            str: Накопленный текст краткого ответа
+            
+        Raises:
+            AudioProcessingError: Аудио не удалось подготовить
         """
+        session, owned = self._session_for(audio)
+        
         try:
-            # Пытаемся найти транскрипцию в начале ответа
-            lines = response_text.split('\n')
-            
-            # Ищем строки, которые выглядят как транскрипция
-            possible_transcription = []
-            
-            for line in lines[:10]:  # Проверяем первые 10 строк
-                line = line.strip()
-                if line and not line.startswith('*') and not line.startswith('#'):
-                    # Если строка выглядит как прямая речь или вопрос
-                    if ('?' in line or 
-                        line.lower().startswith(('как', 'что', 'почему', 'где', 'когда', 'можно', 'дай')) or
-                        len(line.split()) > 3):  # Достаточно длинная строка
-                        possible_transcription.append(line)
-                        
-                        # Если нашли достаточно длинную строку, берем её
-                        if len(line) > 20:
-                            break
-            
-            if possible_transcription:
-                return possible_transcription[0]
-            else:
-                # Fallback: берем краткое описание
-                return "Голосовое сообщение пользователя"
-                
-        except Exception as e:
-            logger.error(f"Ошибка извлечения транскрипции: {e}")
-            return "Голосовое сообщение пользователя" 
\ No newline at end of file
+            logger.info(f"🎧 Начинаем потоковую обработку аудио, размер: {len(session.data)} байт")
+            audio_file = await session.get_part()
+            
+            prompt = self._with_short_answer_instruction(self._build_audio_prompt(context))
+            prompt = f"{prompt}\n\n{Config.AUDIO_STREAM_FORMAT_PROMPT}"
+            stream = self._stream_with_metrics('audio', [prompt, audio_file])
+            async for partial in self._split_stream_transcript(stream, transcript or StreamedTranscript()):
+                yield partial
+        finally:
+            if owned:
+                await session.close()
+
+    @staticmethod
+    async def _split_stream_transcript(stream: AsyncIterator[str],
+                                       transcript: StreamedTranscript) -> AsyncIterator[str]:
+        """
+        Отделяет расшифровку в начале потока от ответа
+        
+        Пока не пришел разделитель, ничего не показывается; после него отдается
+        накопленный текст ответа. Если разделителя нет в первых
+        STREAM_TRANSCRIPT_MAX_CHARS символах или до конца потока, весь текст - ответ.
+        """
+        answer_start = None
+        text = ""
+        async for text in stream:
+            if answer_start is None:
+                position = text.find(f"\n{STREAM_TRANSCRIPT_DELIMITER}")
+                if position >= 0:
+                    line_end = text.find("\n", position + 1)
+                    if line_end < 0:
+                        continue  # строка разделителя еще не закончилась
+                    heard = text[:position].strip()
+                    if heard.startswith(STREAM_TRANSCRIPT_PREFIX):
+                        heard = heard[len(STREAM_TRANSCRIPT_PREFIX):].strip()
+                    transcript.text = heard or None
+                    answer_start = line_end + 1
+                elif len(text) > STREAM_TRANSCRIPT_MAX_CHARS:
+                    answer_start = 0
+                else:
+                    continue
+            answer = text[answer_start:].lstrip()
+            if answer:
+                yield answer
+        
+        if answer_start is None and text.strip():
+            # Формат не соблюден: показываем весь текст как ответ
+            logger.warning("⚠️ Потоковый ответ на аудио пришел без расшифровки")
+            yield text
@@ -0,0 +1,242 @@
+"""
+Ограниченный исполнитель для блокирующих вызовов Gemini SDK с честной очередью между пользователями.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: интерактивные (пользователь ждет ответа) обслуживаются раньше фоновых
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+@dataclass
+class RequestTicket:
+    """Чей запрос выполняется и с каким приоритетом (приоритет можно повысить, см. LLMExecutor.promote)"""
+    user_id: Optional[int] = None
+    priority: int = PRIORITY_INTERACTIVE
+
+# Задается обработчиком апдейта и наследуется задачами, созданными из него (asyncio копирует контекст)
+current_request: contextvars.ContextVar[Optional[RequestTicket]] = contextvars.ContextVar('current_request', default=None)
+
+def use_request(ticket: RequestTicket) -> RequestTicket:
+    """Задает запрос для вызовов модели в текущей задаче"""
+    current_request.set(ticket)
+    return ticket
+
+def mark_request(user_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE) -> RequestTicket:
+    """Задает пользователя и приоритет для вызовов модели в текущей задаче"""
+    if user_id is None:
+        previous = current_request.get()
+        user_id = previous.user_id if previous else None
+    return use_request(RequestTicket(user_id, priority))
+
+class LLMExecutor:
+    """
+    Выполняет синхронные вызовы SDK в пуле потоков, не блокируя цикл событий.
+
+    Одновременно выполняется не более max_concurrency вызовов, остальные
+    ждут своей очереди. Освободившийся слот получает сначала интерактивный
+    запрос, затем фоновый; внутри приоритета пользователи обслуживаются по
+    кругу, поэтому пользователь с множеством запросов не задерживает остальных.
+    При очереди длиннее max_queue новые запросы пользователей отклоняются
+    (overloaded()). Счетчики in_flight/queued доступны через get_stats().
+    """
+
+    def __init__(self, max_concurrency: int = None, max_queue: int = None):
+        """
+        Инициализация исполнителя
+
+        Args:
+            max_concurrency: Максимум одновременных запросов к модели
+            max_queue: Длина очереди, с которой новые запросы отклоняются (0 - без ограничения)
+        """
+        self.max_concurrency = max(1, max_concurrency or Config.GEMINI_MAX_CONCURRENT_REQUESTS)
+        self.max_queue = Config.GEMINI_MAX_QUEUE if max_queue is None else max_queue
+        self._available = self.max_concurrency
+        # Приоритет -> пользователь -> ожидающие (слот, запрос); порядок пользователей - очередь по кругу
+        self._waiting: Dict[int, 'OrderedDict[Optional[int], Deque[Tuple[asyncio.Future, RequestTicket]]]'] = {
+            priority: OrderedDict() for priority in PRIORITY_NAMES
+        }
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="gemini"
+        )
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+
+        metrics.set_gauge('gemini.in_flight', lambda: self.in_flight)
+        metrics.set_gauge('gemini.queued', lambda: self.queued)
+        for priority, name in PRIORITY_NAMES.items():
+            metrics.set_gauge(f'gemini.queued.{name}', functools.partial(self._queued_with, priority))
+
+        logger.info(f"⚙️ Исполнитель Gemini: до {self.max_concurrency} одновременных запросов")
+
+    def _queued_with(self, priority: int) -> int:
+        return sum(len(waiters) for waiters in self._waiting[priority].values())
+
+    def overloaded(self) -> bool:
+        """Очередь переполнена: новый запрос пользователя лучше отклонить сразу"""
+        return self.max_queue > 0 and self.queued >= self.max_queue
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        """Снимает с очереди следующий запрос: по приоритету, внутри него - по кругу пользователей"""
+        for priority in sorted(self._waiting):
+            users = self._waiting[priority]
+            if users:
+                user, waiters = next(iter(users.items()))
+                waiter, _ = waiters.popleft()
+                if waiters:
+                    users.move_to_end(user)
+                else:
+                    del users[user]
+                return waiter
+        return None
+
+    def _release(self):
+        """Передает освободившийся слот следующему запросу"""
+        waiter = self._next_waiter()
+        # Отмененные, но еще не убравшие себя из очереди запросы пропускаются
+        while waiter is not None and waiter.done():
+            waiter = self._next_waiter()
+        if waiter is None:
+            self._available += 1
+        else:
+            waiter.set_result(None)
+
+    def _remove_waiter(self, entry: tuple):
+        """Убирает отмененный запрос из очереди (его приоритет мог быть повышен)"""
+        for users in self._waiting.values():
+            waiters = users.get(entry[1].user_id)
+            if waiters is not None and entry in waiters:
+                waiters.remove(entry)
+                if not waiters:
+                    del users[entry[1].user_id]
+                return
+
+    def promote(self, ticket: RequestTicket):
+        """
+        Повышает фоновый запрос до интерактивного: его уже ждет пользователь
+        
+        Ожидающие вызовы переходят в интерактивную очередь, следующие вызовы
+        задачи сразу встают в нее.
+        """
+        if ticket.priority == PRIORITY_INTERACTIVE:
+            return
+        old_priority, ticket.priority = ticket.priority, PRIORITY_INTERACTIVE
+        metrics.inc('gemini.promoted')
+        
+        waiters = self._waiting[old_priority].get(ticket.user_id)
+        if not waiters:
+            return
+        moving = [entry for entry in waiters if entry[1] is ticket]
+        for entry in moving:
+            waiters.remove(entry)
+        if not waiters:
+            del self._waiting[old_priority][ticket.user_id]
+        self._waiting[PRIORITY_INTERACTIVE].setdefault(ticket.user_id, deque()).extend(moving)
+
+    async def _acquire(self):
+        """Ждет слот в очереди своего пользователя и приоритета"""
+        if self._available > 0 and not self.queued:
+            self._available -= 1
+            return
+
+        ticket = current_request.get() or RequestTicket()
+        priority, user = ticket.priority, ticket.user_id
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, ticket)
+        self._waiting[priority].setdefault(user, deque()).append(entry)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан этому запросу - отдаем его следующему
+                self._release()
+            else:
+                self._remove_waiter(entry)
+            raise
+        finally:
+            self.queued -= 1
+
+        waited = time.monotonic() - started
+        metrics.observe('gemini.queue_wait', waited)
+        metrics.observe(f'gemini.queue_wait.{PRIORITY_NAMES[priority]}', waited)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает слот параллелизма (для нативных async-вызовов SDK)"""
+        await self._acquire()
+
+        self.in_flight += 1
+        try:
+            yield
+            self.completed += 1
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._release()
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Выполняет блокирующую функцию в пуле потоков
+
+        Args:
+            func: Синхронная функция SDK (generate_content, upload_file и т.д.)
+
+        Returns:
+            Any: Результат функции
+        """
+        await self._acquire()
+        self.in_flight += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._finish_call(None)
+            raise
+        # Слот освобождается, когда поток закончит вызов, а не когда ожидающий отменен
+        # (проигравший в гонке движков): иначе реальных вызовов было бы больше max_concurrency
+        future.add_done_callback(self._finish_call)
+        return await asyncio.shield(future)
+
+    def _finish_call(self, future: Optional[asyncio.Future]):
+        """Учитывает завершение вызова в пуле и передает слот следующему запросу"""
+        # exception() помечает ошибку полученной, даже если ожидающий уже отменен
+        if future is None or future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self.in_flight -= 1
+        self._release()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Возвращает текущую загрузку исполнителя"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+    def shutdown(self):
+        """Останавливает пул потоков"""
+        self._pool.shutdown(wait=False)
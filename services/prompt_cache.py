@@ -0,0 +1,159 @@
+"""
+Системный промпт на стороне Gemini: system_instruction и кэш контекста с управляемым TTL.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, Callable
+import google.generativeai as genai
+from google.generativeai import caching
+from config import Config
+from services.llm_executor import LLMExecutor
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class GeminiCacheBackend:
+    """Обращения к Gemini API для кэша контекста (в тестах заменяется заглушкой)"""
+
+    def create_model(self, model_name: str, system_instruction: str):
+        """Модель с системным промптом без кэша"""
+        return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+    def create_cache(self, model_name: str, system_instruction: str, ttl: float):
+        """Создает кэш с системным промптом"""
+        return caching.CachedContent.create(
+            model=model_name,
+            display_name="sovetnik-main-prompt",
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    def extend_cache(self, cache, ttl: float):
+        """Продлевает время жизни кэша"""
+        cache.update(ttl=datetime.timedelta(seconds=ttl))
+
+    def model_from_cache(self, cache):
+        """Модель, использующая кэш как префикс каждого запроса"""
+        return genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+    def delete_cache(self, cache):
+        """Удаляет кэш (хранение кэша оплачивается по времени)"""
+        cache.delete()
+
+
+class PromptCache:
+    """
+    Выдает модель для ответов с MAIN_PROMPT на стороне Gemini.
+
+    Системный промпт всегда передается как system_instruction, а не текстом в
+    каждом запросе. Если включен кэш контекста, промпт хранится в Gemini и
+    обрабатывается один раз: кэш создается при первом запросе, продлевается
+    за refresh_margin секунд до истечения и пересоздается, если истек.
+    Если модель не поддерживает кэш (или промпт короче минимального размера
+    кэша), используется модель с system_instruction, повторная попытка -
+    через retry_interval секунд.
+    """
+
+    def __init__(self, model_name: str = None, system_instruction: str = None, enabled: bool = None,
+                 ttl: float = None, refresh_margin: float = None, retry_interval: float = 3600,
+                 backend: GeminiCacheBackend = None, executor: LLMExecutor = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            model_name: Модель Gemini
+            system_instruction: Системный промпт
+            enabled: Использовать кэш контекста
+            ttl: Время жизни кэша (секунды)
+            refresh_margin: За сколько секунд до истечения продлевать кэш
+            retry_interval: Через сколько секунд повторить создание кэша после ошибки
+            backend: Обращения к API (заглушка в тестах)
+            executor: Исполнитель блокирующих вызовов SDK
+            clock: Источник времени (подменяется в тестах)
+        """
+        self.model_name = model_name or Config.GEMINI_MODEL
+        self.system_instruction = system_instruction or Config.MAIN_PROMPT
+        self.enabled = Config.PROMPT_CACHE_ENABLED if enabled is None else enabled
+        self.ttl = ttl or Config.PROMPT_CACHE_TTL
+        self.refresh_margin = Config.PROMPT_CACHE_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.retry_interval = retry_interval
+        self.backend = backend or GeminiCacheBackend()
+        self.executor = executor or LLMExecutor()
+        self.clock = clock
+
+        self.plain_model = self.backend.create_model(self.model_name, self.system_instruction)
+        self._cache: Any = None
+        self._cached_model = None
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get_model(self):
+        """Возвращает модель для ответа (с кэшем, если он доступен)"""
+        if not self.enabled:
+            return self.plain_model
+
+        now = self.clock()
+        if self._cached_model is not None and now < self._expires_at - self.refresh_margin:
+            metrics.inc('prompt_cache.hits')
+            return self._cached_model
+        if self._cache is None and now < self._retry_at:
+            return self.plain_model
+
+        async with self._lock:
+            # Пока ждали блокировку, кэш мог обновить другой запрос
+            now = self.clock()
+            if self._cached_model is not None and now < self._expires_at - self.refresh_margin:
+                metrics.inc('prompt_cache.hits')
+                return self._cached_model
+
+            if self._cache is not None and now < self._expires_at and await self._extend(now):
+                return self._cached_model
+            return await self._create(now)
+
+    async def _extend(self, now: float) -> bool:
+        """Продлевает кэш, который скоро истечет"""
+        try:
+            await self.executor.run(self.backend.extend_cache, self._cache, self.ttl)
+            self._expires_at = now + self.ttl
+            metrics.inc('prompt_cache.refreshed')
+            logger.info(f"🗄️ Кэш системного промпта продлен на {self.ttl:.0f}s")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось продлить кэш системного промпта, создаем новый: {e}")
+            metrics.inc('prompt_cache.errors')
+            return False
+
+    async def _create(self, now: float):
+        """Создает кэш; при ошибке возвращает модель без кэша"""
+        self._cache = None
+        self._cached_model = None
+        try:
+            cache = await self.executor.run(
+                self.backend.create_cache, self.model_name, self.system_instruction, self.ttl
+            )
+            self._cached_model = self.backend.model_from_cache(cache)
+            self._cache = cache
+            self._expires_at = now + self.ttl
+            metrics.inc('prompt_cache.created')
+            logger.info(f"🗄️ Создан кэш системного промпта на {self.ttl:.0f}s")
+            return self._cached_model
+        except Exception as e:
+            self._retry_at = now + self.retry_interval
+            metrics.inc('prompt_cache.errors')
+            logger.warning(f"⚠️ Кэш контекста недоступен для {self.model_name}, "
+                           f"используем system_instruction без кэша: {e}")
+            return self.plain_model
+
+    async def close(self):
+        """Удаляет кэш, чтобы не оплачивать его хранение после остановки"""
+        cache, self._cache, self._cached_model = self._cache, None, None
+        if cache is None:
+            return
+        try:
+            await self.executor.run(self.backend.delete_cache, cache)
+            logger.info("🗄️ Кэш системного промпта удален")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось удалить кэш системного промпта: {e}")
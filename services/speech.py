@@ -2,59 +2,156 @@
 Сервис для распознавания речи.
 """
 
+import asyncio
+import base64
+import json
 import logging
-import requests
+import random
+from typing import AsyncIterator, Callable, Optional, Tuple
+import httpx
 from config import Config
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Ограничения синхронного speech:recognize: около минуты аудио и 10 МБ на запрос (с учетом base64)
+SPEECH_API_MAX_SECONDS = 55
+SPEECH_API_MAX_BYTES = 7 * 1024 * 1024
+
+RECOGNITION_CONFIG = {
+    "encoding": "OGG_OPUS",
+    "sampleRateHertz": 16000,
+    "languageCode": "ru-RU",
+    "enableAutomaticPunctuation": True
+}
+
+# Аудио кодируется в base64 блоками (кратными 3 байтам, чтобы части склеивались без '=')
+BASE64_BLOCK = 3 * 16 * 1024
+
 class SpeechService:
     """Сервис для распознавания речи"""
-    
-    def __init__(self):
-        """Инициализация сервиса речи"""
+
+    def __init__(self, url: str = None, client: httpx.AsyncClient = None):
+        """
+        Инициализация сервиса речи
+
+        Args:
+            url: Адрес метода speech:recognize (по умолчанию Config.SPEECH_API_URL, в тестах - локальная заглушка)
+            client: HTTP-клиент (по умолчанию общий клиент с пулом keep-alive соединений)
+        """
         self.api_key = Config.GEMINI_API_KEY  # Используем тот же ключ
+        self.url = url or Config.SPEECH_API_URL
+        self.max_retries = Config.SPEECH_MAX_RETRIES
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                Config.SPEECH_READ_TIMEOUT,
+                connect=Config.SPEECH_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+        )
         logger.info("Инициализирован Speech сервис")
-    
+
+    async def close(self):
+        """Закрывает соединения HTTP-клиента"""
+        await self.client.aclose()
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Пауза перед повтором: Retry-After или экспоненциальная со случайным разбросом"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), Config.SPEECH_RETRY_MAX_DELAY)
+
+        # Полный разброс, чтобы повторы параллельных запросов не совпадали
+        return random.uniform(0, min(Config.SPEECH_RETRY_MAX_DELAY, Config.SPEECH_RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def _post(self, body: Callable[[], AsyncIterator[bytes]], length: int) -> Optional[httpx.Response]:
+        """
+        Отправляет запрос с повторами при 429/5xx и сетевых ошибках
+
+        Args:
+            body: Фабрика тела запроса (для каждой попытки - новый поток)
+            length: Длина тела в байтах
+        """
+        headers = {'Content-Type': 'application/json', 'Content-Length': str(length)}
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self.client.post(
+                    self.url, params={'key': self.api_key}, content=body(), headers=headers
+                )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                logger.warning(f"Speech API вернул {response.status_code} (попытка {attempt + 1})")
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                logger.warning(f"Сетевая ошибка Speech API (попытка {attempt + 1}): {type(e).__name__}: {e}")
+
+            if attempt == self.max_retries:
+                return response
+
+            metrics.inc('speech.retries')
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+        return None
+
+    @staticmethod
+    def _request_body(audio_data: bytes) -> Tuple[Callable[[], AsyncIterator[bytes]], int]:
+        """
+        Тело запроса speech:recognize, в котором аудио кодируется в base64 по частям
+
+        Закодированная строка целиком в памяти не собирается: части отправляются
+        по мере кодирования, поэтому дополнительная память - один блок, а не 4/3 аудио.
+
+        Returns:
+            tuple: (фабрика потока тела, длина тела в байтах)
+        """
+        prefix = ('{"config": ' + json.dumps(RECOGNITION_CONFIG) + ', "audio": {"content": "').encode('ascii')
+        suffix = b'"}}'
+        view = memoryview(audio_data)
+
+        async def body() -> AsyncIterator[bytes]:
+            yield prefix
+            for offset in range(0, len(view), BASE64_BLOCK):
+                yield base64.b64encode(view[offset:offset + BASE64_BLOCK])
+            yield suffix
+
+        encoded_length = (len(view) + 2) // 3 * 4
+        return body, len(prefix) + encoded_length + len(suffix)
+
     async def transcribe_audio_simple(self, audio_data: bytes) -> str:
         """
         Простая транскрипция через Google Speech API напрямую
-        
+
         Args:
-            audio_data: Байты аудиофайла
-            
+            audio_data: Аудиофайл (bytes или memoryview, не копируется)
+
         Returns:
             str: Транскрибированный текст или None при ошибке
         """
         try:
-            # Используем Google Speech REST API напрямую
-            url = f"https://speech.googleapis.com/v1/speech:recognize?key={self.api_key}"
-            
-            payload = {
-                "config": {
-                    "encoding": "OGG_OPUS",
-                    "sampleRateHertz": 16000,
-                    "languageCode": "ru-RU",
-                    "enableAutomaticPunctuation": True
-                },
-                "audio": {
-                    "content": __import__('base64').b64encode(audio_data).decode('utf-8')
-                }
-            }
-            
-            response = requests.post(url, json=payload)
-            
+            body, length = self._request_body(audio_data)
+            response = await self._post(body, length)
+
+            if response is None:
+                logger.error("Speech API недоступен")
+                return None
+
             if response.status_code == 200:
                 result = response.json()
-                if 'results' in result and len(result['results']) > 0:
-                    transcript = result['results'][0]['alternatives'][0]['transcript']
-                    return transcript
-                else:
-                    return None
+                # Длинная запись распознается несколькими результатами - по одному на отрезок речи
+                pieces = [
+                    item['alternatives'][0]['transcript'].strip()
+                    for item in result.get('results', []) if item.get('alternatives')
+                ]
+                transcript = " ".join(piece for piece in pieces if piece)
+                return transcript or None
             else:
                 logger.error(f"Speech API error: {response.status_code} - {response.text}")
                 return None
-                
+
         except Exception as e:
             logger.error(f"Ошибка при транскрипции через Speech API: {e}")
-            return None 
\ No newline at end of file
+            return None
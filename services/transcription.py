@@ -0,0 +1,246 @@
+"""
+Стратегии транскрипции: гонка Gemini и Google Speech API, нарезка длинного аудио на куски.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+from config import Config
+from services.speech import SPEECH_API_MAX_SECONDS, SPEECH_API_MAX_BYTES
+from utils.metrics import metrics
+from utils.ogg import OggError, split_ogg
+
+logger = logging.getLogger(__name__)
+
+# Движок транскрипции: (название для метрик, фабрика корутины с текстом или None)
+Engine = Tuple[str, Callable[[], Awaitable[Optional[str]]]]
+
+# Названия движков для логов и пользователя
+ENGINE_NAMES = {'gemini': 'Gemini', 'speech_api': 'Google Speech API', 'none': 'нет результата'}
+
+class HedgedTranscriber:
+    """
+    Запускает основной движок, а резервный - через hedge_delay секунд
+    (сразу, если основной уже вернул пустой результат или ошибку).
+    Первый непустой результат побеждает, проигравший отменяется.
+
+    Так задержка в худшем случае - не сумма двух движков, а резервный
+    вызывается только для медленных запросов (дольше hedge_delay).
+    """
+
+    def __init__(self, gemini_service, speech_service, hedge_delay: float = None):
+        """
+        Args:
+            gemini_service: Сервис Gemini (основной движок)
+            speech_service: Сервис Speech API (резервный движок)
+            hedge_delay: Через сколько секунд запускать резервный движок (0 - сразу)
+        """
+        self.gemini_service = gemini_service
+        self.speech_service = speech_service
+        self.hedge_delay = Config.TRANSCRIPTION_HEDGE_DELAY if hedge_delay is None else hedge_delay
+
+    async def transcribe(self, audio, audio_data: bytes) -> Tuple[Optional[str], str]:
+        """
+        Транскрибирует аудио обоими движками с задержкой резервного
+
+        Args:
+            audio: Сессия голосового сообщения (или байты) для Gemini
+            audio_data: Байты аудио для Speech API
+
+        Returns:
+            tuple: (текст или None, название победившего движка: gemini, speech_api или none)
+        """
+        return await race([
+            ("gemini", lambda: self.gemini_service.transcribe_audio(audio)),
+            ("speech_api", lambda: self.speech_service.transcribe_audio_simple(audio_data)),
+        ], self.hedge_delay)
+
+
+async def race(engines: List[Engine], hedge_delay: float) -> Tuple[Optional[str], str]:
+    """
+    Запускает движки по очереди с интервалом hedge_delay и возвращает первый непустой результат
+
+    Следующий движок запускается раньше срока, если все запущенные уже завершились
+    без результата. Незавершенные движки отменяются после победы.
+
+    Метрики: transcription.hedge.won.<движок>, transcription.hedge.secondary_started,
+    transcription.hedge.latency и transcription.hedge.margin - нижняя оценка того,
+    насколько победитель быстрее проигравшего (проигравший к отмене работал дольше
+    победителя на эту величину и еще не закончил).
+
+    Returns:
+        tuple: (текст или None, название победившего движка; 'none', если никто не справился)
+    """
+    started = time.monotonic()
+    waiting = list(engines)
+    tasks = {}  # задача -> (название, время запуска)
+
+    def launch():
+        name, factory = waiting.pop(0)
+        tasks[asyncio.ensure_future(factory())] = (name, time.monotonic())
+        if len(tasks) > 1:
+            metrics.inc('transcription.hedge.secondary_started')
+            logger.info(f"🏁 Запущен резервный движок транскрипции: {name}")
+
+    launch()
+    next_launch = time.monotonic() + hedge_delay
+    try:
+        while True:
+            pending = [task for task in tasks if not task.done()]
+            if not pending:
+                if not waiting:
+                    break
+                # Все запущенные движки сдались - следующий запускаем сразу
+                launch()
+                next_launch = time.monotonic() + hedge_delay
+                continue
+
+            timeout = max(0.0, next_launch - time.monotonic()) if waiting else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name, task_started = tasks[task]
+                try:
+                    text = task.result()
+                except Exception as e:
+                    logger.warning(f"Ошибка транскрипции ({name}): {e}")
+                    text = None
+                if text:
+                    _record_win(name, task_started, tasks, task, started)
+                    return text, name
+                logger.info(f"Движок {name} не вернул текст")
+
+            if waiting and time.monotonic() >= next_launch and any(not task.done() for task in tasks):
+                # Истек hedge_delay - подключаем следующий движок
+                launch()
+                next_launch = time.monotonic() + hedge_delay
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    metrics.inc('transcription.hedge.won.none')
+    return None, 'none'
+
+def _record_win(name: str, task_started: float, tasks: dict, winner, started: float):
+    """Записывает победителя и отрыв от незавершенных движков"""
+    now = time.monotonic()
+    winner_elapsed = now - task_started
+    metrics.inc(f'transcription.hedge.won.{name}')
+    metrics.observe('transcription.hedge.latency', now - started)
+
+    losers = [task_start for task, (_, task_start) in tasks.items() if task is not winner and not task.done()]
+    if losers:
+        margin = max(now - task_start for task_start in losers) - winner_elapsed
+        metrics.observe('transcription.hedge.margin', margin)
+        logger.info(f"🏆 Транскрипция: победил {name} за {winner_elapsed:.2f}s, отрыв не меньше {margin:.2f}s")
+    else:
+        logger.info(f"🏆 Транскрипция: {name} за {winner_elapsed:.2f}s")
+
+
+def stitch_transcripts(parts: List[str], max_overlap_words: int = 12) -> str:
+    """
+    Склеивает транскрипции соседних кусков, убирая повтор на перекрытии
+
+    Куски нарезаются с перекрытием, поэтому начало следующей транскрипции
+    обычно повторяет конец предыдущей: ищется самый длинный такой повтор
+    (без учета регистра и пунктуации) и отбрасывается.
+    """
+    def normalize(word: str) -> str:
+        return word.strip('.,!?;:…«»"\'()-—').lower()
+
+    words: List[str] = []
+    for part in parts:
+        new_words = part.split()
+        limit = min(max_overlap_words, len(words), len(new_words))
+        for size in range(limit, 0, -1):
+            tail = [normalize(word) for word in words[-size:]]
+            head = [normalize(word) for word in new_words[:size]]
+            # Совпадение одного короткого слова (предлога, союза) скорее случайно
+            if tail == head and (size > 1 or len(tail[0]) > 3):
+                new_words = new_words[size:]
+                break
+        words.extend(new_words)
+    return " ".join(words)
+
+
+class ChunkedTranscriber:
+    """
+    Транскрипция длинных голосовых сообщений по кускам.
+
+    Аудио длиннее лимита движка режется на перекрывающиеся куски по
+    границам страниц Ogg, куски транскрибируются параллельно (не больше
+    concurrency одновременно) и склеиваются по порядку. Время ответа -
+    примерно время самого долгого куска, а не всей записи.
+    """
+
+    def __init__(self, gemini_service, speech_service, concurrency: int = None):
+        """
+        Args:
+            gemini_service: Сервис Gemini
+            speech_service: Сервис Speech API
+            concurrency: Сколько кусков транскрибировать одновременно
+        """
+        self.gemini_service = gemini_service
+        self.speech_service = speech_service
+        self.concurrency = concurrency or Config.CHUNK_TRANSCRIPTION_CONCURRENCY
+
+    async def transcribe(self, audio_data: bytes, use_speech_api: bool = False) -> Optional[str]:
+        """
+        Транскрибирует аудио по кускам
+
+        Args:
+            audio_data: Ogg/Opus целиком
+            use_speech_api: Транскрибировать куски через Speech API (иначе Gemini)
+
+        Returns:
+            str: Склеенный текст или None, если ни один кусок не распознан
+        """
+        if use_speech_api:
+            chunk_seconds = min(Config.CHUNK_TRANSCRIPTION_SECONDS, SPEECH_API_MAX_SECONDS)
+            max_bytes = SPEECH_API_MAX_BYTES
+            transcribe = self.speech_service.transcribe_audio_simple
+        else:
+            chunk_seconds = Config.CHUNK_TRANSCRIPTION_SECONDS
+            max_bytes = Config.GEMINI_MAX_AUDIO_SIZE_MB * 1024 * 1024
+            transcribe = self.gemini_service.transcribe_audio
+
+        try:
+            # Разбор и CRC на чистом Python - в потоке, чтобы не задерживать другие чаты
+            chunks = await asyncio.to_thread(
+                split_ogg, audio_data, chunk_seconds, Config.CHUNK_TRANSCRIPTION_OVERLAP, max_bytes
+            )
+        except OggError as e:
+            logger.warning(f"Не удалось разобрать Ogg, транскрибируем целиком: {e}")
+            return await transcribe(audio_data)
+
+        if len(chunks) == 1:
+            return await transcribe(audio_data)
+
+        logger.info(f"✂️ Аудио разрезано на {len(chunks)} кусков до {chunk_seconds:.0f}s, "
+                    f"транскрибируем по {self.concurrency} одновременно")
+        metrics.inc('transcription.chunked')
+        metrics.observe('transcription.chunks', len(chunks))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def transcribe_chunk(index: int, chunk: bytes) -> Optional[str]:
+            async with semaphore:
+                try:
+                    return await transcribe(chunk)
+                except Exception as e:
+                    logger.warning(f"Ошибка транскрипции куска {index + 1}/{len(chunks)}: {e}")
+                    return None
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(transcribe_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+        metrics.observe('transcription.chunked_latency', time.monotonic() - started)
+
+        if not any(results):
+            return None
+        failed = sum(1 for text in results if not text)
+        if failed:
+            metrics.inc('transcription.chunk_failures', failed)
+            logger.warning(f"⚠️ Не распознано кусков: {failed} из {len(chunks)}")
+        return stitch_transcripts([text or "[неразборчиво]" for text in results])
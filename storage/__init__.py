@@ -0,0 +1,11 @@
+"""
+Пакет хранилищ контекста для Telegram бота-советника.
+"""
+
+from .base import ContextStorage, BatchingStorage
+from .memory import MemoryStorage
+from .sqlite import SQLiteStorage
+from .redis import RedisStorage
+from .factory import create_storage
+
+__all__ = ['ContextStorage', 'BatchingStorage', 'MemoryStorage', 'SQLiteStorage', 'RedisStorage', 'create_storage']
@@ -0,0 +1,193 @@
+"""
+Базовые классы хранилищ контекста пользователей.
+"""
+
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+from config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def _answer_in(data: Optional[Dict[str, Any]], answer_id: int) -> Optional[Dict[str, Any]]:
+    """Полный ответ из снимка пользователя (в JSON ключи - строки)"""
+    if not data:
+        return None
+    answers = data.get('full_answers', {})
+    return answers.get(answer_id) or answers.get(str(answer_id))
+
+class ContextStorage(ABC):
+    """
+    Интерфейс хранилища данных пользователей для ContextManager.
+
+    Данные передаются в виде словарей UserData.to_dict(). Методы вызываются
+    из цикла событий, поэтому save() не должен ждать диска или сети.
+    """
+
+    # False - данные не сохраняются, и снимки для save() можно не строить
+    persistent = True
+
+    @abstractmethod
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Загружает данные пользователя или возвращает None"""
+
+    @abstractmethod
+    def save(self, user_id: int, data: Dict[str, Any]):
+        """Сохраняет данные пользователя (может выполняться отложенно)"""
+
+    def load_answer(self, user_id: int, answer_id: int) -> Optional[Dict[str, Any]]:
+        """Загружает полный ответ, вытесненный из памяти (см. UserData.stored_answers)"""
+        return _answer_in(self.load(user_id), answer_id)
+
+    def flush(self):
+        """Принудительно записывает отложенные изменения"""
+
+    def close(self):
+        """Записывает изменения и освобождает ресурсы"""
+        self.flush()
+
+
+class BatchingStorage(ContextStorage):
+    """
+    Хранилище с отложенной пакетной записью.
+
+    save() только кладет снимок в очередь (последний снимок пользователя
+    заменяет предыдущий), а фоновый поток раз в flush_interval секунд или при
+    накоплении batch_size пользователей записывает всё одной транзакцией.
+
+    Ответов из stored_answers в снимке нет (они вытеснены из памяти): они
+    переносятся из предыдущего снимка в очереди или из записанных данных.
+    """
+
+    def __init__(self, flush_interval: float = None, batch_size: int = None):
+        """
+        Args:
+            flush_interval: Период фоновой записи (секунды)
+            batch_size: Количество пользователей, при котором запись начинается сразу
+        """
+        self.flush_interval = Config.STORAGE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.batch_size = batch_size or Config.STORAGE_BATCH_SIZE
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # Пакет, который записывается прямо сейчас: до фиксации он виден load()
+        self._writing: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        metrics.set_gauge('storage.pending_users', lambda: len(self._pending))
+
+    @abstractmethod
+    def _read(self, user_id: int) -> Optional[str]:
+        """Читает сериализованные данные пользователя"""
+
+    @abstractmethod
+    def _write_batch(self, items: Dict[int, str]):
+        """Записывает пакет сериализованных данных"""
+
+    def _queued(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Последний еще не записанный снимок пользователя (вызывается под _lock)"""
+        data = self._pending.get(user_id)
+        return data if data is not None else self._writing.get(user_id)
+
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._queued(user_id)
+        if data is not None:
+            return data
+
+        raw = self._read(user_id)
+        return json.loads(raw) if raw else None
+
+    def load_answer(self, user_id: int, answer_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            answer = _answer_in(self._queued(user_id), answer_id)
+        if answer is not None:
+            # Копия: снимок в очереди не должен меняться вместе с памятью
+            return dict(answer)
+
+        raw = self._read(user_id)
+        return _answer_in(json.loads(raw), answer_id) if raw else None
+
+    @staticmethod
+    def _carry_answers(data: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
+        """
+        Переносит в снимок вытесненные из памяти ответы из предыдущего снимка
+
+        Returns:
+            bool: Все вытесненные ответы на месте
+        """
+        answers = data['full_answers']
+        complete = True
+        for answer_id in data.get('stored_answers', ()):
+            if answer_id in answers or str(answer_id) in answers:
+                continue
+            answer = _answer_in(previous, answer_id)
+            if answer is None:
+                complete = False
+            else:
+                answers[answer_id] = answer
+        return complete
+
+    def save(self, user_id: int, data: Dict[str, Any]):
+        with self._lock:
+            if data.get('stored_answers'):
+                self._carry_answers(data, self._queued(user_id))
+            self._pending[user_id] = data
+            pending_count = len(self._pending)
+
+        self._ensure_writer()
+        if pending_count >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+            if not batch:
+                return
+
+            try:
+                for user_id, data in batch.items():
+                    # Остальные вытесненные ответы уже записаны прошлыми пакетами
+                    if data.get('stored_answers') and not self._carry_answers(data, None):
+                        raw = self._read(user_id)
+                        self._carry_answers(data, json.loads(raw) if raw else None)
+                encoded = {user_id: json.dumps(data, ensure_ascii=False) for user_id, data in batch.items()}
+                self._write_batch(encoded)
+                metrics.inc('storage.users_written', len(encoded))
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи в хранилище ({len(batch)} пользователей): {e}")
+                metrics.inc('storage.write_errors')
+                # Возвращаем в очередь то, что не было заменено более свежими снимками
+                with self._lock:
+                    for user_id, data in batch.items():
+                        self._pending.setdefault(user_id, data)
+            finally:
+                with self._lock:
+                    self._writing = {}
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def _ensure_writer(self):
+        """Запускает фоновый поток записи при первом сохранении"""
+        if self._thread is None and not self._stopped.is_set():
+            self._thread = threading.Thread(target=self._writer_loop, name="storage-writer", daemon=True)
+            self._thread.start()
+
+    def _writer_loop(self):
+        """Фоновая запись накопленных изменений"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
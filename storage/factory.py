@@ -0,0 +1,30 @@
+"""
+Выбор хранилища контекста по настройкам.
+"""
+
+from config import Config
+from storage.base import ContextStorage
+
+def create_storage(backend: str = None) -> ContextStorage:
+    """
+    Создает хранилище по имени (по умолчанию Config.STORAGE_BACKEND)
+
+    Args:
+        backend: memory, sqlite или redis
+
+    Returns:
+        ContextStorage: Хранилище контекста
+    """
+    backend = (backend or Config.STORAGE_BACKEND).lower()
+
+    if backend == 'sqlite':
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage()
+    if backend == 'redis':
+        from storage.redis import RedisStorage
+        return RedisStorage()
+    if backend == 'memory':
+        from storage.memory import MemoryStorage
+        return MemoryStorage()
+
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={backend}")
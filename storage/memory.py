@@ -0,0 +1,21 @@
+"""
+Хранилище без сохранения на диск (поведение по умолчанию).
+"""
+
+from typing import Any, Dict, Optional
+from storage.base import ContextStorage
+
+class MemoryStorage(ContextStorage):
+    """
+    Данные живут только в кэше ContextManager и теряются при перезапуске.
+
+    Отдельная копия не хранится, чтобы не удваивать потребление памяти.
+    """
+
+    persistent = False
+
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return None
+
+    def save(self, user_id: int, data: Dict[str, Any]):
+        pass
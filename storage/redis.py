@@ -0,0 +1,48 @@
+"""
+Хранилище контекста в Redis (пакетная запись через pipeline).
+"""
+
+import logging
+from typing import Dict, Optional
+from config import Config
+from storage.base import BatchingStorage
+
+logger = logging.getLogger(__name__)
+
+class RedisStorage(BatchingStorage):
+    """Сохраняет данные пользователей в Redis"""
+
+    def __init__(self, client=None, url: str = None, prefix: str = "sovetnik:user:", **kwargs):
+        """
+        Args:
+            client: Готовый клиент (redis.Redis или совместимая замена для тестов)
+            url: Адрес Redis, если клиент не передан
+            prefix: Префикс ключей
+        """
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("Для STORAGE_BACKEND=redis установите пакет redis: pip install redis") from e
+            client = redis.Redis.from_url(url or Config.REDIS_URL)
+
+        self.client = client
+        logger.info("💾 Хранилище контекста: Redis")
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def _read(self, user_id: int) -> Optional[str]:
+        raw = self.client.get(self._key(user_id))
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        return raw
+
+    def _write_batch(self, items: Dict[int, str]):
+        pipeline = self.client.pipeline()
+        for user_id, data in items.items():
+            pipeline.set(self._key(user_id), data)
+        pipeline.execute()
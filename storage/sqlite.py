@@ -0,0 +1,70 @@
+"""
+Хранилище контекста в SQLite (режим WAL, пакетная запись).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from config import Config
+from storage.base import BatchingStorage
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStorage(BatchingStorage):
+    """Сохраняет данные пользователей в файл SQLite"""
+
+    def __init__(self, path: str = None, **kwargs):
+        """
+        Args:
+            path: Путь к файлу базы данных
+        """
+        super().__init__(**kwargs)
+        self.path = path or Config.SQLITE_PATH
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+
+        # Отдельное соединение для чтения: в режиме WAL чтение не ждет пакетной записи
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+        logger.info(f"💾 Хранилище контекста: SQLite ({self.path})")
+
+    def _read(self, user_id: int) -> Optional[str]:
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT data FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write_batch(self, items: Dict[int, str]):
+        now = time.time()
+        with self._db_lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO users (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(user_id, data, now) for user_id, data in items.items()]
+                )
+
+    def close(self):
+        super().close()
+        with self._db_lock:
+            self._connection.close()
+        with self._read_lock:
+            self._reader.close()
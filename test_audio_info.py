@@ -0,0 +1,82 @@
+"""
+Тест локального анализа голосовых сообщений по заголовкам Ogg/Opus.
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.ogg import OggError, analyze_opus, packet_samples
+from test_ogg import build_ogg_opus
+
+def test_duration_and_bitrate():
+    """Длительность берется из granule position, битрейт - из объема пакетов"""
+    print("=== Тест длительности и битрейта ===")
+    info = analyze_opus(build_ogg_opus(12.5, packet_size=lambda: 60))
+
+    assert abs(info.duration - 12.5) < 0.02
+    assert info.packets == 625
+    assert abs(info.bitrate - 24000) < 100  # 60 байт на 20 мс
+    assert info.channels == 1
+    assert not info.silent
+    assert info.quality == "excellent"
+    print(f"✅ {info.duration:.2f}s, {info.bitrate} бит/с, каналов: {info.channels}")
+
+def test_silence_detected():
+    """Запись из одних тихих пакетов и пустая запись считаются тишиной"""
+    print("\n=== Тест тишины ===")
+    silent = analyze_opus(build_ogg_opus(5, packet_size=lambda: 3))
+    assert silent.silent and silent.quiet_ratio == 1.0
+
+    empty = analyze_opus(build_ogg_opus(0))
+    assert empty.silent and empty.duration == 0
+    print("✅ Тишина и пустая запись распознаны без сети")
+
+def test_packet_samples():
+    """Длительность пакета по TOC-байту"""
+    print("\n=== Тест TOC ===")
+    assert packet_samples(b'\x48') == 960          # SILK WB 20 мс
+    assert packet_samples(b'\xf8') == 960          # CELT FB 20 мс
+    assert packet_samples(b'\x49') == 1920         # два кадра
+    assert packet_samples(b'\x4b\x03') == 2880     # три кадра (code 3)
+    print("✅ Длительность пакетов определяется по TOC")
+
+def test_not_ogg():
+    """Не Ogg - ошибка разбора"""
+    print("\n=== Тест не-Ogg данных ===")
+    try:
+        analyze_opus(b'RIFF....WAVEfmt ')
+        assert False, "ожидалась OggError"
+    except OggError:
+        pass
+    print("✅ OggError для не-Ogg данных")
+
+def test_gemini_quality_is_local():
+    """analyze_audio_quality не обращается к модели"""
+    print("\n=== Тест анализа качества без модели ===")
+    from services.gemini import GeminiService
+
+    class NoNetworkModel:
+        def generate_content(self, *args, **kwargs):
+            raise AssertionError("вызов модели")
+
+    service = GeminiService.__new__(GeminiService)
+    service.model = NoNetworkModel()
+    result = asyncio.run(service.analyze_audio_quality(build_ogg_opus(3)))
+
+    assert result["readable"] and abs(result["duration"] - 3) < 0.02
+    print(f"✅ {result['analysis']}")
+
+if __name__ == "__main__":
+    try:
+        test_duration_and_bitrate()
+        test_silence_detected()
+        test_packet_samples()
+        test_not_ogg()
+        test_gemini_quality_is_local()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
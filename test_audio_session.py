@@ -0,0 +1,198 @@
+"""
+Тест общей загрузки голосового сообщения для всех этапов обработки.
+"""
+
+import sys
+import os
+import time
+import json
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+import services.gemini as gemini_module
+from test_gemini_modes import FakeModel, make_service
+
+class FailingModel(FakeModel):
+    """Первый запрос (прямая обработка) падает, остальные отвечают по списку"""
+    def generate_content(self, contents, **kwargs):
+        if not self.calls:
+            self.calls.append((contents, kwargs))
+            raise RuntimeError("500 Internal error")
+        return super().generate_content(contents, **kwargs)
+
+def make_audio_service(answers, inline_max_kb=0):
+    """Сервис с фейковой загрузкой аудио, считающей обращения к File API"""
+    Config.GEMINI_INLINE_AUDIO_MAX_KB = inline_max_kb
+    service = make_service([])
+    service.model = FailingModel(answers)
+    service.prompt_cache.plain_model = service.model
+    service.uploads = []
+    service.deleted = []
+
+    async def fake_upload(audio_data, deadline=None):
+        await asyncio.sleep(0.01)
+        service.uploads.append(audio_data)
+        return f"files/{len(service.uploads)}"
+
+    async def fake_cleanup(audio_file):
+        service.deleted.append(audio_file)
+
+    service._upload_audio = fake_upload
+    service._cleanup_audio = fake_cleanup
+    return service
+
+def test_upload_shared_across_fallback():
+    """Транскрипция после неудачной прямой обработки использует тот же файл"""
+    print("=== Тест повторного использования загруженного аудио ===")
+
+    Config.ANSWER_GENERATION_MODE = 'two_stage'
+    service = make_audio_service(["Расшифровка вопроса"])
+
+    async def pipeline():
+        async with service.audio_session(b"OggS-voice") as audio:
+            full_answer, short_answer, transcript = await service.process_audio_with_context(audio, "")
+            assert "ошибка" in full_answer.lower() and transcript is None
+            assert service.deleted == []
+
+            text = await service.transcribe_audio(audio)
+            assert text == "Расшифровка вопроса"
+            assert audio.uses == 2
+
+    asyncio.run(pipeline())
+
+    assert len(service.uploads) == 1
+    assert service.deleted == ["files/1"]
+    # Оба запроса получили один и тот же файл
+    assert service.model.calls[0][0][1] == service.model.calls[1][0][1] == "files/1"
+    print("✅ Одна загрузка на конвейер, файл удален после всех этапов")
+
+def test_concurrent_stages_upload_once():
+    """Параллельные этапы ждут одну загрузку"""
+    print("\n=== Тест параллельных этапов ===")
+
+    service = make_audio_service([])
+
+    async def scenario():
+        async with service.audio_session(b"OggS") as audio:
+            parts = await asyncio.gather(*(audio.get_part() for _ in range(3)))
+        return parts
+
+    assert asyncio.run(scenario()) == ["files/1"] * 3
+    assert len(service.uploads) == 1
+    print("✅ Три этапа - одна загрузка")
+
+def test_short_audio_sent_inline():
+    """Короткое аудио передается в запросе без загрузки и удаления файла"""
+    print("\n=== Тест передачи короткого аудио в запросе ===")
+
+    Config.ANSWER_GENERATION_MODE = 'two_stage'
+    payload = json.dumps({'transcript': 'Вопрос', 'full_answer': 'Полный'}, ensure_ascii=False)
+    service = make_audio_service([payload, "Кратко"], inline_max_kb=64)
+    service.model.calls.append(("прогрев", {}))  # без искусственной ошибки первого запроса
+
+    async def pipeline():
+        async with service.audio_session(b"OggS" * 100) as audio:
+            return await service.process_audio_with_context(audio, "")
+
+    assert asyncio.run(pipeline()) == ("Полный", "Кратко", "Вопрос")
+    assert service.uploads == [] and service.deleted == []
+    assert service.model.calls[1][0][1] == {'mime_type': 'audio/ogg', 'data': b"OggS" * 100}
+
+    # Большое аудио по-прежнему загружается через File API
+    big = service.audio_session(b"x" * (65 * 1024))
+    assert not big.inline
+    print("✅ Без временного файла, загрузки и ожидания обработки")
+
+class FakeState:
+    def __init__(self, name):
+        self.name = name
+
+class FakeFile:
+    """Файл Gemini с заданным состоянием"""
+    def __init__(self, name, state):
+        self.name = name
+        self.state = FakeState(state)
+
+class FakeFilesAPI:
+    """Замена genai.upload_file/get_file: файл готов после processing_polls проверок"""
+    def __init__(self, processing_polls):
+        self.processing_polls = processing_polls
+        self.polls = 0
+
+    def upload_file(self, path, mime_type=None):
+        return FakeFile("files/slow", "PROCESSING")
+
+    def get_file(self, name):
+        self.polls += 1
+        return FakeFile(name, "PROCESSING" if self.polls < self.processing_polls else "ACTIVE")
+
+def with_fake_files(api, coroutine_factory):
+    """Выполняет сценарий с подмененными функциями File API"""
+    original = gemini_module.genai.upload_file, gemini_module.genai.get_file
+    gemini_module.genai.upload_file, gemini_module.genai.get_file = api.upload_file, api.get_file
+    try:
+        return asyncio.run(coroutine_factory())
+    finally:
+        gemini_module.genai.upload_file, gemini_module.genai.get_file = original
+
+def test_adaptive_polling():
+    """Проверки идут с растущей паузой, ожидание ограничено сроком и отменяемо"""
+    print("\n=== Тест ожидания обработки файла ===")
+
+    Config.GEMINI_FILE_POLL_INITIAL = 0.01
+    Config.GEMINI_FILE_POLL_MAX = 0.04
+    service = make_service([])
+
+    # Файл готов после 4 проверок: 0.01 + 0.02 + 0.04 + 0.04 секунды, а не 4 x 2 секунды
+    api = FakeFilesAPI(processing_polls=4)
+    started = time.monotonic()
+    ready = with_fake_files(api, lambda: service._wait_for_file(
+        FakeFile("files/slow", "PROCESSING"), time.monotonic() + 5
+    ))
+    elapsed = time.monotonic() - started
+    assert ready.state.name == "ACTIVE" and api.polls == 4
+    assert elapsed < 0.5
+
+    # Срок истек - возвращается последнее состояние
+    api = FakeFilesAPI(processing_polls=10 ** 6)
+    started = time.monotonic()
+    stuck = with_fake_files(api, lambda: service._wait_for_file(
+        FakeFile("files/slow", "PROCESSING"), time.monotonic() + 0.1
+    ))
+    assert stuck.state.name == "PROCESSING"
+    assert time.monotonic() - started < 0.3
+
+    # Отмена обработки удаляет загруженный файл
+    deleted = []
+
+    async def fake_cleanup(audio_file):
+        deleted.append(audio_file.name if audio_file else None)
+
+    service._cleanup_audio = fake_cleanup
+
+    async def cancelled_upload():
+        task = asyncio.create_task(service._upload_audio(b"OggS"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert with_fake_files(FakeFilesAPI(processing_polls=10 ** 6), cancelled_upload)
+    assert deleted == ["files/slow"]
+    print(f"✅ Файл готов через {elapsed:.2f}s, срок и отмена соблюдаются")
+
+if __name__ == "__main__":
+    try:
+        test_upload_shared_across_fallback()
+        test_concurrent_stages_upload_once()
+        test_short_audio_sent_inline()
+        test_adaptive_polling()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
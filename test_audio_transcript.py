@@ -0,0 +1,88 @@
+"""
+Тест расшифровки голосового сообщения, получаемой в одном запросе с ответом.
+"""
+
+import sys
+import os
+import json
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from services.gemini import StreamedTranscript
+from test_gemini_modes import make_service
+
+AUDIO = {'mime_type': 'audio/ogg', 'data': b'OggS'}
+
+def run_audio(service):
+    """Прямая обработка inline-аудио"""
+    Config.GEMINI_INLINE_AUDIO_MAX_KB = 64
+    return asyncio.run(service.process_audio_with_context(b'OggS', ""))
+
+def test_structured_fields_per_mode():
+    """Расшифровка и ответ приходят полями JSON, без отдельного запроса"""
+    print("=== Тест структурированной расшифровки ===")
+    try:
+        Config.ANSWER_GENERATION_MODE = 'single_call'
+        payload = {'transcript': 'Как мне быть?', 'full_answer': 'Полный', 'short_answer': 'Кратко'}
+        service = make_service([json.dumps(payload, ensure_ascii=False)])
+        assert run_audio(service) == ('Полный', 'Кратко', 'Как мне быть?')
+        contents, kwargs = service.model.calls[0]
+        assert contents[1] == AUDIO
+        assert kwargs['generation_config'].response_schema['required'] == ['transcript', 'full_answer', 'short_answer']
+
+        Config.ANSWER_GENERATION_MODE = 'lazy'
+        service = make_service([json.dumps({'transcript': 'Как мне быть?', 'short_answer': 'Кратко'})])
+        assert run_audio(service) == (None, 'Кратко', 'Как мне быть?')
+        assert len(service.model.calls) == 1
+
+        Config.ANSWER_GENERATION_MODE = 'two_stage'
+        service = make_service([json.dumps({'transcript': 'Как мне быть?', 'full_answer': 'Полный'}), 'Кратко'])
+        assert run_audio(service) == ('Полный', 'Кратко', 'Как мне быть?')
+        assert len(service.model.calls) == 2
+        print("✅ Во всех режимах расшифровка получена вместе с ответом")
+    finally:
+        Config.ANSWER_GENERATION_MODE = 'two_stage'
+
+def test_plain_text_fallback():
+    """Если модель не вернула JSON, ответ берется как текст, расшифровки нет"""
+    print("\n=== Тест ответа без JSON ===")
+    Config.ANSWER_GENERATION_MODE = 'two_stage'
+    service = make_service(['не JSON', 'Полный', 'Кратко'])
+
+    assert run_audio(service) == ('Полный', 'Кратко', None)
+    print("✅ Ответ сохранен, расшифровка будет получена отдельно")
+
+def test_stream_splits_transcript():
+    """Из потока отделяется расшифровка, пользователь видит только ответ"""
+    print("\n=== Тест расшифровки в потоковом ответе ===")
+    service = make_service([
+        ["Вопрос: Как мне", " быть?\n==", "=\nСо", "вет"]
+    ])
+    heard = StreamedTranscript()
+
+    async def collect():
+        stream = service.stream_audio_short_answer(b'OggS', "", heard)
+        return [partial async for partial in stream]
+
+    assert asyncio.run(collect()) == ["Со", "Совет"]
+    assert heard.text == "Как мне быть?"
+    assert Config.AUDIO_STREAM_FORMAT_PROMPT in service.model.calls[0][0][0]
+
+    # Модель не соблюла формат - весь текст считается ответом
+    service = make_service([["Просто", " совет"]])
+    heard = StreamedTranscript()
+    assert asyncio.run(collect()) == ["Просто совет"]
+    assert heard.text is None
+    print("✅ Расшифровка отделена от ответа")
+
+if __name__ == "__main__":
+    try:
+        test_structured_fields_per_mode()
+        test_plain_text_fallback()
+        test_stream_splits_transcript()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
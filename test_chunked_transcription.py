@@ -0,0 +1,94 @@
+"""
+Тест параллельной транскрипции длинных голосовых сообщений по кускам.
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from services.transcription import ChunkedTranscriber, stitch_transcripts
+from utils.ogg import parse_pages
+from test_ogg import build_ogg_opus
+
+class FakeEngine:
+    """Транскрибирует кусок в номер его первой страницы и считает параллельность"""
+
+    def __init__(self, original: bytes, fail_index: int = None):
+        self.first_pages = [page.body for page in parse_pages(original)[2:]]
+        self.fail_index = fail_index
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    async def transcribe(self, chunk: bytes):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            index = self.first_pages.index(parse_pages(chunk)[2].body)
+            # Куски, начатые позже, заканчиваются раньше - порядок должен сохраниться
+            await asyncio.sleep(0.05 / (index + 1))
+            if index == self.fail_index:
+                raise RuntimeError("quota")
+            return f"кусок {index}"
+        finally:
+            self.active -= 1
+
+def make_transcriber(engine, concurrency=2):
+    class FakeService:
+        async def transcribe_audio(self, audio):
+            return await engine.transcribe(audio)
+
+        async def transcribe_audio_simple(self, audio):
+            return await engine.transcribe(audio)
+
+    return ChunkedTranscriber(FakeService(), FakeService(), concurrency=concurrency)
+
+def test_chunks_in_order_with_bounded_parallelism():
+    """Куски транскрибируются параллельно, не больше concurrency, и склеиваются по порядку"""
+    print("=== Тест параллельной транскрипции кусков ===")
+    Config.CHUNK_TRANSCRIPTION_SECONDS = 30
+    Config.CHUNK_TRANSCRIPTION_OVERLAP = 0
+    data = build_ogg_opus(100)
+    engine = FakeEngine(data)
+
+    text = asyncio.run(make_transcriber(engine, concurrency=2).transcribe(data))
+
+    assert text == "кусок 0 кусок 30 кусок 60 кусок 90"
+    assert engine.max_active == 2
+    print(f"✅ {engine.calls} куска, одновременно не больше {engine.max_active}: {text}")
+
+def test_speech_api_chunks_and_failures():
+    """Для Speech API куски не длиннее минуты, нераспознанный кусок помечается"""
+    print("\n=== Тест кусков для Speech API ===")
+    Config.CHUNK_TRANSCRIPTION_SECONDS = 240
+    Config.CHUNK_TRANSCRIPTION_OVERLAP = 0
+    data = build_ogg_opus(100)
+    engine = FakeEngine(data, fail_index=55)
+
+    text = asyncio.run(make_transcriber(engine, concurrency=4).transcribe(data, use_speech_api=True))
+
+    assert text == "кусок 0 [неразборчиво]"
+    print(f"✅ Куски по 55s, ошибка одного куска не теряет остальные: {text}")
+
+def test_stitch_removes_overlap():
+    """Повтор на перекрытии удаляется без учета регистра и пунктуации"""
+    print("\n=== Тест склейки ===")
+    assert stitch_transcripts(["Как мне лучше", "мне лучше поступить?"]) == "Как мне лучше поступить?"
+    assert stitch_transcripts(["Привет, как дела.", "Как дела у тебя?"]) == "Привет, как дела. у тебя?"
+    # Совпадение одного короткого слова не считается перекрытием
+    assert stitch_transcripts(["Я и", "и ты"]) == "Я и и ты"
+    print("✅ Перекрытие удалено")
+
+if __name__ == "__main__":
+    try:
+        test_chunks_in_order_with_bounded_parallelism()
+        test_speech_api_chunks_and_failures()
+        test_stitch_removes_overlap()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
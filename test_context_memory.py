@@ -0,0 +1,158 @@
+"""
+Тест ограничения памяти ContextManager (выгрузка пользователей и бюджет ответов).
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from utils.context import ContextManager, DEFAULT_USER_IDLE_TTL
+from utils.answer_cache import FullAnswerCache
+from utils.metrics import metrics
+from storage import SQLiteStorage
+
+def save_answer(manager, user_id, text):
+    """Сохраняет ответ так же, как обработчики сообщений"""
+    answer_id = manager.get_next_answer_id(user_id)
+    manager.save_full_answer(user_id, answer_id, text, 'Кратко', 'Вопрос')
+    return answer_id
+
+def test_idle_users_evicted():
+    """Неактивные пользователи выгружаются и подгружаются из хранилища"""
+    print("=== Тест выгрузки неактивных пользователей ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = ContextManager(SQLiteStorage(os.path.join(tmp, 'bot.db')), user_idle_ttl=10)
+        manager.add_to_context(1, 'user', 'Привет')
+        manager.add_to_context(2, 'user', 'Привет')
+
+        # Пользователь 1 давно не писал
+        manager.users[1].last_access -= 100
+        manager._last_sweep -= 100
+        manager.get_user(2)
+
+        assert 1 not in manager.users
+        assert 2 in manager.users
+        assert metrics.snapshot()['gauges']['context.users_in_memory'] == 1
+
+        # При следующем обращении контекст загружается из хранилища
+        assert manager.get_user_message_count(1) == 1
+        manager.close()
+    print("✅ Неактивный пользователь выгружен и восстановлен при обращении")
+
+def test_memory_storage_idle_ttl():
+    """Без хранилища на диске пользователи выгружаются, только если USER_IDLE_TTL задан явно"""
+    print("\n=== Тест выгрузки без постоянного хранилища ===")
+
+    saved_ttl = Config.USER_IDLE_TTL
+    Config.USER_IDLE_TTL = None
+    try:
+        assert ContextManager().user_idle_ttl == 0
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = ContextManager(SQLiteStorage(os.path.join(tmp, 'bot.db')))
+            assert manager.user_idle_ttl == DEFAULT_USER_IDLE_TTL
+            manager.close()
+
+        Config.USER_IDLE_TTL = 10
+        manager = ContextManager()
+        manager.add_to_context(1, 'user', 'Привет')
+        manager.users[1].last_access -= 100
+        manager._last_sweep -= 100
+        manager.get_user(2)
+        # Явно заданный срок действует: диалог выгруженного пользователя потерян
+        assert 1 not in manager.users
+        assert manager.get_user_message_count(1) == 0
+    finally:
+        Config.USER_IDLE_TTL = saved_ttl
+    print("✅ По умолчанию память не выгружается, явный USER_IDLE_TTL соблюдается")
+
+def test_answer_budget_lru():
+    """Полные ответы укладываются в общий бюджет, вытесняются самые давние"""
+    print("\n=== Тест бюджета полных ответов ===")
+
+    manager = ContextManager(user_idle_ttl=0)
+    manager.answer_cache = FullAnswerCache(manager._get_user_answers, max_bytes=3000, spill_path='')
+
+    first = save_answer(manager, 1, 'а' * 500)
+    second = save_answer(manager, 2, 'б' * 500)
+    manager.get_full_answer(1, first)  # ответ пользователя 1 стал свежее
+    third = save_answer(manager, 1, 'в' * 500)
+
+    assert manager.get_full_answer(2, second) is None
+    assert manager.get_full_answer(1, first) is not None
+    assert manager.get_full_answer(1, third) is not None
+    assert manager.answer_cache.total_bytes <= 3000
+
+    # ID не повторяются после вытеснения
+    assert manager.get_next_answer_id(1) == 2
+    print(f"✅ Вытеснен самый давний ответ, в памяти {manager.answer_cache.total_bytes} байт")
+
+def test_evicted_answers_survive_restart():
+    """Ответы, вытесненные из памяти, остаются в хранилище и доступны после перезапуска"""
+    print("\n=== Тест вытеснения ответов с хранилищем на диске ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.db')
+
+        def open_manager():
+            manager = ContextManager(SQLiteStorage(path), user_idle_ttl=0)
+            manager.answer_cache = FullAnswerCache(manager._get_user_answers, max_bytes=300, spill_path='')
+            manager.answer_cache.on_evict = manager._keep_in_storage
+            return manager
+
+        manager = open_manager()
+        ids = [save_answer(manager, 1, str(number) * 100) for number in range(5)]
+        assert ids[0] not in manager.users[1].full_answers
+        # Вытесненный ответ читается из хранилища
+        assert manager.get_full_answer(1, ids[1])['full_answer'] == '1' * 100
+        manager.close()
+
+        manager = open_manager()
+        for number, answer_id in enumerate(ids):
+            assert manager.get_full_answer(1, answer_id)['full_answer'] == str(number) * 100
+        assert manager.answer_cache.total_bytes <= 300
+
+        # Новый чат забывает вытесненные ответы
+        manager.clear_context(1)
+        manager.close()
+        manager = open_manager()
+        assert manager.get_full_answer(1, ids[0]) is None
+        manager.close()
+    print("✅ После перезапуска доступны все ответы, в том числе вытесненные")
+
+def test_answer_spill_to_disk():
+    """Вытесненные ответы возвращаются из файла"""
+    print("\n=== Тест вытеснения ответов на диск ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = ContextManager(user_idle_ttl=0)
+        manager.answer_cache = FullAnswerCache(
+            manager._get_user_answers, max_bytes=1500, spill_path=os.path.join(tmp, 'spill.db')
+        )
+
+        first = save_answer(manager, 1, 'а' * 500)
+        save_answer(manager, 1, 'б' * 500)
+        assert first not in manager.users[1].full_answers
+
+        restored = manager.get_full_answer(1, first)
+        assert restored['full_answer'] == 'а' * 500
+
+        manager.clear_context(1)
+        assert manager.answer_cache.restore(1, 1) is None
+        manager.close()
+    print("✅ Ответ восстановлен из файла, очистка удаляет вытесненные ответы")
+
+if __name__ == "__main__":
+    try:
+        test_idle_users_evicted()
+        test_memory_storage_idle_ttl()
+        test_answer_budget_lru()
+        test_evicted_answers_survive_restart()
+        test_answer_spill_to_disk()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
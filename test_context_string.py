@@ -0,0 +1,104 @@
+"""
+Тест инкрементальной строки контекста UserData.
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models.user import UserData
+from utils.tokens import estimate_tokens
+
+def render_full(messages):
+    """Исходная реализация: пересборка строки по всей истории"""
+    if not messages:
+        return ""
+    parts = []
+    for msg in messages:
+        if msg['role'] == 'user':
+            parts.append(f"Пользователь: {msg['content']}")
+        else:
+            parts.append(f"Советник: {msg['content']}")
+    return "История разговора:\n" + "\n".join(parts) + "\n\n"
+
+def test_incremental_matches_full_rebuild():
+    """Строка совпадает с полной пересборкой при добавлении, вытеснении и очистке"""
+    print("=== Тест инкрементальной строки контекста ===")
+
+    rng = random.Random(3)
+    user = UserData(user_id=1, max_context_length=5)
+
+    for step in range(500):
+        action = rng.random()
+        if action < 0.02:
+            user.clear_context()
+        elif action < 0.04:
+            user.start_new_chat_with_summary("итог\nс переносом")
+        elif action < 0.06:
+            user.max_context_length = rng.randint(2, 8)
+            user.add_to_context('user', 'после смены лимита')
+        elif action < 0.08:
+            user.context_token_budget = rng.choice([0, 20, 60])
+            user.collapse_answers = rng.random() < 0.5
+        else:
+            role = rng.choice(['user', 'assistant'])
+            content = "\n".join("слово " * rng.randint(0, 5) for _ in range(rng.randint(1, 3)))
+            user.add_to_context(role, content, "кратко" if rng.random() < 0.5 else None)
+
+        assert user.get_context_string() == render_full(user.context_messages), f"шаг {step}"
+
+    restored = UserData.from_dict(user.to_dict(), max_context_length=user.max_context_length)
+    assert restored.get_context_string() == user.get_context_string()
+    assert restored.get_context_tokens() == user.get_context_tokens()
+    print("✅ 500 случайных операций: строка совпадает с полной пересборкой")
+
+def test_token_budget():
+    """История укладывается в бюджет токенов, новые сообщения сохраняются"""
+    print("\n=== Тест бюджета токенов ===")
+
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("ок") < estimate_tokens("Советую " * 100)
+
+    user = UserData(user_id=1, max_context_length=100, context_token_budget=300)
+    user.add_to_context('user', 'ок')
+    user.add_to_context('assistant', 'Развернутый совет. ' * 60)
+    user.add_to_context('user', 'А подробнее?')
+
+    assert user.get_context_tokens() <= 300
+    assert user.context_messages[-1]['content'] == 'А подробнее?'
+    assert user.get_context_string() == render_full(user.context_messages)
+
+    # Одно сообщение больше бюджета все равно остается в истории
+    user.add_to_context('assistant', 'Очень длинный ответ. ' * 200)
+    assert len(user.context_messages) == 1
+    print(f"✅ История ~{user.get_context_tokens()} токенов, вытеснены старые сообщения")
+
+def test_collapse_answers():
+    """Прошлые ответы сворачиваются до краткой версии, последний остается полным"""
+    print("\n=== Тест сворачивания ответов ===")
+
+    user = UserData(user_id=1, collapse_answers=True)
+    user.add_to_context('user', 'Вопрос 1')
+    user.add_to_context('assistant', 'Полный ответ 1 ' * 50, 'Кратко 1')
+    user.add_to_context('user', 'Вопрос 2')
+    tokens_before = user.get_context_tokens()
+    user.add_to_context('assistant', 'Полный ответ 2 ' * 50, 'Кратко 2')
+
+    contents = [msg['content'] for msg in user.context_messages]
+    assert contents[1] == 'Кратко 1'
+    assert contents[3].startswith('Полный ответ 2')
+    assert user.get_context_string() == render_full(user.context_messages)
+    assert user.get_context_tokens() < tokens_before + estimate_tokens('Советник: ' + contents[3])
+    print("✅ Полным остается только последний ответ")
+
+if __name__ == "__main__":
+    try:
+        test_incremental_matches_full_rebuild()
+        test_token_budget()
+        test_collapse_answers()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
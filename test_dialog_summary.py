@@ -0,0 +1,183 @@
+"""
+Тест инкрементального и фонового резюме диалога.
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from services.dialog_summary import DialogSummarizer
+from services.llm_executor import LLMExecutor
+from models.user import UserData
+from utils.context import ContextManager
+from utils.metrics import metrics
+
+class FakeGemini:
+    """Резюме - перечень учтенных вопросов; запоминает размер каждого запроса"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.executor = LLMExecutor(max_concurrency=1)
+        self.folds = []
+        self.full_calls = 0
+
+    async def update_dialog_summary(self, summary, new_messages):
+        await asyncio.sleep(self.delay)
+        questions = [line for line in new_messages.split("\n") if line.startswith("Пользователь:")]
+        self.folds.append(len(questions))
+        return ((summary + ", ") if summary else "") + ", ".join(q.split(": ")[1] for q in questions)
+
+    async def generate_dialog_summary(self, context):
+        self.full_calls += 1
+        return "полное резюме"
+
+def chat(manager, user_id, first, last):
+    """Добавляет вопросы first..last с ответами"""
+    for number in range(first, last + 1):
+        manager.add_to_context(user_id, "user", f"в{number}")
+        manager.add_to_context(user_id, "assistant", f"о{number}")
+
+def counter(name):
+    return metrics.snapshot()['counters'].get(name, 0)
+
+def test_rollover_uses_precomputed_summary():
+    """С 7-го сообщения резюме дополняется по частям, на 10-м остается учесть последний ответ"""
+    print("=== Тест фонового резюме ===")
+    Config.SUMMARY_PRECOMPUTE = True
+    manager = ContextManager()
+    gemini = FakeGemini()
+    summarizer = DialogSummarizer(manager, gemini)
+    fresh = counter('dialog_summary.rollover.fresh')
+
+    async def scenario():
+        chat(manager, 1, 1, 6)
+        summarizer.on_message(1)  # до предупреждения резюме не готовится
+        assert not summarizer._tasks
+        for number in range(7, 10):
+            chat(manager, 1, number, number)
+            summarizer.on_message(1)
+            await asyncio.sleep(0.01)
+        chat(manager, 1, 10, 10)
+        return await summarizer.summary_for_rollover(1)
+
+    summary = asyncio.run(scenario())
+
+    assert summary == ", ".join(f"в{number}" for number in range(1, 11))
+    assert gemini.folds == [7, 1, 1, 1]
+    assert gemini.full_calls == 0
+    assert counter('dialog_summary.rollover.fresh') == fresh + 1
+    print(f"✅ Запросы по {gemini.folds} вопроса вместо полного резюме на 10-м сообщении")
+
+def test_rollover_waits_for_running_update():
+    """Если фоновое обновление не закончилось, новый чат ждет его и дописывает остаток"""
+    print("\n=== Тест незавершенного фонового резюме ===")
+    manager = ContextManager()
+    gemini = FakeGemini(delay=0.05)
+    summarizer = DialogSummarizer(manager, gemini)
+    stale = counter('dialog_summary.rollover.stale')
+    promoted = counter('gemini.promoted')
+
+    async def scenario():
+        chat(manager, 1, 1, 7)
+        summarizer.on_message(1)
+        await asyncio.sleep(0)
+        chat(manager, 1, 8, 10)
+        return await summarizer.summary_for_rollover(1)
+
+    assert asyncio.run(scenario()).endswith("в7, в8, в9, в10")
+    assert gemini.folds == [7, 3] and gemini.full_calls == 0
+    assert counter('dialog_summary.rollover.stale') == stale + 1
+    assert counter('gemini.promoted') == promoted + 1
+    print("✅ Дождались фонового резюме (повышено до интерактивного), сообщения не учтены дважды")
+
+def test_new_chat_folds_only_new_messages():
+    """В новом чате резюме дописывается к резюме предыдущего, точка переживает сохранение"""
+    print("\n=== Тест резюме после нового чата ===")
+    manager = ContextManager()
+    gemini = FakeGemini()
+    summarizer = DialogSummarizer(manager, gemini)
+
+    async def scenario():
+        chat(manager, 1, 1, 10)
+        manager.start_new_chat_with_summary(1, await summarizer.summarize(1))
+        chat(manager, 1, 11, 12)
+        first = await summarizer.summarize(1)
+        second = await summarizer.summarize(1)  # без новых сообщений - без запроса
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second == ", ".join(f"в{number}" for number in range(1, 13))
+    assert gemini.folds == [10, 2]
+
+    user = manager.get_user(1)
+    restored = UserData.from_dict(user.to_dict())
+    assert restored.get_summary_delta() == (first, [], (user.chat_number, 4))
+    print("✅ Стоимость резюме не растет с длиной разговора")
+
+def test_cleared_chat_and_failures():
+    """Резюме очищенного чата не переносится; при ошибке резюме создается по всей истории"""
+    print("\n=== Тест очистки и ошибок ===")
+    manager = ContextManager()
+    gemini = FakeGemini()
+    summarizer = DialogSummarizer(manager, gemini)
+
+    async def scenario():
+        chat(manager, 1, 1, 7)
+        summarizer.on_message(1)
+        await asyncio.sleep(0.01)
+        manager.clear_context(1)
+        chat(manager, 1, 1, 1)
+        summarizer.on_message(1)
+        assert not summarizer._tasks
+        cleared = await summarizer.summarize(1)
+
+        async def failing(summary, new_messages):
+            return None
+        gemini.update_dialog_summary = failing
+        chat(manager, 1, 2, 2)
+        return cleared, await summarizer.summarize(1)
+
+    assert asyncio.run(scenario()) == ("в1", "полное резюме")
+    assert gemini.full_calls == 1
+    print("✅ Резюме старого чата не попало в новый, ошибка не теряет резюме")
+
+def test_repeated_taps_share_one_summary():
+    """Одновременные нажатия ждут одну генерацию, повторное - берется из кэша"""
+    print("\n=== Тест повторных нажатий ===")
+    manager = ContextManager()
+    gemini = FakeGemini(delay=0.05)
+    summarizer = DialogSummarizer(manager, gemini)
+    hits, misses = counter('cache.dialog_summary.hits'), counter('cache.dialog_summary.misses')
+    joined = counter('dialog_summary.joined')
+
+    async def scenario():
+        chat(manager, 1, 1, 3)
+        first = await asyncio.gather(summarizer.summarize(1), summarizer.summarize(1))
+        again = await summarizer.summarize(1)
+        chat(manager, 1, 4, 4)
+        changed = await summarizer.summarize(1)
+        return first, again, changed
+
+    first, again, changed = asyncio.run(scenario())
+    assert first == ["в1, в2, в3"] * 2 and again == "в1, в2, в3"
+    assert changed == "в1, в2, в3, в4"
+    assert gemini.folds == [3, 1]
+    assert counter('dialog_summary.joined') == joined + 1
+    assert counter('cache.dialog_summary.hits') == hits + 1
+    assert counter('cache.dialog_summary.misses') == misses + 3
+    print("✅ Три нажатия - один запрос, новое сообщение обновляет резюме")
+
+if __name__ == "__main__":
+    try:
+        test_rollover_uses_precomputed_summary()
+        test_rollover_waits_for_running_update()
+        test_new_chat_folds_only_new_messages()
+        test_cleared_chat_and_failures()
+        test_repeated_taps_share_one_summary()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
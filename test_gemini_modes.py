@@ -0,0 +1,219 @@
+"""
+Тест режимов генерации ответов GeminiService (без обращения к API).
+"""
+
+import sys
+import os
+import json
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from services.gemini import GeminiService
+from services.llm_executor import LLMExecutor
+from services.full_answers import FullAnswerService
+from utils.context import ContextManager
+from utils.metrics import metrics
+
+class FakeResponse:
+    """Ответ модели с полем text"""
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Модель, возвращающая заранее заданные ответы и запоминающая вызовы"""
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def generate_content(self, contents, **kwargs):
+        self.calls.append((contents, kwargs))
+        return FakeResponse(self.answers.pop(0))
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.calls.append((contents, kwargs))
+        chunks = self.answers.pop(0)
+
+        async def iterate():
+            for chunk in chunks:
+                yield FakeResponse(chunk)
+
+        return iterate()
+
+def make_service(answers):
+    """Создает сервис с фейковой моделью"""
+    service = GeminiService(executor=LLMExecutor(max_concurrency=2))
+    service.model = FakeModel(answers)
+    # Ответы с системным промптом идут через ту же фейковую модель, без кэша
+    service.prompt_cache.enabled = False
+    service.prompt_cache.plain_model = service.model
+    return service
+
+def test_single_call_mode():
+    """Полный и краткий ответ приходят одним запросом"""
+    print("=== Тест однопроходного режима ===")
+
+    Config.ANSWER_GENERATION_MODE = 'single_call'
+    try:
+        payload = json.dumps({'full_answer': 'Полный', 'short_answer': 'Кратко'}, ensure_ascii=False)
+        service = make_service([payload])
+
+        full_answer, short_answer = asyncio.run(service.process_with_context("Вопрос", ""))
+
+        assert (full_answer, short_answer) == ('Полный', 'Кратко')
+        assert len(service.model.calls) == 1
+        assert 'generation_config' in service.model.calls[0][1]
+        assert metrics.summarize('answer_latency.text.single_call')['count'] >= 1
+        print("✅ Один запрос вместо двух")
+    finally:
+        Config.ANSWER_GENERATION_MODE = 'two_stage'
+
+def test_single_call_fallback():
+    """При неразборчивом ответе используется двухэтапный режим"""
+    print("\n=== Тест отката на двухэтапный режим ===")
+
+    Config.ANSWER_GENERATION_MODE = 'single_call'
+    try:
+        service = make_service(["не JSON", "Полный", "Кратко"])
+
+        full_answer, short_answer = asyncio.run(service.process_with_context("Вопрос", ""))
+
+        assert (full_answer, short_answer) == ('Полный', 'Кратко')
+        assert len(service.model.calls) == 3
+        assert metrics.summarize('answer_latency.text.single_call_fallback')['count'] >= 1
+        print("✅ Откат на два этапа работает")
+    finally:
+        Config.ANSWER_GENERATION_MODE = 'two_stage'
+
+def test_two_stage_mode():
+    """Режим по умолчанию делает два запроса"""
+    print("\n=== Тест двухэтапного режима ===")
+
+    service = make_service(["Полный", "Кратко"])
+
+    full_answer, short_answer = asyncio.run(service.process_with_context("Вопрос", ""))
+
+    assert (full_answer, short_answer) == ('Полный', 'Кратко')
+    assert len(service.model.calls) == 2
+    assert metrics.summarize('answer_latency.text.two_stage')['count'] >= 1
+    print("✅ Два запроса в режиме two_stage")
+
+def test_lazy_mode_and_full_answer_expansion():
+    """В режиме lazy сразу генерируется краткий ответ, полный - один раз по запросу"""
+    print("\n=== Тест ленивого режима ===")
+
+    Config.ANSWER_GENERATION_MODE = 'lazy'
+    try:
+        service = make_service(["Кратко", "Полный"])
+        cm = ContextManager()
+        full_answers = FullAnswerService(cm, service)
+
+        full_answer, short_answer = asyncio.run(service.process_with_context("Вопрос", "Контекст\n"))
+        assert full_answer is None and short_answer == "Кратко"
+        assert len(service.model.calls) == 1
+
+        cm.save_full_answer(1, 0, full_answer, short_answer, "Вопрос", context="Контекст\n")
+        assert FullAnswerService.is_pending(cm.get_full_answer(1, 0))
+
+        async def double_tap():
+            return await asyncio.gather(
+                full_answers.ensure_full_answer(1, 0),
+                full_answers.ensure_full_answer(1, 0)
+            )
+
+        first, second = asyncio.run(double_tap())
+        assert first['full_answer'] == second['full_answer'] == "Полный"
+        assert first['short_answer'] == "Кратко"
+        assert len(service.model.calls) == 2
+        assert "Контекст" in service.model.calls[1][0]
+        print("✅ Полный ответ сгенерирован один раз при двойном нажатии")
+    finally:
+        Config.ANSWER_GENERATION_MODE = 'two_stage'
+
+def test_full_answer_saved_after_answer_reloaded():
+    """Полный ответ сохраняется, даже если запись ответа перечитали, пока шла генерация"""
+    print("\n=== Тест сохранения полного ответа после перечитывания ===")
+
+    service = make_service(["Полный"])
+    cm = ContextManager()
+    full_answers = FullAnswerService(cm, service)
+    cm.save_full_answer(1, 0, None, "Кратко", "Вопрос", message_id=5, context="Контекст\n")
+    cm.save_full_answer(2, 0, None, "Кратко", "Вопрос", context="Контекст\n")
+    generate = service.generate_full_answer
+    during_generation = []
+
+    async def generate_with_change(question, context):
+        during_generation.pop()()
+        return await generate(question, context)
+
+    service.generate_full_answer = generate_with_change
+
+    def reload_answer():
+        # Ответ вытеснен и восстановлен: в памяти новый словарь с теми же данными
+        answers = cm.users[1].full_answers
+        answers[0] = dict(answers[0])
+
+    during_generation.append(reload_answer)
+    assert asyncio.run(full_answers.ensure_full_answer(1, 0))['full_answer'] == "Полный"
+
+    # Ответ заменен новым вопросом - результат генерации устарел
+    service.model.answers.append("Полный")
+    during_generation.append(lambda: cm.save_full_answer(2, 0, None, "Кратко", "Другой вопрос"))
+    assert asyncio.run(full_answers.ensure_full_answer(2, 0))['full_answer'] is None
+    print("✅ Сравниваются данные ответа, а не объект словаря")
+
+def test_stream_short_answer():
+    """Потоковая генерация выдает накопленный текст и пишет время первого фрагмента"""
+    print("\n=== Тест потоковой генерации ===")
+
+    service = make_service([["Крат", "кий ", "ответ"]])
+
+    async def collect():
+        return [text async for text in service.stream_short_answer("Вопрос", "")]
+
+    partials = asyncio.run(collect())
+
+    assert partials == ["Крат", "Краткий ", "Краткий ответ"]
+    assert metrics.summarize('answer_first_token.text')['count'] >= 1
+    assert service.executor.get_stats()['in_flight'] == 0
+    print("✅ Фрагменты накапливаются, слот исполнителя освобожден")
+
+def test_stream_releases_slot_before_consumer_finishes():
+    """Слот исполнителя освобождается по окончании генерации, а не после медленных правок сообщения"""
+    print("\n=== Тест освобождения слота при потоковой генерации ===")
+
+    service = make_service([["Крат", "кий ", "ответ"], ["Следующий"]])
+
+    async def scenario():
+        stream = service.stream_short_answer("Вопрос", "")
+        first = await stream.__anext__()
+        # Потребитель "правит сообщение", генерация тем временем завершается
+        await asyncio.sleep(0.01)
+        in_flight = service.executor.get_stats()['in_flight']
+        rest = [text async for text in stream]
+        # Брошенный поток отменяет генерацию и тоже освобождает слот
+        abandoned = service.stream_short_answer("Вопрос", "")
+        await abandoned.__anext__()
+        await abandoned.aclose()
+        await asyncio.sleep(0)
+        return first, rest, in_flight, service.executor.get_stats()['in_flight']
+
+    first, rest, in_flight, after_close = asyncio.run(scenario())
+    assert first == "Крат" and rest == ["Краткий ", "Краткий ответ"]
+    assert in_flight == 0 and after_close == 0
+    print("✅ Слот свободен, пока потребитель дочитывает фрагменты")
+
+if __name__ == "__main__":
+    try:
+        test_single_call_mode()
+        test_single_call_fallback()
+        test_two_stage_mode()
+        test_lazy_mode_and_full_answer_expansion()
+        test_full_answer_saved_after_answer_reloaded()
+        test_stream_short_answer()
+        test_stream_releases_slot_before_consumer_finishes()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,121 @@
+"""
+Тест хеджированной транскрипции (гонка Gemini и Speech API).
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.transcription import HedgedTranscriber
+from utils.metrics import metrics
+
+class FakeEngine:
+    """Движок транскрипции с заданной задержкой и результатом"""
+
+    def __init__(self, delay, text):
+        self.delay = delay
+        self.text = text
+        self.calls = 0
+        self.cancelled = False
+
+    async def run(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.text, Exception):
+            raise self.text
+        return self.text
+
+def make_transcriber(gemini, speech, hedge_delay):
+    """Собирает HedgedTranscriber поверх заглушек"""
+    class FakeGemini:
+        async def transcribe_audio(self, audio):
+            return await gemini.run()
+
+    class FakeSpeech:
+        async def transcribe_audio_simple(self, audio_data):
+            return await speech.run()
+
+    return HedgedTranscriber(FakeGemini(), FakeSpeech(), hedge_delay=hedge_delay)
+
+def counter(name):
+    return metrics.snapshot()['counters'].get(name, 0)
+
+def test_fast_primary_no_hedge():
+    """Быстрый Gemini отвечает до задержки - Speech API не вызывается"""
+    print("=== Тест быстрого основного движка ===")
+    gemini, speech = FakeEngine(0.01, 'текст Gemini'), FakeEngine(0.01, 'текст Speech')
+    transcriber = make_transcriber(gemini, speech, hedge_delay=0.2)
+
+    text, winner = asyncio.run(transcriber.transcribe(b'audio', b'audio'))
+
+    assert (text, winner) == ('текст Gemini', 'gemini')
+    assert speech.calls == 0
+    print("✅ Резервный движок не запускался")
+
+def test_slow_primary_hedged():
+    """Медленный Gemini проигрывает Speech API и отменяется"""
+    print("\n=== Тест медленного основного движка ===")
+    gemini, speech = FakeEngine(5, 'текст Gemini'), FakeEngine(0.01, 'текст Speech')
+    transcriber = make_transcriber(gemini, speech, hedge_delay=0.05)
+    won_before = counter('transcription.hedge.won.speech_api')
+
+    async def scenario():
+        started = asyncio.get_running_loop().time()
+        result = await transcriber.transcribe(b'audio', b'audio')
+        await asyncio.sleep(0)  # даем отмене дойти до проигравшего
+        return result, asyncio.get_running_loop().time() - started
+
+    (text, winner), elapsed = asyncio.run(scenario())
+
+    assert (text, winner) == ('текст Speech', 'speech_api')
+    assert gemini.cancelled
+    assert elapsed < 1
+    assert counter('transcription.hedge.won.speech_api') == won_before + 1
+    assert metrics.summarize('transcription.hedge.margin')['count'] >= 1
+    print(f"✅ Ответ за {elapsed:.2f}s вместо 5s, Gemini отменен")
+
+def test_empty_primary_starts_secondary_immediately():
+    """Пустой результат Gemini запускает Speech API, не дожидаясь задержки"""
+    print("\n=== Тест пустого результата основного движка ===")
+    gemini, speech = FakeEngine(0.01, None), FakeEngine(0.01, 'текст Speech')
+    transcriber = make_transcriber(gemini, speech, hedge_delay=5)
+
+    async def scenario():
+        started = asyncio.get_running_loop().time()
+        result = await transcriber.transcribe(b'audio', b'audio')
+        return result, asyncio.get_running_loop().time() - started
+
+    (text, winner), elapsed = asyncio.run(scenario())
+
+    assert (text, winner) == ('текст Speech', 'speech_api')
+    assert elapsed < 1
+    print("✅ Speech API запущен сразу после пустого ответа Gemini")
+
+def test_both_fail():
+    """Оба движка не справились - возвращается None"""
+    print("\n=== Тест неудачи обоих движков ===")
+    gemini, speech = FakeEngine(0.01, RuntimeError("quota")), FakeEngine(0.01, '')
+    transcriber = make_transcriber(gemini, speech, hedge_delay=0)
+
+    text, winner = asyncio.run(transcriber.transcribe(b'audio', b'audio'))
+
+    assert (text, winner) == (None, 'none')
+    assert gemini.calls == 1 and speech.calls == 1
+    print("✅ Ошибка и пустой результат дают None")
+
+if __name__ == "__main__":
+    try:
+        test_fast_primary_no_hedge()
+        test_slow_primary_hedged()
+        test_empty_primary_starts_secondary_immediately()
+        test_both_fail()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,183 @@
+"""
+Тест ограниченного исполнителя вызовов Gemini (параллелизм, честная очередь, перегрузка).
+"""
+
+import sys
+import os
+import time
+import asyncio
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.llm_executor import LLMExecutor, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, mark_request, use_request
+from utils.metrics import metrics
+
+def test_executor_limits_concurrency():
+    """Блокирующие вызовы выполняются параллельно, но не больше лимита"""
+    print("=== Тест ограничения параллелизма ===")
+
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+
+    def blocking_call(value):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        return value * 2
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=2)
+        tasks = [asyncio.create_task(executor.run(blocking_call, i)) for i in range(6)]
+        await asyncio.sleep(0.01)
+        stats = executor.get_stats()
+        assert stats['in_flight'] == 2
+        assert stats['queued'] == 4
+        results = await asyncio.gather(*tasks)
+        executor.shutdown()
+        return results, executor.get_stats()
+
+    results, stats = asyncio.run(scenario())
+
+    assert results == [i * 2 for i in range(6)]
+    assert state['peak'] == 2
+    assert stats['in_flight'] == 0 and stats['queued'] == 0
+    assert stats['completed'] == 6
+    print("✅ Не более 2 одновременных вызовов, очередь учитывается")
+
+def test_executor_does_not_block_event_loop():
+    """Пока идет блокирующий вызов, цикл событий продолжает работать"""
+    print("\n=== Тест неблокирующего выполнения ===")
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1)
+        ticks = 0
+        call = asyncio.create_task(executor.run(time.sleep, 0.1))
+        while not call.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        executor.shutdown()
+        return ticks
+
+    ticks = asyncio.run(scenario())
+    assert ticks >= 5
+    print(f"✅ Цикл событий отработал {ticks} тиков во время вызова")
+
+def test_fair_order_and_priorities():
+    """Освободившийся слот получает интерактивный запрос, пользователи чередуются"""
+    print("\n=== Тест честной очереди ===")
+    order = []
+
+    async def request(executor, name, user_id, priority=PRIORITY_INTERACTIVE):
+        mark_request(user_id, priority)
+        async with executor.slot():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, max_queue=0)
+        tasks = [asyncio.create_task(request(executor, "занят", 0))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request(executor, f"A{i}", 1)) for i in range(3)]
+        tasks.append(asyncio.create_task(request(executor, "резюме", 3, PRIORITY_BACKGROUND)))
+        tasks.append(asyncio.create_task(request(executor, "B0", 2)))
+        cancelled = asyncio.create_task(request(executor, "отменен", 2))
+        await asyncio.sleep(0)
+        assert executor.get_stats()['queued'] == 6
+        cancelled.cancel()
+        await asyncio.gather(*tasks)
+        executor.shutdown()
+        return executor.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert order == ["занят", "A0", "B0", "A1", "A2", "резюме"]
+    assert stats['queued'] == 0 and stats['in_flight'] == 0
+    assert metrics.summarize('gemini.queue_wait.background')['count'] >= 1
+    print(f"✅ Порядок: {order}")
+
+def test_promote_waiting_background_request():
+    """Фоновый запрос, который теперь ждет пользователь, переходит в интерактивную очередь"""
+    print("\n=== Тест повышения приоритета ===")
+    order = []
+
+    async def request(executor, name, ticket):
+        use_request(ticket)
+        async with executor.slot():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, max_queue=0)
+        tasks = [asyncio.create_task(request(executor, "занят", mark_request(0)))]
+        await asyncio.sleep(0)
+        ticket = mark_request(1, PRIORITY_BACKGROUND)
+        tasks.append(asyncio.create_task(request(executor, "фон другого", mark_request(2, PRIORITY_BACKGROUND))))
+        tasks.append(asyncio.create_task(request(executor, "полный ответ", ticket)))
+        await asyncio.sleep(0)
+        executor.promote(ticket)
+        tasks.append(asyncio.create_task(request(executor, "вопрос", mark_request(3))))
+        await asyncio.gather(*tasks)
+        executor.shutdown()
+        return ticket.priority
+
+    assert asyncio.run(scenario()) == PRIORITY_INTERACTIVE
+    assert order == ["занят", "полный ответ", "вопрос", "фон другого"]
+    print(f"✅ Порядок: {order}")
+
+def test_cancelled_call_holds_slot():
+    """Отмена ожидающего не освобождает слот, пока поток еще выполняет вызов"""
+    print("\n=== Тест отмены вызова в пуле ===")
+    finished = {}
+
+    def blocking_call(name):
+        time.sleep(0.1)
+        finished[name] = time.monotonic()
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, max_queue=0)
+        loser = asyncio.create_task(executor.run(blocking_call, "проигравший"))
+        await asyncio.sleep(0.01)
+        loser.cancel()
+        await asyncio.gather(loser, return_exceptions=True)
+        busy = executor.get_stats()['in_flight']
+        await executor.run(blocking_call, "следующий")
+        executor.shutdown()
+        return loser.cancelled(), busy, executor.get_stats()
+
+    cancelled, busy, stats = asyncio.run(scenario())
+    assert cancelled and busy == 1
+    assert finished["следующий"] - finished["проигравший"] >= 0.09
+    assert stats['in_flight'] == 0 and stats['completed'] == 2
+    print("✅ Следующий вызов начался после завершения отмененного")
+
+def test_overloaded_when_queue_full():
+    """При переполненной очереди исполнитель сообщает о перегрузке"""
+    print("\n=== Тест отклонения при перегрузке ===")
+
+    async def scenario():
+        executor = LLMExecutor(max_concurrency=1, max_queue=2)
+        tasks = [asyncio.create_task(executor.run(time.sleep, 0.05)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        overloaded = executor.overloaded()
+        await asyncio.gather(*tasks)
+        executor.shutdown()
+        return overloaded, executor.overloaded()
+
+    assert asyncio.run(scenario()) == (True, False)
+    print("✅ Перегрузка определяется по длине очереди")
+
+if __name__ == "__main__":
+    try:
+        test_executor_limits_concurrency()
+        test_executor_does_not_block_event_loop()
+        test_fair_order_and_priorities()
+        test_promote_waiting_background_request()
+        test_cancelled_call_holds_slot()
+        test_overloaded_when_queue_full()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,127 @@
+"""
+Тест разбора и нарезки Ogg/Opus.
+"""
+
+import sys
+import os
+import random
+import struct
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.ogg import (OggPage, FLAG_BOS, FLAG_EOS, FLAG_CONTINUED, OPUS_SAMPLE_RATE,
+                       ogg_crc, parse_pages, parse_opus_head, split_ogg)
+
+PRE_SKIP = 312
+FRAME_SAMPLES = 960  # 20 мс
+
+def build_ogg_opus(seconds: float, packets_per_page: int = 50, packet_size=lambda: 60,
+                   channels: int = 1, seed: int = 1) -> bytes:
+    """Собирает Ogg/Opus с пакетами заданного размера (содержимое не декодируется)"""
+    rng = random.Random(seed)
+    serial = 0x1234
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, channels, PRE_SKIP, 48000, 0, 0)
+    tags = b'OpusTags' + struct.pack('<I', 6) + b'sovet' + b'n' + struct.pack('<I', 0)
+
+    def page(flags, granule, sequence, packets):
+        lacing = bytearray()
+        for packet in packets:
+            lacing += bytes([255] * (len(packet) // 255) + [len(packet) % 255])
+        return OggPage(flags, granule, serial, sequence, bytes(lacing), b''.join(packets)).to_bytes()
+
+    pages = [page(FLAG_BOS, 0, 0, [head]), page(0, 0, 1, [tags])]
+    total_packets = int(seconds * OPUS_SAMPLE_RATE / FRAME_SAMPLES)
+    granule = PRE_SKIP
+    sequence = 2
+    for first in range(0, total_packets, packets_per_page):
+        count = min(packets_per_page, total_packets - first)
+        # TOC 0x48: SILK WB, один кадр 20 мс - как в голосовых сообщениях Telegram
+        packets = [b'\x48' + bytes(rng.getrandbits(8) for _ in range(packet_size() - 1)) for _ in range(count)]
+        granule += count * FRAME_SAMPLES
+        last = first + count >= total_packets
+        pages.append(page(FLAG_EOS if last else 0, granule, sequence, packets))
+        sequence += 1
+    return b''.join(pages)
+
+def check_stream(data: bytes):
+    """Проверяет, что поток самостоятельный: CRC, флаги, номера страниц"""
+    pages = parse_pages(data)
+    raw_offset = 0
+    for index, page in enumerate(pages):
+        raw = page.to_bytes()
+        assert data[raw_offset:raw_offset + len(raw)] == raw, "CRC или заголовок страницы не совпадает"
+        raw_offset += len(raw)
+        assert page.sequence == index
+        assert bool(page.flags & FLAG_BOS) == (index == 0)
+        assert bool(page.flags & FLAG_EOS) == (index == len(pages) - 1)
+    return pages
+
+def test_crc():
+    """CRC совпадает с эталонным значением полинома Ogg"""
+    print("=== Тест CRC Ogg ===")
+    assert ogg_crc(b'123456789') == 0x89A1897F
+    check_stream(build_ogg_opus(2))
+    print("✅ CRC страниц корректен")
+
+def test_split_with_overlap():
+    """Куски укладываются в длительность, перекрываются и покрывают все аудио"""
+    print("\n=== Тест нарезки ===")
+    data = build_ogg_opus(100)  # страницы по 1 с
+
+    chunks = split_ogg(data, chunk_seconds=30, overlap_seconds=2)
+    assert len(chunks) == 4
+
+    original = [page.body for page in parse_pages(data)[2:]]
+    position = 0
+    for chunk in chunks:
+        pages = check_stream(chunk)
+        head = parse_opus_head(pages[0])
+        assert head.pre_skip == PRE_SKIP
+        audio = pages[2:]
+        assert 0 < audio[-1].granule - PRE_SKIP <= 30 * OPUS_SAMPLE_RATE
+
+        # Кусок - непрерывный фрагмент исходного аудио, начинающийся с перекрытием
+        first = original.index(audio[0].body)
+        assert first < position if position else first == 0
+        assert [page.body for page in audio] == original[first:first + len(audio)]
+        position = first + len(audio)
+    assert position == len(original)
+    print(f"✅ {len(chunks)} кусков по ≤30s с перекрытием, все аудио покрыто")
+
+def test_split_short_and_by_size():
+    """Короткое аудио не режется, большое режется и по размеру"""
+    print("\n=== Тест коротких и больших записей ===")
+    data = build_ogg_opus(10)
+    # Короткий поток не пересобирается: возвращается тот же буфер
+    assert split_ogg(data, chunk_seconds=30)[0] is data
+
+    chunks = split_ogg(data, chunk_seconds=300, max_chunk_bytes=len(data) // 3)
+    assert len(chunks) >= 3
+    assert all(len(chunk) <= len(data) // 3 for chunk in chunks)
+    print(f"✅ Ограничение по размеру дает {len(chunks)} куска")
+
+def test_continued_packets_not_split():
+    """Пакет, разорванный между страницами, не разрезается"""
+    print("\n=== Тест пакетов на границе страниц ===")
+    data = build_ogg_opus(20, packets_per_page=10)
+    pages = parse_pages(data)
+    # Четвертая страница продолжает пакет третьей - перед ней резать нельзя
+    third = pages[3]
+    pages[3] = OggPage(third.flags | FLAG_CONTINUED, third.granule, third.serial, third.sequence,
+                       third.lacing, third.body)
+    data = b''.join(page.to_bytes() for page in pages)
+
+    for chunk in split_ogg(data, chunk_seconds=0.1):
+        assert not parse_pages(chunk)[2].continued
+    print("✅ Куски начинаются только с нового пакета")
+
+if __name__ == "__main__":
+    try:
+        test_crc()
+        test_split_with_overlap()
+        test_split_short_and_by_size()
+        test_continued_packets_not_split()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
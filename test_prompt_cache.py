@@ -0,0 +1,111 @@
+"""
+Тест кэша системного промпта (без обращения к API).
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.prompt_cache import PromptCache
+from services.llm_executor import LLMExecutor
+
+class FakeClock:
+    """Управляемое время"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeCacheBackend:
+    """Заглушка API кэша контекста: кэш - словарь, модель - кортеж"""
+    def __init__(self, fail_create=False):
+        self.fail_create = fail_create
+        self.created = []
+        self.extended = []
+        self.deleted = []
+
+    def create_model(self, model_name, system_instruction):
+        return ('plain', system_instruction)
+
+    def create_cache(self, model_name, system_instruction, ttl):
+        if self.fail_create:
+            raise RuntimeError("model does not support caching")
+        cache = {'id': len(self.created), 'ttl': ttl}
+        self.created.append(cache)
+        return cache
+
+    def extend_cache(self, cache, ttl):
+        self.extended.append((cache['id'], ttl))
+
+    def model_from_cache(self, cache):
+        return ('cached', cache['id'])
+
+    def delete_cache(self, cache):
+        self.deleted.append(cache['id'])
+
+def make_cache(backend, clock):
+    return PromptCache(
+        model_name='gemini-test', system_instruction='Системный промпт', enabled=True,
+        ttl=600, refresh_margin=60, retry_interval=300,
+        backend=backend, executor=LLMExecutor(max_concurrency=2), clock=clock
+    )
+
+def test_cache_created_once_and_refreshed():
+    """Кэш создается один раз, продлевается перед истечением и пересоздается после"""
+    print("=== Тест жизненного цикла кэша ===")
+
+    backend = FakeCacheBackend()
+    clock = FakeClock()
+    cache = make_cache(backend, clock)
+
+    async def scenario():
+        # Одновременные первые запросы создают один кэш
+        models = await asyncio.gather(*(cache.get_model() for _ in range(5)))
+        assert set(models) == {('cached', 0)}
+        assert len(backend.created) == 1
+
+        clock.now += 560  # до истечения меньше refresh_margin
+        assert await cache.get_model() == ('cached', 0)
+        assert backend.extended == [(0, 600)]
+
+        clock.now += 700  # кэш истек
+        assert await cache.get_model() == ('cached', 1)
+        assert len(backend.created) == 2
+
+        await cache.close()
+        assert backend.deleted == [1]
+
+    asyncio.run(scenario())
+    print("✅ Создание, продление, пересоздание после истечения и удаление")
+
+def test_fallback_without_cache_support():
+    """Без поддержки кэша используется system_instruction, повтор - через retry_interval"""
+    print("\n=== Тест работы без кэша ===")
+
+    backend = FakeCacheBackend(fail_create=True)
+    clock = FakeClock()
+    cache = make_cache(backend, clock)
+
+    async def scenario():
+        assert await cache.get_model() == ('plain', 'Системный промпт')
+        clock.now += 100
+        assert await cache.get_model() == ('plain', 'Системный промпт')
+
+        backend.fail_create = False
+        clock.now += 300
+        assert await cache.get_model() == ('cached', 0)
+
+    asyncio.run(scenario())
+    print("✅ Ошибка кэша не ломает ответы, повторная попытка по расписанию")
+
+if __name__ == "__main__":
+    try:
+        test_cache_created_once_and_refreshed()
+        test_fallback_without_cache_support()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
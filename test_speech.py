@@ -0,0 +1,141 @@
+"""
+Тест SpeechService на локальной заглушке Speech API (повторы и keep-alive).
+"""
+
+import sys
+import os
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from services.speech import SpeechService
+from utils.metrics import metrics
+
+class StubSpeechHandler(BaseHTTPRequestHandler):
+    """Отвечает заранее заданными статусами и запоминает соединения клиентов"""
+    protocol_version = "HTTP/1.1"
+    statuses = []
+    results = None
+    requests = []
+    connections = set()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        type(self).requests.append(body)
+        type(self).connections.add(self.client_address)
+
+        status = type(self).statuses.pop(0) if type(self).statuses else 200
+        if status == 200:
+            payload = {'results': type(self).results or [{'alternatives': [{'transcript': 'Привет, мир'}]}]}
+        else:
+            payload = {'error': {'code': status}}
+        data = json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def run_with_stub(statuses, coro_factory):
+    """Запускает заглушку Speech API и выполняет сценарий против нее"""
+    StubSpeechHandler.statuses = list(statuses)
+    StubSpeechHandler.requests = []
+    StubSpeechHandler.connections = set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSpeechHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/speech:recognize"
+    try:
+        return asyncio.run(coro_factory(url))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_retry_on_server_error():
+    """503 и 429 повторяются, соединение переиспользуется"""
+    print("=== Тест повторов Speech API ===")
+    Config.SPEECH_RETRY_BASE_DELAY = 0.01
+    retries_before = metrics.snapshot()['counters'].get('speech.retries', 0)
+
+    async def scenario(url):
+        service = SpeechService(url=url)
+        try:
+            first = await service.transcribe_audio_simple(b'OggS fake audio')
+            second = await service.transcribe_audio_simple(b'OggS fake audio')
+            return first, second
+        finally:
+            await service.close()
+
+    first, second = run_with_stub([503, 429], scenario)
+
+    assert first == 'Привет, мир'
+    assert second == 'Привет, мир'
+    assert len(StubSpeechHandler.requests) == 4
+    assert StubSpeechHandler.requests[0]['config']['languageCode'] == 'ru-RU'
+    assert len(StubSpeechHandler.connections) == 1
+    assert metrics.snapshot()['counters']['speech.retries'] - retries_before == 2
+    print("✅ Ответы 503 и 429 повторены, все запросы прошли через одно соединение")
+
+def test_retries_exhausted():
+    """После исчерпания повторов возвращается None"""
+    print("\n=== Тест исчерпания повторов ===")
+    Config.SPEECH_RETRY_BASE_DELAY = 0.01
+
+    async def scenario(url):
+        service = SpeechService(url=url)
+        service.max_retries = 1
+        try:
+            return await service.transcribe_audio_simple(b'OggS fake audio')
+        finally:
+            await service.close()
+
+    result = run_with_stub([500, 500, 500], scenario)
+
+    assert result is None
+    assert len(StubSpeechHandler.requests) == 2
+    print("✅ Сделано 1 + max_retries попыток, ошибка не выброшена")
+
+def test_multiple_results_joined():
+    """Все результаты длинной записи попадают в транскрипцию, а не только первый"""
+    print("\n=== Тест нескольких результатов ===")
+
+    async def scenario(url):
+        service = SpeechService(url=url)
+        try:
+            return await service.transcribe_audio_simple(b'OggS fake audio')
+        finally:
+            await service.close()
+
+    StubSpeechHandler.results = [
+        {'alternatives': [{'transcript': 'Первая фраза'}]},
+        {'alternatives': [{'transcript': ' вторая фраза'}, {'transcript': 'вариант'}]},
+        {'alternatives': []},
+        {'alternatives': [{'transcript': 'третья'}]}
+    ]
+    try:
+        result = run_with_stub([], scenario)
+    finally:
+        StubSpeechHandler.results = None
+
+    assert result == 'Первая фраза вторая фраза третья'
+    print("✅ Результаты всех отрезков объединены")
+
+if __name__ == "__main__":
+    try:
+        test_retry_on_server_error()
+        test_retries_exhausted()
+        test_multiple_results_joined()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
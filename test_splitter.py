@@ -0,0 +1,60 @@
+"""
+Тест разбивки длинных сообщений MessageSplitter.
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.messages import MessageSplitter, _MarkdownState
+from bench_splitter import make_llm_text
+
+def test_incremental_state_matches_full_scan():
+    """Состояние склейки совпадает с подсчетом по всей строке"""
+    print("=== Тест инкрементального подсчета разметки ===")
+
+    rng = random.Random(0)
+    alphabet = ['a', 'Я', ' ', '\n', '*', '**', '_', '`', '.', '! ', 'слово']
+    for _ in range(2000):
+        left = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 15)))
+        right = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 15)))
+        for separator in ['', ' ', '\n\n']:
+            joined = _MarkdownState.of(left).joined(separator, _MarkdownState.of(right))
+            expected = _MarkdownState.of(left + separator + right)
+            assert joined.tag_counts() == expected.tag_counts(), (left, separator, right)
+            assert joined.is_safe() == expected.is_safe(), (left, separator, right)
+            assert joined.length == expected.length
+
+    print("✅ Склейка состояний эквивалентна полному пересчету")
+
+def test_split_llm_answer():
+    """Длинный ответ делится на части в пределах лимита без потери текста"""
+    print("\n=== Тест разбивки длинного ответа ===")
+
+    text = make_llm_text(60 * 1024)
+    splitter = MessageSplitter(4000)
+    parts = splitter.split(text)
+
+    assert len(parts) > 1
+    assert all(len(part) <= 4000 for part in parts)
+    assert "".join(text.split()) == "".join("".join(parts).split())
+    print(f"✅ {len(parts)} частей, текст сохранен полностью")
+
+def test_short_and_blank_messages():
+    """Короткий текст не делится, пустой длинный текст не вызывает ошибку"""
+    splitter = MessageSplitter(10)
+    assert splitter.split("короткий") == ["короткий"]
+    assert splitter.split(" " * 50) == [" " * 10]
+    print("✅ Граничные случаи обработаны")
+
+if __name__ == "__main__":
+    try:
+        test_incremental_state_matches_full_scan()
+        test_split_llm_answer()
+        test_short_and_blank_messages()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,215 @@
+"""
+Тест хранилищ контекста пользователей.
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage import MemoryStorage, SQLiteStorage, RedisStorage
+from utils.context import ContextManager
+
+class FakeRedis:
+    """Минимальная замена клиента Redis (get/pipeline)"""
+
+    def __init__(self):
+        self.data = {}
+        self.pipelines = 0
+
+    def get(self, key):
+        value = self.data.get(key)
+        return value.encode('utf-8') if value is not None else None
+
+    def pipeline(self):
+        self.pipelines += 1
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append((key, value))
+
+    def execute(self):
+        for key, value in self.commands:
+            self.client.data[key] = value
+
+def fill_dialog(manager, user_id):
+    """Создает типичный диалог с сохраненным полным ответом"""
+    manager.add_to_context(user_id, 'user', 'Как дела?')
+    manager.add_to_context(user_id, 'assistant', 'Отлично')
+    manager.save_full_answer(user_id, 0, 'Полный ответ', 'Краткий', 'Как дела?', message_id=42)
+
+def check_restored(manager, user_id):
+    """Проверяет, что данные пользователя восстановлены из хранилища"""
+    assert manager.get_user_message_count(user_id) == 1
+    assert manager.get_context_count(user_id) == 2
+    answer = manager.get_full_answer(user_id, 0)
+    assert answer['full_answer'] == 'Полный ответ'
+    assert answer['message_id'] == 42
+
+def test_memory_storage():
+    """Хранилище по умолчанию ничего не сохраняет"""
+    print("=== Тест хранилища в памяти ===")
+
+    manager = ContextManager(MemoryStorage())
+    fill_dialog(manager, 1)
+    assert manager.get_context_count(1) == 2
+    manager.close()
+
+    assert ContextManager(MemoryStorage()).get_context_count(1) == 0
+    print("✅ Контекст живет только в памяти")
+
+def test_sqlite_storage():
+    """Контекст переживает перезапуск с SQLite"""
+    print("\n=== Тест SQLite ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data', 'bot.db')
+
+        storage = SQLiteStorage(path, flush_interval=60)
+        manager = ContextManager(storage)
+        fill_dialog(manager, 1)
+
+        # До фоновой записи данные читаются из очереди
+        assert storage.load(1)['user_message_count'] == 1
+        manager.close()
+
+        restarted = ContextManager(SQLiteStorage(path))
+        check_restored(restarted, 1)
+        assert restarted.get_next_answer_id(1) == 1
+
+        restarted.clear_context(1)
+        restarted.close()
+
+        cleared = ContextManager(SQLiteStorage(path))
+        assert cleared.get_context_count(1) == 0
+        cleared.close()
+    print("✅ Данные восстановлены после перезапуска, очистка тоже сохраняется")
+
+def test_batched_writes():
+    """Несколько изменений одного пользователя записываются одним снимком"""
+    print("\n=== Тест пакетной записи ===")
+
+    client = FakeRedis()
+    storage = RedisStorage(client=client, flush_interval=60)
+    manager = ContextManager(storage)
+
+    for user_id in range(1, 4):
+        fill_dialog(manager, user_id)
+    assert client.pipelines == 0
+
+    storage.flush()
+    assert client.pipelines == 1
+    assert len(client.data) == 3
+
+    restarted = ContextManager(RedisStorage(client=client))
+    check_restored(restarted, 2)
+    print("✅ 9 изменений 3 пользователей записаны одним пакетом")
+
+def test_load_during_write():
+    """Пока пакет записывается, load() возвращает его, а не старые данные"""
+    print("\n=== Тест чтения во время записи ===")
+
+    client = FakeRedis()
+    storage = RedisStorage(client=client, flush_interval=60)
+    storage.save(1, {'user_id': 1, 'user_message_count': 1})
+    storage.flush()
+
+    started, release = threading.Event(), threading.Event()
+    write_batch = storage._write_batch
+
+    def blocked_write(items):
+        started.set()
+        release.wait(5)
+        write_batch(items)
+
+    storage._write_batch = blocked_write
+    storage.save(1, {'user_id': 1, 'user_message_count': 2})
+    writer = threading.Thread(target=storage.flush)
+    writer.start()
+    assert started.wait(5)
+
+    assert storage.load(1)['user_message_count'] == 2
+    release.set()
+    writer.join()
+    assert storage.load(1)['user_message_count'] == 2
+    assert not storage._writing
+    print("✅ Пакет в процессе записи виден при чтении")
+
+def test_preload_off_event_loop():
+    """Пользователь читается из хранилища в пуле потоков, дальше - только из памяти"""
+    print("\n=== Тест загрузки вне цикла событий ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.db')
+        manager = ContextManager(SQLiteStorage(path))
+        fill_dialog(manager, 1)
+        manager.close()
+
+        storage = SQLiteStorage(path)
+        restarted = ContextManager(storage)
+        threads = []
+        load = storage.load
+
+        def tracked_load(user_id):
+            threads.append(threading.current_thread())
+            return load(user_id)
+        storage.load = tracked_load
+
+        asyncio.run(restarted.preload_user(1))
+        assert threads and threads[0] is not threading.main_thread()
+        check_restored(restarted, 1)
+        assert len(threads) == 1
+        restarted.close()
+    print("✅ Чтение выполнено в отдельном потоке, один раз")
+
+class CountingStorage(MemoryStorage):
+    """Сохраняющее хранилище, считающее полученные снимки"""
+    persistent = True
+
+    def __init__(self):
+        self.saves = []
+
+    def save(self, user_id, data):
+        self.saves.append(user_id)
+
+def test_one_snapshot_per_message():
+    """В цикле событий изменения за одно сообщение дают один снимок; без диска снимков нет"""
+    print("\n=== Тест снимков за сообщение ===")
+
+    storage = CountingStorage()
+    manager = ContextManager(storage)
+
+    async def handle_message():
+        fill_dialog(manager, 1)
+        assert storage.saves == []  # снимок строится после обработчика
+        await asyncio.sleep(0)
+
+    asyncio.run(handle_message())
+    assert storage.saves == [1]
+
+    memory = ContextManager(MemoryStorage())
+    memory.users[1] = memory.get_user(1)
+    memory.users[1].to_dict = lambda: (_ for _ in ()).throw(AssertionError("снимок не нужен"))
+    fill_dialog(memory, 1)
+    print("✅ Три изменения - один снимок")
+
+if __name__ == "__main__":
+    try:
+        test_memory_storage()
+        test_sqlite_storage()
+        test_batched_writes()
+        test_load_during_write()
+        test_preload_off_event_loop()
+        test_one_snapshot_per_message()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
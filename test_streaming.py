@@ -0,0 +1,121 @@
+"""
+Тест потокового вывода ответа с ограничением частоты правок.
+"""
+
+import sys
+import os
+import asyncio
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from telegram.error import RetryAfter
+from config import Config
+from utils.streaming import ChatEditThrottler, StreamingReply
+
+class FakeMessage:
+    """Сообщение Telegram, запоминающее правки"""
+    def __init__(self, chat_id=1):
+        self.chat_id = chat_id
+        self.edits = []
+        self.deleted = False
+
+    async def edit_text(self, text, parse_mode=None, reply_markup=None):
+        self.edits.append((text, parse_mode, reply_markup))
+
+    async def delete(self):
+        self.deleted = True
+
+    async def reply_text(self, text, parse_mode=None, reply_markup=None):
+        self.edits.append(('reply', text, reply_markup))
+
+class FakeUpdate:
+    """Update с сообщением пользователя"""
+    def __init__(self, message):
+        self.message = message
+
+def test_edits_are_throttled():
+    """Частые фрагменты не превращаются в частые правки"""
+    print("=== Тест ограничения частоты правок ===")
+
+    async def scenario():
+        message = FakeMessage()
+        reply = StreamingReply(message, ChatEditThrottler(min_interval=0.05))
+        text = ""
+        for i in range(40):
+            text += f"слово{i} "
+            await reply.update(text)
+            await asyncio.sleep(0.005)
+        await reply.finalize(FakeUpdate(message), text.strip(), 'Markdown', 'markup')
+        return message
+
+    message = asyncio.run(scenario())
+
+    intermediate = message.edits[:-1]
+    assert 1 <= len(intermediate) <= 6
+    assert all(parse_mode is None for _, parse_mode, _ in intermediate)
+    assert message.edits[-1] == (" ".join(f"слово{i}" for i in range(40)), 'Markdown', 'markup')
+    print(f"✅ {len(intermediate)} промежуточных правок на 40 фрагментов")
+
+def test_group_chats_use_longer_interval():
+    """В группах интервал между правками не меньше 3 секунд"""
+    throttler = ChatEditThrottler(min_interval=1.0)
+    throttler.mark(-100)
+    throttler.mark(100)
+    assert not throttler.ready(-100)
+    assert throttler._interval(-100) == ChatEditThrottler.GROUP_MIN_INTERVAL
+    assert throttler._interval(100) == 1.0
+    print("✅ Для групп используется увеличенный интервал")
+
+def test_retry_after_is_kept():
+    """Отсрочка из RetryAfter не сокращается до обычного интервала правок"""
+    print("\n=== Тест отсрочки после RetryAfter ===")
+
+    class FloodedMessage(FakeMessage):
+        async def edit_text(self, text, parse_mode=None, reply_markup=None):
+            raise RetryAfter(30)
+
+    async def scenario():
+        throttler = ChatEditThrottler(min_interval=1.0)
+        reply = StreamingReply(FloodedMessage(), throttler)
+        await reply.update("Частичный ответ")
+        return throttler
+
+    throttler = asyncio.run(scenario())
+    assert not throttler.ready(1)
+    assert throttler._next_allowed[1] - time.monotonic() > 25
+    print("✅ Следующая правка не раньше, чем разрешил Telegram")
+
+def test_long_answer_is_split():
+    """Длинный итоговый ответ отправляется частями, заглушка удаляется"""
+    print("\n=== Тест длинного итогового ответа ===")
+
+    async def scenario():
+        message = FakeMessage()
+        reply = StreamingReply(message, ChatEditThrottler(min_interval=0))
+        long_text = "\n\n".join(["Абзац " + "текст " * 100] * 20)
+        await reply.update(long_text)
+        await reply.finalize(FakeUpdate(message), long_text, 'Markdown', 'markup')
+        return message
+
+    message = asyncio.run(scenario())
+
+    assert message.deleted
+    preview = message.edits[0][0]
+    assert len(preview) <= Config.MESSAGE_LENGTH_LIMIT
+    replies = [edit for edit in message.edits if edit[0] == 'reply']
+    assert len(replies) > 1
+    assert all(len(text) <= Config.MESSAGE_LENGTH_LIMIT for _, text, _ in replies)
+    assert replies[-1][2] == 'markup'
+    print(f"✅ Ответ отправлен {len(replies)} частями")
+
+if __name__ == "__main__":
+    try:
+        test_edits_are_throttled()
+        test_group_chats_use_longer_interval()
+        test_retry_after_is_kept()
+        test_long_answer_is_split()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
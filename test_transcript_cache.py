@@ -0,0 +1,115 @@
+"""
+Тест кэша транскрипций (TTL, LRU, уровень на диске, ключи file_unique_id и хеш).
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.cache import TTLCache, TranscriptCache
+
+class FakeClock:
+    """Управляемые часы"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_ttl_and_lru():
+    """Записи истекают по TTL, лишние вытесняются самые давние"""
+    print("=== Тест TTL и LRU ===")
+    clock = FakeClock()
+    cache = TTLCache('test_lru', max_entries=2, ttl=60, clock=clock)
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'a' стал свежее 'b'
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    clock.now += 61
+    assert cache.get('a') is None
+    print("✅ Вытеснена давняя запись, просроченные не возвращаются")
+
+def test_disk_tier():
+    """Вытесненные из памяти записи и записи до перезапуска читаются с диска"""
+    print("\n=== Тест уровня на диске ===")
+    clock = FakeClock()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.db')
+        cache = TTLCache('test_disk', max_entries=1, ttl=60, disk_path=path, clock=clock)
+        cache.set('a', {'transcript': 'Привет'})
+        cache.set('b', {'transcript': 'Пока'})
+        assert cache.get('a') == {'transcript': 'Привет'}
+        cache.close()
+
+        # После перезапуска
+        restarted = TTLCache('test_disk', max_entries=1, ttl=60, disk_path=path, clock=clock)
+        assert restarted.get('b') == {'transcript': 'Пока'}
+        clock.now += 61
+        assert restarted.get('a') is None
+        restarted.close()
+    print("✅ Записи пережили вытеснение и перезапуск, TTL учитывается на диске")
+
+def disk_keys(cache):
+    """Ключи записей в файле кэша"""
+    return {row[0] for row in cache._disk.execute("SELECT key FROM cache")}
+
+def test_disk_sweep_and_limit():
+    """Файл очищается от просроченных записей и не растет больше лимита"""
+    print("\n=== Тест очистки уровня на диске ===")
+    clock = FakeClock()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TTLCache('test_sweep', max_entries=1, ttl=60, disk_path=os.path.join(tmp, 'ttl.db'), clock=clock)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        clock.now += 61
+        # Просроченные записи удаляются, даже если их больше никто не читает
+        cache.set('c', 3)
+        assert disk_keys(cache) == {'c'}
+        cache.close()
+
+        cache = TTLCache('test_cap', max_entries=1, ttl=0, disk_path=os.path.join(tmp, 'cap.db'),
+                         clock=clock, disk_max_entries=3)
+        for number in range(5):
+            cache.set(f'k{number}', number)
+        cache.set('k0', 0)  # перезаписанная запись становится самой новой
+        assert len(disk_keys(cache)) == 5  # очистка не чаще DISK_SWEEP_INTERVAL
+        clock.now += TTLCache.DISK_SWEEP_INTERVAL
+        cache.set('k5', 5)
+        assert disk_keys(cache) == {'k4', 'k0', 'k5'}
+        assert cache.get('k1') is None and cache.get('k0') == 0
+        cache.close()
+    print("✅ Просроченные удалены, в файле не больше disk_max_entries записей")
+
+def test_transcript_keys():
+    """Повторное аудио находится по file_unique_id, другое ID - по содержимому"""
+    print("\n=== Тест ключей транскрипций ===")
+    transcripts = TranscriptCache(TTLCache('test_transcripts', max_entries=10, ttl=60))
+
+    transcripts.put('Как дела?', 'uniq-1', b'OggS audio', quality={'quality': 'good'})
+    assert transcripts.get('uniq-1')['transcript'] == 'Как дела?'
+    assert transcripts.get('uniq-2') is None
+
+    # То же аудио под другим ID
+    entry = transcripts.get_by_content(b'OggS audio', 'uniq-2')
+    assert entry == {'transcript': 'Как дела?', 'quality': {'quality': 'good'}}
+    assert transcripts.get('uniq-2')['transcript'] == 'Как дела?'
+    assert transcripts.get_by_content(b'other audio') is None
+    print("✅ Поиск по file_unique_id и хешу содержимого")
+
+if __name__ == "__main__":
+    try:
+        test_ttl_and_lru()
+        test_disk_tier()
+        test_disk_sweep_and_limit()
+        test_transcript_keys()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
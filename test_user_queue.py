@@ -0,0 +1,102 @@
+"""
+Тест очереди сообщений пользователя: порядок, отсутствие параллелизма, объединение серий.
+"""
+
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.user_queue import UserWorkQueue
+from utils.metrics import metrics
+
+class Recorder:
+    """Обработчик, запоминающий вызовы и число одновременно выполняемых"""
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.calls = []
+        self.active = {}
+        self.max_active = 0
+
+    async def handle(self, user_id, text):
+        self.active[user_id] = self.active.get(user_id, 0) + 1
+        self.max_active = max(self.max_active, self.active[user_id])
+        await asyncio.sleep(self.delay)
+        self.calls.append((user_id, text))
+        self.active[user_id] -= 1
+
+def test_order_per_user():
+    """Сообщения одного пользователя идут по порядку и по одному, разные пользователи - параллельно"""
+    print("=== Тест порядка обработки ===")
+    recorder = Recorder()
+    queue = UserWorkQueue(coalesce_window=0)
+
+    async def scenario():
+        for number in range(3):
+            queue.submit_text(1, recorder.handle, f"вопрос {number}", 1)
+            queue.submit(2, recorder.handle, 2, f"голосовое {number}")
+        started = asyncio.get_running_loop().time()
+        await queue.join()
+        return asyncio.get_running_loop().time() - started
+
+    elapsed = asyncio.run(scenario())
+    assert [text for user, text in recorder.calls if user == 1] == ["вопрос 0", "вопрос 1", "вопрос 2"]
+    assert recorder.max_active == 1
+    # Пользователи не ждут друг друга
+    assert elapsed < 3 * 2 * recorder.delay
+    assert not queue._queues and not queue._workers
+    print(f"✅ Порядок сохранен, {elapsed:.2f}s на 6 сообщений двух пользователей")
+
+def test_burst_coalesced():
+    """Серия сообщений в пределах окна объединяется в один вызов"""
+    print("\n=== Тест объединения серии ===")
+    recorder = Recorder()
+    queue = UserWorkQueue(coalesce_window=0.05)
+    coalesced = metrics.snapshot()['counters'].get('user_queue.coalesced', 0)
+
+    async def scenario():
+        for text in ["Привет", "у меня вопрос", "про работу"]:
+            queue.submit_text(1, recorder.handle, text, 1)
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.06)  # окно закончилось - обработка началась
+        queue.submit_text(1, recorder.handle, "и еще", 1)
+        queue.submit(1, recorder.handle, 1, "кнопка")
+        queue.submit_text(1, recorder.handle, "после кнопки", 1)
+        await queue.join()
+
+    asyncio.run(scenario())
+    assert recorder.calls == [
+        (1, "Привет\nу меня вопрос\nпро работу"), (1, "и еще"), (1, "кнопка"), (1, "после кнопки")
+    ]
+    assert metrics.snapshot()['counters']['user_queue.coalesced'] == coalesced + 2
+    print("✅ Три сообщения - один запрос, кнопки не объединяются")
+
+def test_failure_does_not_block_queue():
+    """Ошибка обработчика не останавливает очередь"""
+    print("\n=== Тест ошибки обработчика ===")
+    recorder = Recorder(delay=0)
+    queue = UserWorkQueue(coalesce_window=0)
+
+    async def failing(user_id, text):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        queue.submit_text(1, failing, "первый", 1)
+        queue.submit_text(1, recorder.handle, "второй", 1)
+        await queue.join()
+
+    asyncio.run(scenario())
+    assert recorder.calls == [(1, "второй")]
+    print("✅ Следующее сообщение обработано")
+
+if __name__ == "__main__":
+    try:
+        test_order_per_user()
+        test_burst_coalesced()
+        test_failure_does_not_block_queue()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,126 @@
+"""
+Тест пути аудио без копий: от скачивания до запроса к модели (tracemalloc).
+"""
+
+import sys
+import os
+import asyncio
+import base64
+import hashlib
+import json
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.audio_session import AudioSession
+from services.speech import SpeechService
+from utils.messages import MessageUtils
+from utils.ogg import analyze_opus
+from test_ogg import build_ogg_opus
+
+def peak_allocated(func):
+    """Выполняет func и возвращает (результат, пик выделенной памяти в байтах)"""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+def peak_allocated_async(coroutine_factory):
+    """То же для корутины; память считается внутри цикла событий, без накладных расходов asyncio.run"""
+    async def measured():
+        tracemalloc.start()
+        try:
+            result = await coroutine_factory()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, peak
+    return asyncio.run(measured())
+
+class FakeTelegramFile:
+    """Файл Telegram: download_to_memory передает полученные bytes в write()"""
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    async def download_to_memory(self, out):
+        out.write(self.payload)
+
+def test_download_without_copy():
+    """Скачанные bytes передаются дальше тем же объектом"""
+    print("=== Тест скачивания без копии ===")
+    payload = os.urandom(4 * 1024 * 1024)
+
+    data, peak = peak_allocated_async(lambda: MessageUtils.download_bytes(FakeTelegramFile(payload)))
+
+    assert data is payload
+    assert peak < len(payload) // 4
+    print(f"✅ Пик {peak // 1024} КБ при аудио {len(payload) // 1024} КБ")
+
+def test_speech_body_streamed():
+    """Тело запроса к Speech API кодируется по частям, без строки base64 целиком"""
+    print("\n=== Тест потокового base64 ===")
+    audio = os.urandom(4 * 1024 * 1024 + 1)
+    body, length = SpeechService._request_body(audio)
+
+    async def consume():
+        digest = hashlib.sha256()
+        size = 0
+        async for part in body():
+            digest.update(part)
+            size += len(part)
+        return digest.hexdigest(), size
+
+    (digest, size), peak = peak_allocated_async(consume)
+
+    assert size == length
+    assert peak < len(audio) // 4
+
+    # Тело - корректный JSON с тем же аудио
+    full = b''.join(asyncio.run(_collect(body())))
+    assert hashlib.sha256(full).hexdigest() == digest
+    request = json.loads(full)
+    assert request['config']['languageCode'] == 'ru-RU'
+    assert base64.b64decode(request['audio']['content']) == audio
+    print(f"✅ Пик {peak // 1024} КБ вместо ~{len(audio) * 4 // 3 // 1024} КБ строки base64")
+
+async def _collect(stream):
+    return [part async for part in stream]
+
+def test_ogg_analysis_without_copy():
+    """Разбор страниц ссылается на исходный буфер"""
+    print("\n=== Тест разбора Ogg без копий ===")
+    data = build_ogg_opus(300)
+
+    info, peak = peak_allocated(lambda: analyze_opus(data))
+
+    assert abs(info.duration - 300) < 0.1
+    assert peak < len(data) // 2
+    print(f"✅ Пик {peak // 1024} КБ при аудио {len(data) // 1024} КБ")
+
+def test_inline_part_shares_buffer():
+    """Короткое аудио передается в запрос тем же буфером"""
+    print("\n=== Тест inline-аудио без копии ===")
+    data = os.urandom(64 * 1024)
+
+    async def noop(*args):
+        return None
+
+    session = AudioSession(data, noop, noop, inline_max_bytes=len(data))
+    part = asyncio.run(session.get_part())
+    assert part['data'] is data
+    print("✅ Буфер сессии передается в запрос без копирования")
+
+if __name__ == "__main__":
+    try:
+        test_download_without_copy()
+        test_speech_body_streamed()
+        test_ogg_analysis_without_copy()
+        test_inline_part_shares_buffer()
+        print("\n🎉 Все тесты прошли успешно!")
+    except Exception as e:
+        print(f"\n❌ Тест провален: {e}")
+        import traceback
+        traceback.print_exc()
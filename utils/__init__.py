@@ -4,5 +4,8 @@
 
 from .context import ContextManager
 from .messages import MessageUtils
+from .metrics import Metrics, metrics
+from .cache import TTLCache, TranscriptCache
+from .user_queue import UserWorkQueue
 
-__all__ = ['ContextManager', 'MessageUtils'] 
\ No newline at end of file
+__all__ = ['ContextManager', 'MessageUtils', 'Metrics', 'metrics', 'TTLCache', 'TranscriptCache', 'UserWorkQueue'] 
\ No newline at end of file
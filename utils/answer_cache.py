@@ -0,0 +1,152 @@
+"""
+Учет памяти полных ответов: общий бюджет в байтах с вытеснением LRU.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+AnswerKey = Tuple[int, int]
+
+class FullAnswerCache:
+    """
+    Общий для всех пользователей бюджет памяти на полные ответы.
+
+    Сами ответы остаются в UserData.full_answers, здесь хранится только порядок
+    обращений и размер каждого ответа. При превышении бюджета самые давние ответы
+    удаляются из памяти. Если on_evict подтверждает, что ответ остается в хранилище
+    контекста, больше ничего не нужно; иначе при заданном spill_path ответ
+    переносится в файл SQLite и возвращается оттуда при следующем обращении.
+    """
+
+    def __init__(self, get_answers: Callable[[int], Optional[Dict[int, Dict[str, Any]]]],
+                 max_bytes: int = None, spill_path: str = None):
+        """
+        Args:
+            get_answers: Возвращает словарь full_answers пользователя, если он в памяти
+            max_bytes: Бюджет памяти на ответы (0 - без ограничения)
+            spill_path: Файл для вытесненных ответов (None - ответы удаляются)
+        """
+        self.get_answers = get_answers
+        # (user_id, answer_id) -> True, если ответ можно просто убрать из памяти (задает ContextManager)
+        self.on_evict: Optional[Callable[[int, int], bool]] = None
+        self.max_bytes = Config.FULL_ANSWERS_MAX_BYTES if max_bytes is None else max_bytes
+        self.spill_path = Config.FULL_ANSWERS_SPILL_PATH if spill_path is None else spill_path
+        self.total_bytes = 0
+        self._entries: 'OrderedDict[AnswerKey, int]' = OrderedDict()
+        self._spill: Optional[sqlite3.Connection] = None
+
+        if self.spill_path:
+            self._open_spill()
+
+        metrics.set_gauge('context.full_answers_bytes', lambda: self.total_bytes)
+        metrics.set_gauge('context.full_answers_count', lambda: len(self._entries))
+
+    def _open_spill(self):
+        """Открывает файл для вытесненных ответов"""
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._spill = sqlite3.connect(self.spill_path, check_same_thread=False)
+        # Файл - продолжение памяти, а не надежное хранилище: скорость важнее
+        self._spill.execute("PRAGMA journal_mode=WAL")
+        self._spill.execute("PRAGMA synchronous=OFF")
+        self._spill.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "user_id INTEGER, answer_id INTEGER, data TEXT NOT NULL, PRIMARY KEY (user_id, answer_id))"
+        )
+        self._spill.commit()
+
+    @staticmethod
+    def answer_size(answer: Dict[str, Any]) -> int:
+        """Оценивает размер ответа в байтах по его текстовым полям"""
+        return sum(len(value.encode('utf-8')) for value in answer.values() if isinstance(value, str))
+
+    def add(self, user_id: int, answer_id: int, answer: Dict[str, Any]):
+        """Учитывает новый или обновленный ответ и вытесняет лишнее"""
+        key = (user_id, answer_id)
+        self.total_bytes -= self._entries.pop(key, 0)
+        size = self.answer_size(answer)
+        self._entries[key] = size
+        self.total_bytes += size
+        self._evict()
+
+    def touch(self, user_id: int, answer_id: int) -> bool:
+        """Отмечает обращение к ответу; False - ответ не учитывается в памяти"""
+        key = (user_id, answer_id)
+        if key not in self._entries:
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    def restore(self, user_id: int, answer_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает вытесненный ответ из файла (или None)"""
+        if self._spill is None:
+            return None
+
+        row = self._spill.execute(
+            "SELECT data FROM answers WHERE user_id = ? AND answer_id = ?", (user_id, answer_id)
+        ).fetchone()
+        if row is None:
+            return None
+
+        with self._spill:
+            self._spill.execute("DELETE FROM answers WHERE user_id = ? AND answer_id = ?", (user_id, answer_id))
+        metrics.inc('context.full_answers_restored')
+        return json.loads(row[0])
+
+    def forget_user(self, user_id: int, drop_spilled: bool = False):
+        """
+        Перестает учитывать ответы пользователя (пользователь выгружен или очищен)
+
+        Args:
+            drop_spilled: Удалить и вытесненные в файл ответы (при очистке диалога)
+        """
+        for key in [key for key in self._entries if key[0] == user_id]:
+            self.total_bytes -= self._entries.pop(key)
+
+        if drop_spilled and self._spill is not None:
+            with self._spill:
+                self._spill.execute("DELETE FROM answers WHERE user_id = ?", (user_id,))
+
+    def _evict(self):
+        """Вытесняет самые давние ответы, пока не уложимся в бюджет"""
+        if not self.max_bytes:
+            return
+
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            (user_id, answer_id), size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+
+            answers = self.get_answers(user_id)
+            if answers is None or answer_id not in answers:
+                continue
+
+            metrics.inc('context.full_answers_evicted')
+            # on_evict вызывается до удаления: хранилище должно получить ответ
+            if self.on_evict is not None and self.on_evict(user_id, answer_id):
+                del answers[answer_id]
+                continue
+
+            answer = answers.pop(answer_id)
+            if self._spill is not None:
+                with self._spill:
+                    self._spill.execute(
+                        "INSERT OR REPLACE INTO answers (user_id, answer_id, data) VALUES (?, ?, ?)",
+                        (user_id, answer_id, json.dumps(answer, ensure_ascii=False))
+                    )
+                metrics.inc('context.full_answers_spilled')
+
+    def close(self):
+        """Закрывает файл вытесненных ответов"""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
@@ -0,0 +1,230 @@
+"""
+Ограниченный кэш с TTL и вытеснением LRU, с необязательным уровнем на диске (SQLite).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """
+    Кэш JSON-значений: в памяти не больше max_entries записей (LRU),
+    каждая живет ttl секунд.
+
+    Если задан disk_path, записи дублируются в файл SQLite: вытесненные из
+    памяти и сохраненные до перезапуска возвращаются оттуда (и снова
+    поднимаются в память). Просроченные записи удаляются при обращении и
+    не реже раза в DISK_SWEEP_INTERVAL при записи; тогда же файл урезается
+    до disk_max_entries записей (удаляются записанные раньше всех).
+    """
+
+    # Период очистки файла от просроченных и лишних записей (секунды)
+    DISK_SWEEP_INTERVAL = 60
+
+    def __init__(self, name: str, max_entries: int, ttl: float, disk_path: str = None,
+                 clock: Callable[[], float] = time.time, disk_max_entries: int = 0):
+        """
+        Args:
+            name: Имя кэша (префикс метрик cache.<name>.*)
+            max_entries: Максимум записей в памяти
+            ttl: Время жизни записи (секунды, 0 - без ограничения)
+            disk_path: Файл SQLite для второго уровня (None или '' - только память)
+            clock: Источник времени (подменяется в тестах); время на диске переживает перезапуск
+            disk_max_entries: Максимум записей в файле (0 - без ограничения)
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.disk_max_entries = disk_max_entries
+        self._last_sweep = float('-inf')
+        self._memory: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+
+        if disk_path:
+            self._open_disk(disk_path)
+
+        metrics.set_gauge(f'cache.{name}.entries', lambda: len(self._memory))
+
+    def _open_disk(self, path: str):
+        """Открывает файл второго уровня"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._disk = sqlite3.connect(path, check_same_thread=False)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute("PRAGMA synchronous=OFF")
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._disk.commit()
+
+    def _expires_at(self) -> float:
+        return self.clock() + self.ttl if self.ttl else float('inf')
+
+    def get(self, key: str) -> Optional[Any]:
+        """Возвращает значение или None, если записи нет или она истекла"""
+        now = self.clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    metrics.inc(f'cache.{self.name}.hits')
+                    return entry[1]
+                del self._memory[key]
+
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                metrics.inc(f'cache.{self.name}.disk_hits')
+                self._put_memory(key, entry[1], entry[0])
+                return entry[1]
+
+        metrics.inc(f'cache.{self.name}.misses')
+        return None
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        """Читает запись с диска (под блокировкой), возвращает (срок, значение)"""
+        if self._disk is None:
+            return None
+        try:
+            row = self._disk.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._disk.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._disk.commit()
+                return None
+            return row[1], json.loads(row[0])
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка чтения кэша {self.name} с диска: {e}")
+            return None
+
+    def set(self, key: str, value: Any):
+        """Сохраняет значение (в память и, если включен, на диск)"""
+        expires_at = self._expires_at()
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+            if self._disk is not None:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), expires_at)
+                    )
+                    self._disk.commit()
+                    self._maybe_sweep_disk()
+                except Exception as e:
+                    logger.warning(f"⚠️ Ошибка записи кэша {self.name} на диск: {e}")
+
+    def _maybe_sweep_disk(self):
+        """Удаляет с диска просроченные записи и самые старые сверх лимита (под блокировкой)"""
+        now = self.clock()
+        if now - self._last_sweep < self.DISK_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+
+        with self._disk:
+            expired = self._disk.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+            evicted = 0
+            if self.disk_max_entries:
+                excess = self._disk.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.disk_max_entries
+                if excess > 0:
+                    # INSERT OR REPLACE выдает записи новый rowid: меньший rowid - записан раньше
+                    evicted = self._disk.execute(
+                        "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?)",
+                        (excess,)
+                    ).rowcount
+        if expired:
+            metrics.inc(f'cache.{self.name}.disk_expired', expired)
+        if evicted:
+            metrics.inc(f'cache.{self.name}.disk_evicted', evicted)
+
+    def _put_memory(self, key: str, value: Any, expires_at: float):
+        """Кладет запись в память и вытесняет самые давние (под блокировкой)"""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            metrics.inc(f'cache.{self.name}.evicted')
+
+    def close(self):
+        """Закрывает файл второго уровня"""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+
+class TranscriptCache:
+    """
+    Транскрипции голосовых сообщений.
+
+    Ключ - file_unique_id из Telegram (одинаков у пересланных и повторно
+    отправленных сообщений), поэтому повторное аудио не нужно даже скачивать.
+    Если ID не совпал, запасной ключ - SHA-256 содержимого: он избавляет
+    от повторного вызова модели. Вместе с текстом можно сохранить анализ
+    качества аудио.
+    """
+
+    def __init__(self, cache: TTLCache = None):
+        """
+        Args:
+            cache: Хранилище записей (по умолчанию - по настройкам TRANSCRIPT_CACHE_*)
+        """
+        self.cache = cache or TTLCache(
+            'transcripts',
+            max_entries=Config.TRANSCRIPT_CACHE_SIZE,
+            ttl=Config.TRANSCRIPT_CACHE_TTL,
+            disk_path=Config.TRANSCRIPT_CACHE_PATH,
+            disk_max_entries=Config.TRANSCRIPT_CACHE_DISK_SIZE
+        )
+
+    @staticmethod
+    def content_key(data: bytes) -> str:
+        return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+    def get(self, file_unique_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет запись по file_unique_id (до скачивания аудио)
+
+        Returns:
+            dict: {'transcript': ..., 'quality': ...} или None
+        """
+        if not file_unique_id:
+            return None
+        return self.cache.get('file:' + file_unique_id)
+
+    def get_by_content(self, data: bytes, file_unique_id: str = None) -> Optional[Dict[str, Any]]:
+        """Ищет запись по содержимому аудио; найденную запоминает и под file_unique_id"""
+        entry = self.cache.get(self.content_key(data))
+        if entry is not None and file_unique_id:
+            # В следующий раз найдем без скачивания
+            self.cache.set('file:' + file_unique_id, entry)
+        return entry
+
+    def put(self, transcript: str, file_unique_id: str = None, data: bytes = None, quality: dict = None):
+        """Сохраняет транскрипцию под всеми известными ключами"""
+        if not transcript:
+            return
+        entry = {'transcript': transcript}
+        if quality is not None:
+            entry['quality'] = quality
+        if file_unique_id:
+            self.cache.set('file:' + file_unique_id, entry)
+        if data:
+            self.cache.set(self.content_key(data), entry)
+
+    def close(self):
+        self.cache.close()
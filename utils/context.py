@@ -2,55 +2,248 @@
 Менеджер контекста пользователей.
 """
 
-from typing import Dict
+from typing import Dict, Optional, Set, TYPE_CHECKING
 from collections import defaultdict
 from models.user import UserData
+from utils.answer_cache import FullAnswerCache
+from utils.metrics import metrics
 from config import Config
+import asyncio
 import logging
+import time
+
+if TYPE_CHECKING:
+    from storage import ContextStorage
 
 logger = logging.getLogger(__name__)
 
+# Выгрузка неактивных пользователей по умолчанию (при хранилище на диске)
+DEFAULT_USER_IDLE_TTL = 86400
+
 class ContextManager:
-    """Менеджер контекста для всех пользователей"""
+    """
+    Менеджер контекста для всех пользователей
     
-    def __init__(self):
+    Активные пользователи держатся в памяти; хранилище читается только при первом
+    обращении к пользователю, а изменения записываются в него отложенно.
+    Пользователи, неактивные дольше user_idle_ttl, выгружаются из памяти, а полные
+    ответы всех пользователей укладываются в общий бюджет FullAnswerCache.
+    """
+    
+    def __init__(self, storage: Optional['ContextStorage'] = None,
+                 user_idle_ttl: float = None, answer_cache: FullAnswerCache = None):
+        if storage is None:
+            # Импорт здесь: пакет storage сам использует utils.metrics
+            from storage import MemoryStorage
+            storage = MemoryStorage()
+        
         self.users: Dict[int, UserData] = {}
         self.max_context_length = Config.MAX_CONTEXT_MESSAGES
+        self.storage = storage
+        if user_idle_ttl is None:
+            user_idle_ttl = Config.USER_IDLE_TTL
+        if user_idle_ttl is None:
+            # Без хранилища на диске выгрузка стерла бы диалог - по умолчанию не выгружаем
+            user_idle_ttl = DEFAULT_USER_IDLE_TTL if storage.persistent else 0
+        self.user_idle_ttl = user_idle_ttl
+        self.answer_cache = answer_cache or FullAnswerCache(self._get_user_answers)
+        self.answer_cache.on_evict = self._keep_in_storage
+        self._last_sweep = time.time()
+        self._dirty: Set[int] = set()
+        
+        metrics.set_gauge('context.users_in_memory', lambda: len(self.users))
     
     def get_user(self, user_id: int) -> UserData:
         """Получает или создает данные пользователя"""
+        now = time.time()
+        self._maybe_evict_idle_users(now)
+        
+        user = self.users.get(user_id)
+        if user is None:
+            user = self._install_user(user_id, self._load_user(user_id))
+        user.last_access = now
+        return user
+    
+    async def preload_user(self, user_id: int):
+        """
+        Загружает пользователя из хранилища в пуле потоков, не блокируя цикл событий
+        
+        Вызывается до обработки апдейта: после этого get_user не обращается к диску или сети.
+        """
+        if user_id in self.users or not self.storage.persistent:
+            return
+        data = await asyncio.to_thread(self._read_user, user_id)
+        # Пока шло чтение, пользователь мог появиться (параллельный апдейт)
         if user_id not in self.users:
-            self.users[user_id] = UserData(
-                user_id=user_id,
-                max_context_length=self.max_context_length
-            )
-        return self.users[user_id]
-    
-    def add_to_context(self, user_id: int, role: str, content: str):
-        """Добавляет сообщение в контекст пользователя"""
+            self._install_user(user_id, self._user_from(user_id, data))
+    
+    def _install_user(self, user_id: int, user: UserData) -> UserData:
+        """Добавляет загруженного пользователя в память и его ответы - в кэш"""
+        self.users[user_id] = user
+        for answer_id, answer in list(user.full_answers.items()):
+            self.answer_cache.add(user_id, answer_id, answer)
+        return user
+    
+    def _get_user_answers(self, user_id: int):
+        """Полные ответы пользователя, если он загружен в память"""
+        user = self.users.get(user_id)
+        return user.full_answers if user is not None else None
+    
+    def _keep_in_storage(self, user_id: int, answer_id: int) -> bool:
+        """
+        Оставляет вытесняемый из памяти ответ в хранилище
+        
+        Returns:
+            bool: False - хранилище не сохраняет данные (ответ уходит в файл вытеснения или теряется)
+        """
+        user = self.users.get(user_id)
+        if not self.storage.persistent or user is None:
+            return False
+        if user_id in self._dirty:
+            # Несохраненные изменения ответа должны попасть в хранилище до вытеснения
+            self._dirty.discard(user_id)
+            self.storage.save(user_id, user.to_dict())
+        user.stored_answers.add(answer_id)
+        return True
+    
+    def _maybe_evict_idle_users(self, now: float):
+        """Выгружает неактивных пользователей (не чаще раза в минуту)"""
+        if not self.user_idle_ttl or now - self._last_sweep < min(60, self.user_idle_ttl):
+            return
+        self._last_sweep = now
+        
+        deadline = now - self.user_idle_ttl
+        idle = [user_id for user_id, user in self.users.items() if user.last_access < deadline]
+        # Отложенные снимки передаются в хранилище до выгрузки
+        self._save_dirty()
+        for user_id in idle:
+            del self.users[user_id]
+            self.answer_cache.forget_user(user_id)
+        
+        if idle:
+            metrics.inc('context.users_evicted', len(idle))
+            logger.info(f"🧹 Выгружено неактивных пользователей: {len(idle)}")
+    
+    def _load_user(self, user_id: int) -> UserData:
+        """Загружает пользователя из хранилища или создает нового"""
+        return self._user_from(user_id, self._read_user(user_id))
+    
+    def _read_user(self, user_id: int) -> Optional[dict]:
+        """Читает данные пользователя из хранилища (None - нет данных или ошибка)"""
+        try:
+            return self.storage.load(user_id)
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить контекст пользователя {user_id}: {e}")
+            return None
+    
+    def _user_from(self, user_id: int, data: Optional[dict]) -> UserData:
+        """UserData из данных хранилища или новый пользователь"""
+        if data:
+            return UserData.from_dict(data, **self._context_limits())
+        return UserData(user_id=user_id, **self._context_limits())
+    
+    def _context_limits(self) -> dict:
+        """Текущие лимиты истории для UserData"""
+        return {
+            'max_context_length': self.max_context_length,
+            'context_token_budget': Config.CONTEXT_TOKEN_BUDGET,
+            'collapse_answers': Config.CONTEXT_COLLAPSE_ANSWERS
+        }
+    
+    def _persist(self, user_id: int):
+        """
+        Отмечает изменение данных пользователя для хранилища
+        
+        Снимок строится один раз на итерацию цикла событий, сколько бы изменений
+        ни было сделано при обработке сообщения; без хранилища на диске - не строится вовсе.
+        """
+        if not self.storage.persistent or user_id in self._dirty:
+            return
+        self._dirty.add(user_id)
+        try:
+            asyncio.get_running_loop().call_soon(self._save_dirty)
+        except RuntimeError:
+            # Вне цикла событий (скрипты, тесты) снимок передается сразу
+            self._save_dirty()
+    
+    def _save_dirty(self):
+        """Передает в хранилище снимки измененных пользователей"""
+        dirty, self._dirty = self._dirty, set()
+        for user_id in dirty:
+            user = self.users.get(user_id)
+            if user is not None:
+                self.storage.save(user_id, user.to_dict())
+    
+    def close(self):
+        """Записывает отложенные изменения в хранилище"""
+        self._save_dirty()
+        self.storage.close()
+        self.answer_cache.close()
+    
+    def add_to_context(self, user_id: int, role: str, content: str, short_content: str = None):
+        """Добавляет сообщение в контекст пользователя (short_content - краткая версия ответа)"""
         user = self.get_user(user_id)
-        user.add_to_context(role, content)
+        user.add_to_context(role, content, short_content)
+        self._persist(user_id)
     
     def get_context_string(self, user_id: int) -> str:
         """Формирует строку с контекстом разговора"""
         user = self.get_user(user_id)
         return user.get_context_string()
     
+    def get_summary_delta(self, user_id: int) -> tuple:
+        """Резюме на контрольной точке и сообщения после нее (см. UserData.get_summary_delta)"""
+        return self.get_user(user_id).get_summary_delta()
+    
+    def save_summary_checkpoint(self, user_id: int, summary: str, point: tuple) -> bool:
+        """Сохраняет резюме диалога как новую контрольную точку"""
+        saved = self.get_user(user_id).save_summary_checkpoint(summary, point)
+        if saved:
+            self._persist(user_id)
+        return saved
+    
     def clear_context(self, user_id: int):
         """Очищает контекст пользователя"""
-        if user_id in self.users:
-            self.users[user_id].clear_context()
+        user = self.get_user(user_id)
+        user.clear_context()
+        self.answer_cache.forget_user(user_id, drop_spilled=True)
+        self._persist(user_id)
     
     def save_full_answer(self, user_id: int, answer_id: int, full_answer: str, 
-                        short_answer: str, question: str, message_id: int = None):
-        """Сохраняет полный ответ пользователя"""
+                        short_answer: str, question: str, message_id: int = None,
+                        context: str = None):
+        """Сохраняет полный ответ пользователя (full_answer=None - ответ будет сгенерирован позже)"""
         user = self.get_user(user_id)
-        user.save_full_answer(answer_id, full_answer, short_answer, question, message_id)
+        user.save_full_answer(answer_id, full_answer, short_answer, question, message_id, context)
+        self.answer_cache.add(user_id, answer_id, user.full_answers[answer_id])
+        self._persist(user_id)
     
     def get_full_answer(self, user_id: int, answer_id: int):
         """Получает полный ответ пользователя"""
         user = self.get_user(user_id)
-        return user.get_full_answer(answer_id)
+        answer = user.get_full_answer(answer_id)
+        
+        if answer is not None:
+            self.answer_cache.touch(user_id, answer_id)
+            return answer
+        
+        # Ответ мог быть вытеснен из памяти в хранилище или в файл
+        if answer_id in user.stored_answers:
+            try:
+                answer = self.storage.load_answer(user_id, answer_id)
+            except Exception as e:
+                # Ответ остается в хранилище, можно повторить позже
+                logger.error(f"❌ Не удалось загрузить ответ {answer_id} пользователя {user_id}: {e}")
+                return None
+            user.stored_answers.discard(answer_id)
+            if answer is not None:
+                metrics.inc('context.full_answers_restored')
+        else:
+            answer = self.answer_cache.restore(user_id, answer_id)
+        if answer is not None:
+            user.full_answers[answer_id] = answer
+            self.answer_cache.add(user_id, answer_id, answer)
+        return answer
     
     def get_context_count(self, user_id: int) -> int:
         """Возвращает количество сообщений в контексте пользователя (старая логика)"""
@@ -92,6 +285,8 @@ class ContextManager:
         """Начинает новый чат с резюме предыдущего диалога"""
         user = self.get_user(user_id)
         user.start_new_chat_with_summary(summary)
+        self.answer_cache.forget_user(user_id, drop_spilled=True)
+        self._persist(user_id)
         logger.info(f"Начат новый чат с резюме для пользователя {user_id}")
     
     def get_limit_info_text(self, user_id: int) -> str:
@@ -11,6 +11,116 @@ from config import Config
 
 logger = logging.getLogger(__name__)
 
+class _MarkdownState:
+    """
+    Сводка строки для проверки безопасной точки разбиения.
+    
+    Хранит четность Markdown-символов, длины серий '*' по краям и два последних
+    символа, поэтому состояние склейки двух строк вычисляется за O(1),
+    без повторного подсчета по всей накопленной части сообщения.
+    """
+    
+    __slots__ = ('length', 'stars', 'pairs', 'backticks', 'underscores', 'lead_run', 'trail_run', 'tail')
+    
+    def __init__(self, length=0, stars=0, pairs=0, backticks=0, underscores=0,
+                 lead_run=0, trail_run=0, tail=""):
+        self.length = length
+        self.stars = stars
+        self.pairs = pairs  # количество '**' при подсчете слева направо (как str.count)
+        self.backticks = backticks
+        self.underscores = underscores
+        self.lead_run = lead_run  # длина серии '*' в начале строки
+        self.trail_run = trail_run  # длина серии '*' в конце строки
+        self.tail = tail  # два последних символа
+    
+    @classmethod
+    def of(cls, text: str) -> '_MarkdownState':
+        """Вычисляет состояние строки за один проход"""
+        length = len(text)
+        stars = text.count('*')
+        if stars:
+            pairs = text.count('**')
+            lead_run = length - len(text.lstrip('*')) if text[0] == '*' else 0
+            trail_run = length - len(text.rstrip('*')) if text[-1] == '*' else 0
+        else:
+            pairs = lead_run = trail_run = 0
+        return cls(length, stars, pairs, text.count('`'), text.count('_'), lead_run, trail_run, text[-2:])
+    
+    def joined(self, separator: str, other: '_MarkdownState') -> '_MarkdownState':
+        """Состояние строки self + separator + other (separator без символов разметки)"""
+        if not self.length:
+            if not separator:
+                return other
+            return _MarkdownState(len(separator), 0, 0, 0, 0, 0, 0, separator[-2:]).joined('', other)
+        
+        pairs = self.pairs + other.pairs
+        if separator or not other.length:
+            lead_run = self.lead_run
+            trail_run = other.trail_run if other.length else (0 if separator else self.trail_run)
+        else:
+            # Серии '*' на стыке сливаются: str.count('**') считает их как одну серию
+            merged = self.trail_run + other.lead_run
+            pairs += merged // 2 - self.trail_run // 2 - other.lead_run // 2
+            self_all_stars = self.lead_run == self.length
+            other_all_stars = other.lead_run == other.length
+            lead_run = self.length + other.lead_run if self_all_stars else self.lead_run
+            trail_run = self.trail_run + other.length if other_all_stars else other.trail_run
+        
+        tail = other.tail
+        if len(tail) < 2:
+            tail = (self.tail + separator + tail)[-2:]
+        
+        return _MarkdownState(
+            self.length + len(separator) + other.length,
+            self.stars + other.stars,
+            pairs,
+            self.backticks + other.backticks,
+            self.underscores + other.underscores,
+            lead_run,
+            trail_run,
+            tail
+        )
+    
+    def tag_counts(self) -> dict:
+        """Четность открытых Markdown тегов (формат _count_markdown_tags)"""
+        return {
+            '**': self.pairs % 2,  # bold
+            '*': (self.stars - self.pairs * 2) % 2,  # italic
+            '`': self.backticks % 2,  # code
+            '_': self.underscores % 2,  # underline
+        }
+    
+    def is_safe(self) -> bool:
+        """Все теги закрыты и строка не обрывается посередине слова"""
+        if self.tail and not self.tail[-1].isspace() and self.tail[-1] not in '.!?,:;':
+            if self.length > 1 and self.tail.isalnum():
+                return False
+        
+        return (self.pairs % 2 == 0 and self.stars % 2 == 0 and
+                self.backticks % 2 == 0 and self.underscores % 2 == 0)
+
+
+class _Chunk:
+    """Накапливаемая часть сообщения: фрагменты склеиваются только при выдаче"""
+    
+    __slots__ = ('pieces', 'state')
+    
+    def __init__(self, text: str = "", state: _MarkdownState = None):
+        self.pieces = [text] if text else []
+        self.state = state if state is not None else _MarkdownState.of(text)
+    
+    def append(self, separator: str, piece: str, state: _MarkdownState):
+        """Добавляет фрагмент; state - уже вычисленное состояние результата"""
+        if separator:
+            self.pieces.append(separator)
+        if piece:
+            self.pieces.append(piece)
+        self.state = state
+    
+    def text(self) -> str:
+        return ''.join(self.pieces)
+
+
 class MessageSplitter:
     """Класс для умной разбивки длинных сообщений"""
     
@@ -21,6 +131,9 @@ class MessageSplitter:
         """
         Основной метод разбивки длинного сообщения на части с сохранением Markdown и абзацев
         
+        Работает за линейное время: каждый фрагмент просматривается один раз,
+        а проверка разметки для склейки использует накопленное состояние.
+        
         Args:
             text: Текст для разбивки
             
@@ -31,63 +144,56 @@ class MessageSplitter:
             return [text]
         
         # Разбиваем по абзацам (двойной перенос строки)
-        paragraphs = text.split('\n\n')
         parts = []
-        current_message = ""
+        current = _Chunk()
         
-        for paragraph in paragraphs:
-            test_message = current_message + ('\n\n' if current_message else '') + paragraph
+        for paragraph in text.split('\n\n'):
+            paragraph_state = _MarkdownState.of(paragraph)
+            separator = '\n\n' if current.state.length else ''
+            test_state = current.state.joined(separator, paragraph_state)
             
-            if len(test_message) <= self.max_length and self._is_safe_split_point(test_message):
+            if test_state.length <= self.max_length and test_state.is_safe():
                 # Абзац помещается - добавляем к текущему сообщению
-                current_message = test_message
+                current.append(separator, paragraph, test_state)
+                continue
+            
+            # Абзац не помещается - сохраняем текущее сообщение
+            self._flush(current, parts)
+            
+            # Обрабатываем текущий абзац
+            if paragraph_state.length <= self.max_length and paragraph_state.is_safe():
+                current = _Chunk(paragraph, paragraph_state)
             else:
-                # Абзац не помещается - сохраняем текущее сообщение
-                if current_message.strip():
-                    parts.append(current_message.strip())
+                # Абзац нужно разбить на части
+                paragraph_parts = self._split_paragraph(paragraph)
                 
-                # Обрабатываем текущий абзац
-                if len(paragraph) <= self.max_length and self._is_safe_split_point(paragraph):
-                    current_message = paragraph
-                else:
-                    # Абзац нужно разбить на части
-                    paragraph_parts = self._split_paragraph(paragraph)
-                    
-                    # Добавляем все части абзаца, кроме последней
-                    for part in paragraph_parts[:-1]:
-                        if part.strip():
-                            parts.append(part.strip())
-                    
-                    # Последняя часть становится началом нового сообщения
-                    current_message = paragraph_parts[-1] if paragraph_parts else ""
+                # Добавляем все части абзаца, кроме последней
+                for part in paragraph_parts[:-1]:
+                    if part.strip():
+                        parts.append(part.strip())
+                
+                # Последняя часть становится началом нового сообщения
+                current = _Chunk(paragraph_parts[-1] if paragraph_parts else "")
         
         # Добавляем последнее сообщение
-        if current_message.strip():
-            parts.append(current_message.strip())
+        self._flush(current, parts)
         
-        return self._finalize_parts(parts)
+        return self._finalize_parts(parts, text)
+    
+    @staticmethod
+    def _flush(chunk: _Chunk, parts: List[str]):
+        """Добавляет накопленную часть в результат, если она не пустая"""
+        message = chunk.text().strip()
+        if message:
+            parts.append(message)
     
     def _count_markdown_tags(self, text: str) -> dict:
         """Подсчитывает открытые/закрытые Markdown теги"""
-        counts = {
-            '**': text.count('**') % 2,  # bold
-            '*': (text.count('*') - text.count('**') * 2) % 2,  # italic  
-            '`': text.count('`') % 2,  # code
-            '_': text.count('_') % 2,  # underline
-        }
-        return counts
+        return _MarkdownState.of(text).tag_counts()
     
     def _is_safe_split_point(self, text: str) -> bool:
         """Проверяет, безопасно ли разбивать текст в этой точке (все теги закрыты)"""
-        counts = self._count_markdown_tags(text)
-        all_tags_closed = all(count == 0 for count in counts.values())
-        
-        # Дополнительная проверка - текст не должен заканчиваться посередине слова
-        if text and not text[-1].isspace() and text[-1] not in '.!?,:;':
-            if len(text) > 1 and text[-2:].isalnum():
-                return False
-        
-        return all_tags_closed
+        return _MarkdownState.of(text).is_safe()
     
     def _split_paragraph(self, paragraph: str) -> List[str]:
         """Разбивает абзац на части по предложениям"""
@@ -95,57 +201,56 @@ class MessageSplitter:
             return [paragraph]
         
         parts = []
-        current_part = ""
+        current = _Chunk()
         
         # Разбиваем по предложениям
         sentences = re.split(r'([.!?]+\s)', paragraph)
         
         for sentence in sentences:
-            test_part = current_part + sentence
+            sentence_state = _MarkdownState.of(sentence)
+            test_state = current.state.joined('', sentence_state)
             
-            if len(test_part) <= self.max_length and self._is_safe_split_point(test_part):
-                current_part = test_part
+            if test_state.length <= self.max_length and test_state.is_safe():
+                current.append('', sentence, test_state)
+                continue
+            
+            # Сохраняем текущую часть
+            self._flush(current, parts)
+            
+            # Если предложение слишком длинное, разбиваем по словам
+            if len(sentence) > self.max_length:
+                word_parts = self._split_by_words(sentence)
+                parts.extend(word_parts[:-1])
+                current = _Chunk(word_parts[-1] if word_parts else "")
             else:
-                # Сохраняем текущую часть
-                if current_part.strip():
-                    parts.append(current_part.strip())
-                
-                # Если предложение слишком длинное, разбиваем по словам
-                if len(sentence) > self.max_length:
-                    word_parts = self._split_by_words(sentence)
-                    parts.extend(word_parts[:-1])
-                    current_part = word_parts[-1] if word_parts else ""
-                else:
-                    current_part = sentence
+                current = _Chunk(sentence, sentence_state)
         
         # Добавляем последнюю часть
-        if current_part.strip():
-            parts.append(current_part.strip())
+        self._flush(current, parts)
         
         return parts
     
     def _split_by_words(self, text: str) -> List[str]:
         """Разбивает текст по словам когда предложения слишком длинные"""
         parts = []
-        words = text.split(' ')
-        current_part = ""
+        current = _Chunk()
         
-        for word in words:
-            test_part = current_part + (' ' if current_part else '') + word
+        for word in text.split(' '):
+            word_state = _MarkdownState.of(word)
+            separator = ' ' if current.state.length else ''
+            test_state = current.state.joined(separator, word_state)
             
-            if len(test_part) <= self.max_length and self._is_safe_split_point(test_part):
-                current_part = test_part
+            if test_state.length <= self.max_length and test_state.is_safe():
+                current.append(separator, word, test_state)
             else:
-                if current_part.strip():
-                    parts.append(current_part.strip())
-                current_part = word
+                self._flush(current, parts)
+                current = _Chunk(word, word_state)
         
-        if current_part.strip():
-            parts.append(current_part.strip())
+        self._flush(current, parts)
         
         return parts
     
-    def _finalize_parts(self, parts: List[str]) -> List[str]:
+    def _finalize_parts(self, parts: List[str], text: str = "") -> List[str]:
         """Финальная проверка и очистка частей"""
         final_parts = []
         
@@ -214,6 +319,25 @@ class MessageUtils:
         splitter = MessageSplitter(max_length)
         return splitter.split(text)
 
+    @staticmethod
+    async def download_bytes(file) -> bytes:
+        """
+        Скачивает файл Telegram в bytes без лишних копий
+
+        download_as_bytearray копирует полученные bytes в новый bytearray,
+        а download_to_memory передает их в write() как есть - сохраняем ссылку.
+        """
+        class _Sink:
+            def __init__(self):
+                self.parts = []
+
+            def write(self, data):
+                self.parts.append(data)
+
+        sink = _Sink()
+        await file.download_to_memory(sink)
+        return sink.parts[0] if len(sink.parts) == 1 else b''.join(sink.parts)
+
     @staticmethod
     async def send_long_message(update: Update, text: str, parse_mode: str = None, reply_markup=None):
         """
@@ -0,0 +1,90 @@
+"""
+Простой реестр метрик бота (счетчики, датчики и выборки задержек).
+"""
+
+import threading
+from collections import defaultdict, deque
+from typing import Callable, Dict, Any
+
+
+class Metrics:
+    """Потокобезопасный реестр метрик процесса"""
+
+    def __init__(self, max_samples: int = 1000):
+        """
+        Инициализация реестра
+
+        Args:
+            max_samples: Сколько последних значений хранить для каждой выборки
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(int)
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+        self._samples: Dict[str, deque] = {}
+
+    def inc(self, name: str, value: float = 1):
+        """Увеличивает счетчик"""
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, getter: Callable[[], Any]):
+        """Регистрирует датчик, значение которого вычисляется при чтении"""
+        with self._lock:
+            self._gauges[name] = getter
+
+    def observe(self, name: str, value: float):
+        """Добавляет значение в выборку (например, задержку в секундах)"""
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.max_samples)
+            samples.append(value)
+
+    def get_counter(self, name: str) -> float:
+        """Возвращает текущее значение счетчика"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    @staticmethod
+    def _percentile(sorted_values, fraction: float) -> float:
+        """Возвращает перцентиль по отсортированной выборке"""
+        index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+        return sorted_values[index]
+
+    def summarize(self, name: str) -> Dict[str, float]:
+        """Возвращает count/p50/p95/max для выборки"""
+        with self._lock:
+            values = sorted(self._samples.get(name, ()))
+        if not values:
+            return {'count': 0}
+        return {
+            'count': len(values),
+            'p50': self._percentile(values, 0.5),
+            'p95': self._percentile(values, 0.95),
+            'max': values[-1]
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает все метрики в виде словаря (для /metrics)"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            sample_names = list(self._samples)
+
+        gauge_values = {}
+        for name, getter in gauges.items():
+            try:
+                gauge_values[name] = getter()
+            except Exception as e:
+                gauge_values[name] = f"error: {e}"
+
+        return {
+            'counters': counters,
+            'gauges': gauge_values,
+            'timings': {name: self.summarize(name) for name in sample_names}
+        }
+
+
+# Общий реестр метрик процесса
+metrics = Metrics()
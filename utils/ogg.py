@@ -0,0 +1,376 @@
+"""
+Разбор и нарезка Ogg/Opus (голосовые сообщения Telegram) без внешних библиотек.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import List
+
+# Opus всегда считает granule position в отсчетах 48 кГц
+OPUS_SAMPLE_RATE = 48000
+
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')  # OggS, версия, флаги, granule, serial, номер, CRC, сегменты
+
+FLAG_CONTINUED = 0x01  # страница продолжает пакет с предыдущей
+FLAG_BOS = 0x02        # первая страница потока
+FLAG_EOS = 0x04        # последняя страница потока
+
+NO_GRANULE = -1  # на странице не заканчивается ни один пакет
+
+class OggError(ValueError):
+    """Данные не являются корректным Ogg/Opus"""
+
+
+def _crc_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+_CRC_TABLE = _crc_table()
+
+def ogg_crc(data: bytes) -> int:
+    """CRC-32 страницы Ogg (полином 0x04C11DB7, без отражения, начальное значение 0)"""
+    crc = 0
+    table = _CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+@dataclass
+class OggPage:
+    """Страница Ogg"""
+    flags: int
+    granule: int
+    serial: int
+    sequence: int
+    lacing: bytes
+    body: memoryview
+
+    @property
+    def continued(self) -> bool:
+        """Страница начинается с продолжения пакета предыдущей страницы"""
+        return bool(self.flags & FLAG_CONTINUED)
+
+    @property
+    def packet_sizes(self) -> List[int]:
+        """Размеры пакетов (и частей пакетов), которые заканчиваются или начинаются на странице"""
+        sizes, size = [], 0
+        for value in self.lacing:
+            size += value
+            if value < 255:
+                sizes.append(size)
+                size = 0
+        if size:
+            sizes.append(size)  # пакет продолжается на следующей странице
+        return sizes
+
+    def write_to(self, out: bytearray):
+        """Дописывает страницу в буфер с пересчитанной контрольной суммой"""
+        start = len(out)
+        out += PAGE_HEADER.pack(b'OggS', 0, self.flags, self.granule, self.serial,
+                                self.sequence, 0, len(self.lacing))
+        out += self.lacing
+        out += self.body
+        view = memoryview(out)
+        crc = ogg_crc(view[start:])
+        view.release()
+        struct.pack_into('<I', out, start + 22, crc)
+
+    def to_bytes(self) -> bytes:
+        """Собирает страницу с пересчитанной контрольной суммой"""
+        out = bytearray()
+        self.write_to(out)
+        return bytes(out)
+
+
+def parse_pages(data: bytes) -> List[OggPage]:
+    """
+    Разбирает поток на страницы
+
+    Тела страниц ссылаются на data (memoryview), поэтому разбор не копирует аудио.
+
+    Raises:
+        OggError: Данные не начинаются с Ogg или страница обрезана
+    """
+    pages = []
+    offset = 0
+    view = memoryview(data)
+    while offset < len(data):
+        if len(data) - offset < PAGE_HEADER.size:
+            raise OggError(f"Обрезанный заголовок страницы на смещении {offset}")
+        capture, version, flags, granule, serial, sequence, _crc, segments = PAGE_HEADER.unpack_from(data, offset)
+        if capture != b'OggS' or version != 0:
+            raise OggError(f"Нет страницы Ogg на смещении {offset}")
+
+        lacing_start = offset + PAGE_HEADER.size
+        body_start = lacing_start + segments
+        lacing = bytes(view[lacing_start:body_start])
+        body_end = body_start + sum(lacing)
+        if body_end > len(data):
+            raise OggError(f"Обрезанная страница на смещении {offset}")
+
+        # Тело страницы - срез исходного буфера, без копирования
+        pages.append(OggPage(flags, granule, serial, sequence, lacing, view[body_start:body_end]))
+        offset = body_end
+    return pages
+
+
+@dataclass
+class OpusHead:
+    """Заголовок потока Opus (RFC 7845, раздел 5.1)"""
+    channels: int
+    pre_skip: int
+    input_sample_rate: int
+
+
+def parse_opus_head(page: OggPage) -> OpusHead:
+    """Читает OpusHead из первой страницы потока"""
+    body = page.body
+    if len(body) < 19 or body[:8] != b'OpusHead':
+        raise OggError("Первая страница не содержит OpusHead")
+    channels = body[9]
+    pre_skip, input_sample_rate = struct.unpack_from('<HI', body, 10)
+    return OpusHead(channels, pre_skip, input_sample_rate)
+
+
+def _header_page_count(pages: List[OggPage]) -> int:
+    """Количество страниц заголовков (OpusHead и OpusTags) в начале потока"""
+    # OpusTags может занимать несколько страниц, его последняя страница имеет granule 0;
+    # аудио всегда начинается с новой страницы
+    count = 1
+    while count < len(pages):
+        count += 1
+        if pages[count - 1].granule == 0:
+            break
+    return count
+
+
+def split_ogg(data: bytes, chunk_seconds: float, overlap_seconds: float = 0.0,
+              max_chunk_bytes: int = 0) -> List[bytes]:
+    """
+    Нарезает Ogg/Opus на самостоятельные потоки по границам страниц
+
+    Каждый кусок начинается с заголовков исходного потока, номера страниц и
+    granule position пересчитываются от начала куска, контрольные суммы
+    пересчитываются. Соседние куски перекрываются примерно на overlap_seconds,
+    чтобы слово на границе попало в оба куска целиком. Резать можно только
+    перед страницей, которая начинается с нового пакета.
+
+    Args:
+        data: Исходный Ogg/Opus
+        chunk_seconds: Максимальная длительность куска
+        overlap_seconds: Перекрытие соседних кусков
+        max_chunk_bytes: Максимальный размер куска (0 - без ограничения)
+
+    Returns:
+        list: Куски в порядке воспроизведения; если резать не нужно - [data] без копирования
+
+    Raises:
+        OggError: Данные не являются Ogg/Opus
+    """
+    pages = parse_pages(data)
+    if not pages:
+        raise OggError("Пустой поток")
+    head = parse_opus_head(pages[0])
+    header_count = _header_page_count(pages)
+    headers, audio = pages[:header_count], pages[header_count:]
+    if not audio:
+        return [data]
+
+    # Время конца каждой страницы (для страниц без законченного пакета - как у предыдущей)
+    granules: List[int] = []
+    last_granule = 0
+    for page in audio:
+        if page.granule != NO_GRANULE:
+            last_granule = page.granule
+        granules.append(last_granule)
+    ends = [max(0, granule - head.pre_skip) / OPUS_SAMPLE_RATE for granule in granules]
+    starts = [0.0] + ends[:-1]
+
+    headers_size = sum(len(page.lacing) + len(page.body) + PAGE_HEADER.size for page in headers)
+    cut_points = [i for i, page in enumerate(audio) if not page.continued]
+
+    # Сначала определяются границы кусков: если кусок один, поток не пересобирается
+    ranges = []
+    start = 0
+    while start < len(audio):
+        # Последняя страница куска: укладываемся в длительность и размер, но минимум одна
+        end = start
+        size = headers_size
+        for i in range(start, len(audio)):
+            page_size = PAGE_HEADER.size + len(audio[i].lacing) + len(audio[i].body)
+            too_long = ends[i] - starts[start] > chunk_seconds
+            too_big = max_chunk_bytes and size + page_size > max_chunk_bytes
+            if i > start and (too_long or too_big):
+                break
+            size += page_size
+            end = i
+        # Кусок должен заканчиваться перед точкой разреза, иначе пакет окажется разорван
+        if end + 1 < len(audio):
+            allowed = [point for point in cut_points if start < point <= end + 1]
+            if allowed:
+                end = allowed[-1] - 1
+            else:
+                # Пакет длиннее куска - продлеваем кусок до ближайшей точки разреза
+                end = next((point for point in cut_points if point > end), len(audio)) - 1
+
+        ranges.append((start, end))
+        if end + 1 >= len(audio):
+            break
+
+        # Следующий кусок начинается с перекрытием, но обязательно дальше текущего начала
+        overlap_from = ends[end] - overlap_seconds
+        start = min(
+            (point for point in cut_points if start < point <= end + 1 and starts[point] >= overlap_from),
+            default=end + 1
+        )
+
+    if len(ranges) == 1:
+        return [data]
+    return [_build_chunk(headers, audio[start:end + 1], granules[start - 1] if start else 0)
+            for start, end in ranges]
+
+
+def _build_chunk(headers: List[OggPage], pages: List[OggPage], base_granule: int) -> bytes:
+    """Собирает самостоятельный поток из заголовков и страниц аудио"""
+    out = bytearray()
+    sequence = 0
+    for page in headers:
+        OggPage(page.flags & ~FLAG_EOS, page.granule, page.serial, sequence,
+                page.lacing, page.body).write_to(out)
+        sequence += 1
+    for i, page in enumerate(pages):
+        flags = page.flags & ~(FLAG_EOS | FLAG_BOS)
+        if i == len(pages) - 1:
+            flags |= FLAG_EOS
+        # Granule отсчитывается от начала куска (декодер отбросит pre_skip отсчетов, их покрывает перекрытие)
+        granule = page.granule if page.granule == NO_GRANULE else page.granule - base_granule
+        OggPage(flags, granule, page.serial, sequence, page.lacing, page.body).write_to(out)
+        sequence += 1
+    return bytes(out)
+
+
+def duration_seconds(pages: List[OggPage], pre_skip: int) -> float:
+    """Длительность потока по granule position последней страницы"""
+    for page in reversed(pages):
+        if page.granule not in (NO_GRANULE, 0):
+            return max(0, page.granule - pre_skip) / OPUS_SAMPLE_RATE
+    return 0.0
+
+
+# Длительность кадра Opus по номеру конфигурации из TOC-байта (RFC 6716, раздел 3.1), в отсчетах 48 кГц
+_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3 +  # SILK NB/MB/WB: 10, 20, 40, 60 мс
+    [480, 960] * 2 +              # Hybrid SWB/FB: 10, 20 мс
+    [120, 240, 480, 960] * 4      # CELT: 2.5, 5, 10, 20 мс
+)
+
+# Пакет тише этого (байт на 20 мс, ~4 кбит/с) - тишина или фон: речь кодируется заметно крупнее
+QUIET_BYTES_PER_20MS = 10
+# Запись считается тишиной, если тихих пакетов не меньше этой доли
+SILENT_RATIO = 0.95
+# Записи короче этого (секунды) считаются пустыми
+MIN_SPEECH_SECONDS = 0.3
+
+def packet_samples(packet: bytes) -> int:
+    """Длительность пакета Opus в отсчетах 48 кГц по его TOC-байту"""
+    if not packet:
+        return 0
+    toc = packet[0]
+    frame = _FRAME_SAMPLES[toc >> 3]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame * frames
+
+
+def iter_packets(pages: List[OggPage]):
+    """Собирает пакеты из страниц (с учетом пакетов, разорванных между страницами)"""
+    pending = b''
+    for page in pages:
+        offset = 0
+        size = 0
+        for value in page.lacing:
+            size += value
+            if value < 255:
+                packet = page.body[offset:offset + size]
+                yield pending + bytes(packet) if pending else packet
+                pending = b''
+                offset += size
+                size = 0
+        if size:
+            pending += bytes(page.body[offset:offset + size])
+
+
+@dataclass
+class OpusInfo:
+    """Параметры голосового сообщения, полученные без декодирования"""
+    duration: float
+    bitrate: int
+    channels: int
+    packets: int
+    quiet_ratio: float
+
+    @property
+    def silent(self) -> bool:
+        """Пустая запись или запись без речи"""
+        return self.duration < MIN_SPEECH_SECONDS or self.quiet_ratio >= SILENT_RATIO
+
+    @property
+    def quality(self) -> str:
+        """Грубая оценка качества по битрейту и доле тишины"""
+        if self.silent:
+            return "poor"
+        if self.bitrate >= 24000:
+            return "excellent" if self.quiet_ratio < 0.5 else "good"
+        if self.bitrate >= 12000:
+            return "good"
+        return "fair"
+
+
+def analyze_opus(data: bytes) -> OpusInfo:
+    """
+    Разбирает голосовое сообщение без сети и без декодирования
+
+    Длительность - по granule position последней страницы (точная, в отличие
+    от voice.duration из Telegram), битрейт - по объему пакетов, тишина - по
+    доле пакетов, которые меньше QUIET_BYTES_PER_20MS на 20 мс звука.
+
+    Raises:
+        OggError: Данные не являются Ogg/Opus
+    """
+    pages = parse_pages(data)
+    if not pages:
+        raise OggError("Пустой поток")
+    head = parse_opus_head(pages[0])
+    audio = pages[_header_page_count(pages):]
+
+    duration = duration_seconds(audio, head.pre_skip)
+    payload = 0
+    packets = 0
+    quiet = 0
+    for packet in iter_packets(audio):
+        samples = packet_samples(packet)
+        if not samples:
+            continue
+        packets += 1
+        payload += len(packet)
+        if len(packet) * 960 / samples < QUIET_BYTES_PER_20MS:
+            quiet += 1
+
+    return OpusInfo(
+        duration=duration,
+        bitrate=int(payload * 8 / duration) if duration else 0,
+        channels=head.channels,
+        packets=packets,
+        quiet_ratio=quiet / packets if packets else 1.0
+    )
@@ -0,0 +1,143 @@
+"""
+Потоковый вывод ответа через редактирование сообщения.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter
+from config import Config
+from utils.messages import MessageUtils
+
+logger = logging.getLogger(__name__)
+
+class ChatEditThrottler:
+    """Ограничивает частоту редактирования сообщений в каждом чате"""
+
+    # Telegram допускает не более ~20 сообщений в минуту в группах
+    GROUP_MIN_INTERVAL = 3.0
+
+    def __init__(self, min_interval: float = None):
+        """
+        Args:
+            min_interval: Минимальный интервал между правками в личном чате (секунды)
+        """
+        self.min_interval = Config.STREAM_EDIT_INTERVAL if min_interval is None else min_interval
+        self._next_allowed: Dict[int, float] = {}
+
+    def _interval(self, chat_id: int) -> float:
+        """Интервал для чата (группы и каналы имеют отрицательный ID)"""
+        if chat_id < 0:
+            return max(self.min_interval, self.GROUP_MIN_INTERVAL)
+        return self.min_interval
+
+    def ready(self, chat_id: int) -> bool:
+        """Можно ли редактировать сообщение в чате прямо сейчас"""
+        return time.monotonic() >= self._next_allowed.get(chat_id, 0)
+
+    def mark(self, chat_id: int):
+        """Отмечает выполненное редактирование (не сокращая отсрочку из delay)"""
+        self._next_allowed[chat_id] = max(self._next_allowed.get(chat_id, 0), time.monotonic() + self._interval(chat_id))
+
+    def delay(self, chat_id: int, seconds: float):
+        """Откладывает следующее редактирование (например, после RetryAfter)"""
+        self._next_allowed[chat_id] = max(self._next_allowed.get(chat_id, 0), time.monotonic() + seconds)
+
+    async def wait(self, chat_id: int):
+        """Ждет, пока редактирование в чате снова станет разрешено"""
+        remaining = self._next_allowed.get(chat_id, 0) - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+
+class StreamingReply:
+    """Сообщение, которое постепенно дополняется по мере генерации ответа"""
+
+    CURSOR = " ▌"
+
+    def __init__(self, message, throttler: ChatEditThrottler):
+        """
+        Args:
+            message: Сообщение-заглушка ("🦉 Уху..."), которое будет редактироваться
+            throttler: Ограничитель частоты правок
+        """
+        self.message = message
+        self.throttler = throttler
+        self.chat_id = message.chat_id
+        self._shown_text = None
+
+    def _preview(self, text: str) -> str:
+        """Текст промежуточной правки: без разметки и не длиннее лимита"""
+        if len(text) > Config.MESSAGE_CUT_LENGTH:
+            return text[:Config.MESSAGE_CUT_LENGTH] + " …"
+        return text + self.CURSOR
+
+    async def _edit(self, text: str, parse_mode: str = None, reply_markup=None):
+        """Редактирует сообщение с учетом ограничений Telegram"""
+        try:
+            await self.message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+            self._shown_text = text
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logger.warning(f"⏳ Telegram просит подождать {retry_after}s перед правкой")
+            self.throttler.delay(self.chat_id, retry_after)
+            raise
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+        finally:
+            self.throttler.mark(self.chat_id)
+
+    async def update(self, text: str):
+        """Показывает промежуточный текст, если лимит правок позволяет"""
+        if not text.strip() or not self.throttler.ready(self.chat_id):
+            return
+
+        preview = self._preview(text)
+        if preview == self._shown_text:
+            return
+
+        try:
+            await self._edit(preview)
+        except RetryAfter:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка промежуточной правки сообщения: {e}")
+
+    async def finalize(self, update: Update, text: str, parse_mode: str = 'Markdown', reply_markup=None):
+        """
+        Показывает окончательный ответ
+
+        Короткий ответ заменяет текст заглушки, длинный отправляется частями
+        через MessageSplitter, а заглушка удаляется.
+        """
+        if len(text) > Config.MESSAGE_LENGTH_LIMIT:
+            await self.message.delete()
+            await MessageUtils.safe_send_message(update, text, parse_mode, reply_markup)
+            return
+
+        for attempt in range(2):
+            await self.throttler.wait(self.chat_id)
+            try:
+                await self._edit(text, parse_mode, reply_markup)
+                return
+            except RetryAfter:
+                continue
+            except BadRequest as e:
+                if "can't parse entities" in str(e).lower():
+                    logger.warning(f"Ошибка парсинга Markdown, показываю без разметки: {e}")
+                    parse_mode = None
+                    continue
+                break
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка финальной правки сообщения: {e}")
+                break
+
+        # Не удалось отредактировать - отправляем ответ новым сообщением
+        try:
+            await self.message.delete()
+        except Exception as delete_error:
+            logger.warning(f"⚠️ Ошибка удаления сообщения: {delete_error}")
+        await MessageUtils.safe_send_message(update, text, parse_mode, reply_markup)
@@ -0,0 +1,29 @@
+"""
+Быстрая локальная оценка количества токенов (без запросов к API).
+"""
+
+# Средняя длина токена Gemini в символах: латиница и цифры кодируются
+# крупнее, кириллица и прочие не-ASCII символы - мельче
+ASCII_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.5
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает количество токенов в тексте
+
+    Точность порядка ±20% - достаточно для бюджета контекста и логов.
+    Работает за один проход кодирования в C, без токенизатора.
+
+    Args:
+        text: Текст
+
+    Returns:
+        int: Примерное количество токенов
+    """
+    if not text:
+        return 0
+
+    # Кириллица занимает 2 байта в UTF-8, поэтому лишние байты ~ не-ASCII символы
+    other = min(len(text.encode('utf-8')) - len(text), len(text))
+    ascii_chars = len(text) - other
+    return int(ascii_chars / ASCII_CHARS_PER_TOKEN + other / OTHER_CHARS_PER_TOKEN) + 1
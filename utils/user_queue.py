@@ -0,0 +1,103 @@
+"""
+Последовательная обработка сообщений каждого пользователя с объединением быстрых серий.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from config import Config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class QueuedJob:
+    """Обработка одного апдейта (или серии объединенных текстовых сообщений)"""
+    handler: Callable[..., Awaitable[Any]]
+    args: tuple
+    texts: Optional[List[str]] = None  # Для объединяемых текстовых сообщений
+    ready_at: float = field(default_factory=time.monotonic)
+
+class UserWorkQueue:
+    """
+    Очередь апдейтов каждого пользователя: обрабатываются по одному, в порядке поступления
+    
+    Так ответы не читают один и тот же устаревший контекст и не перемешивают записи
+    в историю, а один пользователь не занимает несколько слотов Gemini сразу.
+    Если задано окно coalesce_window, текстовые сообщения, пришедшие подряд
+    в пределах окна, объединяются в один вопрос (один запрос к модели).
+    """
+
+    def __init__(self, coalesce_window: float = None):
+        """
+        Args:
+            coalesce_window: Окно объединения текстовых сообщений в секундах (0 - без объединения)
+        """
+        self.coalesce_window = Config.MESSAGE_COALESCE_WINDOW if coalesce_window is None else coalesce_window
+        self._queues: Dict[int, Deque[QueuedJob]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        
+        metrics.set_gauge('user_queue.users', lambda: len(self._workers))
+        metrics.set_gauge('user_queue.pending', lambda: sum(len(queue) for queue in self._queues.values()))
+
+    def submit(self, user_id: int, handler: Callable[..., Awaitable[Any]], *args):
+        """Ставит обработку апдейта в очередь пользователя"""
+        self._enqueue(user_id, QueuedJob(handler, args))
+
+    def submit_text(self, user_id: int, handler: Callable[..., Awaitable[Any]], text: str, *args):
+        """
+        Ставит в очередь текстовое сообщение; handler(*args, text) вызывается с объединенным текстом
+        
+        Сообщение присоединяется к предыдущему, если то еще ждет окончания окна объединения.
+        """
+        if self.coalesce_window <= 0:
+            self._enqueue(user_id, QueuedJob(handler, args, [text]))
+            return
+        
+        queue = self._queues.get(user_id)
+        ready_at = time.monotonic() + self.coalesce_window
+        # Выполняемая задача уже снята с очереди - в ней только ожидающие
+        last = queue[-1] if queue else None
+        if last is not None and last.texts is not None and last.handler == handler:
+            last.texts.append(text)
+            last.args = args  # Ответ придет на последнее сообщение серии
+            last.ready_at = ready_at
+            metrics.inc('user_queue.coalesced')
+            logger.info(f"🧩 Сообщение пользователя {user_id} объединено с предыдущими ({len(last.texts)})")
+            return
+        self._enqueue(user_id, QueuedJob(handler, args, [text], ready_at))
+
+    def _enqueue(self, user_id: int, job: QueuedJob):
+        self._queues.setdefault(user_id, deque()).append(job)
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._work(user_id))
+
+    async def _work(self, user_id: int):
+        """Выполняет задачи пользователя по одной, пока очередь не опустеет"""
+        queue = self._queues[user_id]
+        try:
+            while queue:
+                job = queue[0]
+                # Окно объединения продлевается с каждым новым сообщением серии
+                while (remaining := job.ready_at - time.monotonic()) > 0:
+                    await asyncio.sleep(remaining)
+                queue.popleft()
+                
+                try:
+                    if job.texts is None:
+                        await job.handler(*job.args)
+                    else:
+                        await job.handler(*job.args, "\n".join(job.texts))
+                except Exception as e:
+                    logger.error(f"Ошибка обработки сообщения пользователя {user_id}: {e}")
+        finally:
+            del self._workers[user_id]
+            del self._queues[user_id]
+
+    async def join(self):
+        """Дожидается обработки всех поставленных в очередь сообщений (при остановке бота)"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)